@@ -30,6 +30,79 @@ ADMIN_CHAT_ID = os.environ.get("ADMIN_CHAT_ID")  # Telegram chat ID for alerts
 MONGO_URI = os.environ.get("MONGO_URI")  # mongodb+srv://...
 
 
+def _env_flag(name, default="false"):
+    return os.environ.get(name, default).lower() in ("true", "1", "yes")
+
+
+# Webhook processing
+# מצב אסינכרוני: ה-webhook מכניס את העדכון לתור ומחזיר תשובה מיד
+WEBHOOK_ASYNC_MODE = _env_flag("WEBHOOK_ASYNC_MODE")
+WEBHOOK_WORKERS = int(os.environ.get("WEBHOOK_WORKERS", 4))
+WEBHOOK_QUEUE_SIZE = int(os.environ.get("WEBHOOK_QUEUE_SIZE", 1000))
+# במצב סינכרוני: הקריאה הראשונה ל-Bot API חוזרת בתשובת ה-webhook עצמה.
+# כבוי כברירת מחדל - טלגרם לא מדווח על כישלון של קריאה כזו
+WEBHOOK_INLINE_REPLY = _env_flag("WEBHOOK_INLINE_REPLY")
+
+# לקוח Bot API משותף (connection pool ל-api.telegram.org)
+TELEGRAM_POOL_SIZE = int(os.environ.get("TELEGRAM_POOL_SIZE", 20))
+TELEGRAM_CONNECT_TIMEOUT = float(os.environ.get("TELEGRAM_CONNECT_TIMEOUT", 3.05))
+TELEGRAM_READ_TIMEOUT = float(os.environ.get("TELEGRAM_READ_TIMEOUT", 10))
+
+# הגבלת קצב שליחה יוצא (טלגרם: ~30 הודעות/שנייה לבוט, 1/שנייה לצ'אט, 20/דקה לקבוצה).
+# כבוי כברירת מחדל - כשמופעל, sendMessage ו-answerCallbackQuery נכנסים לתור ונשלחים
+# ברקע (אסינכרוני), ומחיקה / באן / השתקה עוברות באותו תור וממתינות לתשובה
+OUTBOUND_RATE_LIMIT = _env_flag("OUTBOUND_RATE_LIMIT")
+OUTBOUND_BOT_RATE = float(os.environ.get("OUTBOUND_BOT_RATE", 30))
+OUTBOUND_CHAT_RATE = float(os.environ.get("OUTBOUND_CHAT_RATE", 1))
+OUTBOUND_GROUP_RATE_PER_MIN = float(os.environ.get("OUTBOUND_GROUP_RATE_PER_MIN", 20))
+OUTBOUND_SENDERS = int(os.environ.get("OUTBOUND_SENDERS", 2))
+
+# מטמון bot_registry - כל כמה שניות לשלוף בוטים שנרשמו ב-workers אחרים
+REGISTRY_REFRESH_SECONDS = int(os.environ.get("REGISTRY_REFRESH_SECONDS", 30))
+
+# סינון עדכונים כפולים (redeliveries של טלגרם): memory / mongo / off
+UPDATE_DEDUP_BACKEND = os.environ.get("UPDATE_DEDUP_BACKEND", "memory").lower()
+UPDATE_DEDUP_WINDOW = int(os.environ.get("UPDATE_DEDUP_WINDOW", 3600))
+UPDATE_DEDUP_MAX_SIZE = int(os.environ.get("UPDATE_DEDUP_MAX_SIZE", 10000))
+
+# קטלוג פלאגינים - מעקב אחרי תיקיית plugins: auto (inotify, אחרת polling) / inotify / poll / off
+PLUGIN_WATCH_MODE = os.environ.get("PLUGIN_WATCH_MODE", "auto").lower()
+PLUGIN_POLL_SECONDS = float(os.environ.get("PLUGIN_POLL_SECONDS", 5))
+
+# מודולים של בוטים רשומים בזיכרון - מקסימום מודולים ופליטה אחרי חוסר פעילות (שניות, 0 = ללא)
+TENANT_PLUGIN_CACHE_SIZE = int(os.environ.get("TENANT_PLUGIN_CACHE_SIZE", 200))
+TENANT_PLUGIN_IDLE_SECONDS = int(os.environ.get("TENANT_PLUGIN_IDLE_SECONDS", 1800))
+
+# מטמון bot_states לכל (בוט, משתמש) - תמיד בתוך עדכון אחד; STATE_CACHE_TTL > 0 שומר
+# גם בין עדכונים (שניות) ומתאים רק ל-worker יחיד
+STATE_CACHE_TTL = int(os.environ.get("STATE_CACHE_TTL", 0))
+STATE_CACHE_MAX_USERS = int(os.environ.get("STATE_CACHE_MAX_USERS", 10000))
+
+# מטמון רשימת האדמינים לכל (בוט, צ'אט) - מתרענן אחרי TTL ובעדכוני chat_member
+ADMIN_CACHE_TTL = int(os.environ.get("ADMIN_CACHE_TTL", 300))
+ADMIN_CACHE_MAX_CHATS = int(os.environ.get("ADMIN_CACHE_MAX_CHATS", 10000))
+
+# ספירת משתמשים ייחודיים (dashboard ו-/stats) - HyperLogLog לפי סטיית תקן מבוקשת,
+# ומדויק כל עוד בכל יום בחלון יש פחות מ-UNIQUE_USERS_EXACT_LIMIT משתמשים
+UNIQUE_USERS_ERROR = float(os.environ.get("UNIQUE_USERS_ERROR", 0.02))
+UNIQUE_USERS_EXACT_LIMIT = int(os.environ.get("UNIQUE_USERS_EXACT_LIMIT", 1000))
+
+# מטמון תשובות /api/funnel* - memory (לכל worker) / mongo (משותף ל-workers) / off
+API_CACHE_BACKEND = os.environ.get("API_CACHE_BACKEND", "memory").lower()
+API_CACHE_TTL = int(os.environ.get("API_CACHE_TTL", 60))
+API_CACHE_MAX_SIZE = int(os.environ.get("API_CACHE_MAX_SIZE", 256))
+
+# ערך state שגודלו (בבתים) מעל הסף נשמר ב-GridFS ונטען רק כשצריך (0 = כבוי)
+STATE_OFFLOAD_BYTES = int(os.environ.get("STATE_OFFLOAD_BYTES", 262144))
+
+# כתיבה מרוכזת של user_actions (write-behind) - לפי גודל batch או זמן
+ANALYTICS_BATCH_SIZE = int(os.environ.get("ANALYTICS_BATCH_SIZE", 200))
+ANALYTICS_FLUSH_SECONDS = float(os.environ.get("ANALYTICS_FLUSH_SECONDS", 2))
+ANALYTICS_MAX_BUFFER = int(os.environ.get("ANALYTICS_MAX_BUFFER", 10000))
+# כשהבאפר מלא: drop_oldest / drop_newest
+ANALYTICS_OVERFLOW = os.environ.get("ANALYTICS_OVERFLOW", "drop_oldest").lower()
+
+
 class Config:
     """הגדרות כלליות לדשבורד הבוט"""
     
@@ -67,6 +140,42 @@ class Config:
     # MongoDB
     MONGO_URI = MONGO_URI
 
+    # Webhook processing
+    WEBHOOK_ASYNC_MODE = WEBHOOK_ASYNC_MODE
+    WEBHOOK_WORKERS = WEBHOOK_WORKERS
+    WEBHOOK_QUEUE_SIZE = WEBHOOK_QUEUE_SIZE
+    WEBHOOK_INLINE_REPLY = WEBHOOK_INLINE_REPLY
+    TELEGRAM_POOL_SIZE = TELEGRAM_POOL_SIZE
+    TELEGRAM_CONNECT_TIMEOUT = TELEGRAM_CONNECT_TIMEOUT
+    TELEGRAM_READ_TIMEOUT = TELEGRAM_READ_TIMEOUT
+    OUTBOUND_RATE_LIMIT = OUTBOUND_RATE_LIMIT
+    OUTBOUND_BOT_RATE = OUTBOUND_BOT_RATE
+    OUTBOUND_CHAT_RATE = OUTBOUND_CHAT_RATE
+    OUTBOUND_GROUP_RATE_PER_MIN = OUTBOUND_GROUP_RATE_PER_MIN
+    OUTBOUND_SENDERS = OUTBOUND_SENDERS
+    REGISTRY_REFRESH_SECONDS = REGISTRY_REFRESH_SECONDS
+    UPDATE_DEDUP_BACKEND = UPDATE_DEDUP_BACKEND
+    UPDATE_DEDUP_WINDOW = UPDATE_DEDUP_WINDOW
+    UPDATE_DEDUP_MAX_SIZE = UPDATE_DEDUP_MAX_SIZE
+    PLUGIN_WATCH_MODE = PLUGIN_WATCH_MODE
+    PLUGIN_POLL_SECONDS = PLUGIN_POLL_SECONDS
+    TENANT_PLUGIN_CACHE_SIZE = TENANT_PLUGIN_CACHE_SIZE
+    TENANT_PLUGIN_IDLE_SECONDS = TENANT_PLUGIN_IDLE_SECONDS
+    STATE_CACHE_TTL = STATE_CACHE_TTL
+    STATE_CACHE_MAX_USERS = STATE_CACHE_MAX_USERS
+    STATE_OFFLOAD_BYTES = STATE_OFFLOAD_BYTES
+    ADMIN_CACHE_TTL = ADMIN_CACHE_TTL
+    ADMIN_CACHE_MAX_CHATS = ADMIN_CACHE_MAX_CHATS
+    UNIQUE_USERS_ERROR = UNIQUE_USERS_ERROR
+    UNIQUE_USERS_EXACT_LIMIT = UNIQUE_USERS_EXACT_LIMIT
+    API_CACHE_BACKEND = API_CACHE_BACKEND
+    API_CACHE_TTL = API_CACHE_TTL
+    API_CACHE_MAX_SIZE = API_CACHE_MAX_SIZE
+    ANALYTICS_BATCH_SIZE = ANALYTICS_BATCH_SIZE
+    ANALYTICS_FLUSH_SECONDS = ANALYTICS_FLUSH_SECONDS
+    ANALYTICS_MAX_BUFFER = ANALYTICS_MAX_BUFFER
+    ANALYTICS_OVERFLOW = ANALYTICS_OVERFLOW
+
 
 # Convenience module-level aliases (for engine/app.py usage)
 ENABLED_PLUGINS = Config.ENABLED_PLUGINS
@@ -0,0 +1,130 @@
+"""
+Engine Activation - מטמון סטטוס ההפעלה של בוטים שנוצרו
+כל הודעה לבוט רשום בודקת אם השולח הוא היוצר שמפעיל את הבוט לראשונה.
+המטמון כאן זוכר לכל bot_token_id את ה-flow, היוצר והאם כבר הופעל,
+כך שבוט שהופעל לא עולה אף קריאה ל-MongoDB.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class ActivationEntry:
+    """מצב ההפעלה של בוט אחד כפי שנשמר במטמון."""
+
+    __slots__ = ("flow_id", "creator_id", "activated", "cached_at")
+
+    def __init__(self, flow_id, creator_id, activated, cached_at):
+        self.flow_id = flow_id
+        self.creator_id = creator_id
+        self.activated = activated
+        self.cached_at = cached_at
+
+
+class ActivationCache:
+    """
+    מטמון bot_token_id -> ActivationEntry, מוגבל בגודל (LRU).
+    - בוט שהופעל נשאר במטמון ללא תפוגה (הסטטוס לא חוזר אחורה)
+    - בוט שעוד לא הופעל נבדק מחדש אחרי pending_ttl
+    - בוט בלי flow נזכר כ"אין" למשך negative_ttl
+    """
+
+    def __init__(self, get_db, pending_ttl=300, negative_ttl=60, max_size=10000):
+        """
+        Args:
+            get_db: פונקציה שמחזירה חיבור ל-MongoDB (או None)
+            pending_ttl: כמה זמן לסמוך על flow שעוד לא הופעל (שניות)
+            negative_ttl: כמה זמן לזכור שאין flow לבוט (שניות)
+            max_size: מספר הבוטים המקסימלי במטמון
+        """
+        self._get_db = get_db
+        self._pending_ttl = pending_ttl
+        self._negative_ttl = negative_ttl
+        self._max_size = max(1, int(max_size))
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+        self._hits = 0
+        self._misses = 0
+        self._db_reads = 0
+
+    def get(self, bot_token_id):
+        """
+        מחזיר את מצב ההפעלה של הבוט.
+
+        Returns:
+            ActivationEntry, או None אם אין flow לבוט
+        """
+        now = time.monotonic()
+        with self._lock:
+            if bot_token_id in self._entries:
+                entry = self._entries[bot_token_id]
+                if self._is_fresh(entry, now):
+                    # flow_id None = ידוע שאין flow לבוט
+                    self._entries.move_to_end(bot_token_id)
+                    self._hits += 1
+                    return entry if entry.flow_id is not None else None
+            self._misses += 1
+
+        return self._load(bot_token_id, now)
+
+    def mark_activated(self, bot_token_id):
+        """מסמן שהבוט הופעל - מכאן והלאה אין יותר בדיקות מול ה-DB."""
+        with self._lock:
+            entry = self._entries.get(bot_token_id)
+            if entry is not None:
+                entry.activated = True
+
+    def stats(self):
+        with self._lock:
+            return {
+                "bots": len(self._entries),
+                "activated": sum(1 for entry in self._entries.values() if entry.activated),
+                "hits": self._hits,
+                "misses": self._misses,
+                "db_reads": self._db_reads,
+            }
+
+    # === Internal ===
+
+    def _is_fresh(self, entry, now):
+        if entry.activated:
+            return True
+        ttl = self._pending_ttl if entry.flow_id is not None else self._negative_ttl
+        return now - entry.cached_at < ttl
+
+    def _load(self, bot_token_id, now):
+        db = self._get_db()
+        if db is None:
+            return None
+
+        try:
+            flow_doc = db.bot_flows.find_one(
+                {"bot_token_id": bot_token_id},
+                {"creator_id": 1, "status": 1}
+            )
+        except Exception as e:
+            print(f"⚠️ Failed loading activation status: {e}")
+            return None
+
+        if flow_doc:
+            entry = ActivationEntry(
+                flow_doc["_id"],
+                flow_doc.get("creator_id"),
+                flow_doc.get("status") == "activated",
+                now,
+            )
+        else:
+            # רשומה בלי flow - נשמרת כדי לא לחפש שוב בכל הודעה
+            entry = ActivationEntry(None, None, False, now)
+
+        with self._lock:
+            self._db_reads += 1
+            self._entries[bot_token_id] = entry
+            self._entries.move_to_end(bot_token_id)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+        return entry if entry.flow_id is not None else None
@@ -0,0 +1,139 @@
+"""
+Engine Activity - סיכומים יומיים של user_actions (user_action_rollups)
+כל batch שנכתב ל-user_actions מעדכן מסמך אחד ליום: מספר הפעולות, פילוח לפי
+סוג ו-sketch של המשתמשים הייחודיים. /stats קורא 7 מסמכים קטנים במקום
+$group לפי user_id על שבוע של user_actions.
+החלון הוא ימים קלנדריים (UTC), כמו ב-engine.funnel.
+בהתקנה קיימת backfill_activity_rollups בונה את הסיכומים מ-user_actions פעם
+אחת (עם סימון ב-engine_migrations), לפני שעדכונים חיים נכתבים - כמו ב-funnel.
+"""
+
+from pymongo import UpdateOne
+
+from engine.funnel import day_key, insert_rollup_documents, window_days
+from engine.hll import UniqueCounter
+from engine.migrations import run_once
+
+
+ROLLUPS_COLLECTION = "user_action_rollups"
+# סימון ב-engine_migrations שהסיכומים נבנו מ-user_actions הקיימים
+BACKFILL_MIGRATION = "backfill:user_action_rollups"
+
+_default_unique = UniqueCounter()
+
+
+def record_actions(db, docs, unique=None):
+    """
+    מוסיף לסיכומים היומיים פעולות שנכתבו ל-user_actions.
+
+    Args:
+        db: חיבור ל-MongoDB
+        docs: מסמכי user_actions (עם timestamp, action_type, user_id)
+        unique: UniqueCounter לספירת המשתמשים
+    """
+    unique = unique or _default_unique
+    days = {}
+    for doc in docs:
+        timestamp = doc.get("timestamp")
+        if timestamp is None:
+            continue
+        day = days.setdefault(day_key(timestamp), {"actions": 0, "types": {}, "users": set()})
+        day["actions"] += 1
+        action_type = doc.get("action_type") or "unknown"
+        day["types"][action_type] = day["types"].get(action_type, 0) + 1
+        if doc.get("user_id") is not None:
+            day["users"].add(str(doc["user_id"]))
+
+    operations = []
+    for day, totals in days.items():
+        update = unique.sketch_update(totals["users"])
+        update["$setOnInsert"] = {**update.get("$setOnInsert", {}), "day": day}
+        update["$inc"] = {"actions": totals["actions"]}
+        for action_type, count in totals["types"].items():
+            update["$inc"][f"types.{action_type}"] = count
+        operations.append(UpdateOne({"_id": day}, update, upsert=True))
+        exact = unique.exact_update(day, totals["users"])
+        if exact is not None:
+            operations.append(exact)
+
+    if operations:
+        # ordered - הוספה לרשימה המדויקת מניחה שמסמך היום כבר נוצר
+        db[ROLLUPS_COLLECTION].bulk_write(operations, ordered=True)
+
+
+def get_activity_totals(db, days, unique=None, now=None):
+    """
+    מסכם את מסמכי הימים בחלון.
+
+    Returns:
+        dict: actions, types (סוג -> מספר), unique_users, unique_users_exact
+    """
+    unique = unique or _default_unique
+    docs = list(db[ROLLUPS_COLLECTION].find({"_id": {"$in": window_days(days, now)}}))
+    totals = {"actions": 0, "types": {}}
+    for doc in docs:
+        totals["actions"] += doc.get("actions", 0)
+        for action_type, count in (doc.get("types") or {}).items():
+            totals["types"][action_type] = totals["types"].get(action_type, 0) + count
+    totals["unique_users"], totals["unique_users_exact"] = unique.count(docs)
+    return totals
+
+
+def rebuild_activity_rollups(db, unique=None):
+    """
+    בונה מחדש את user_action_rollups מ-user_actions הקיימים.
+
+    Returns:
+        dict: days (מספר מסמכי הסיכום שנכתבו)
+    """
+    documents = _build_documents(db, unique or _default_unique)
+    db[ROLLUPS_COLLECTION].delete_many({})
+    insert_rollup_documents(db[ROLLUPS_COLLECTION], documents)
+    return {"days": len(documents)}
+
+
+def backfill_activity_rollups(db, unique=None):
+    """
+    בונה את user_action_rollups מ-user_actions הקיימים, פעם אחת לכל DB.
+    בניה מלאה כמו ב-engine.funnel.backfill_rollups: מסמך של היום שנוצר
+    מעדכונים חיים לפני הבניה מכיל רק את מה שנכתב אחרי העלייה.
+
+    Returns:
+        dict או None: days, או None אם הבניה כבר הושלמה
+    """
+    def backfill():
+        result = rebuild_activity_rollups(db, unique)
+        print(f"✅ Backfilled {result['days']} daily user_actions rollups")
+        return result
+
+    return run_once(db, BACKFILL_MIGRATION, backfill)
+
+
+def _build_documents(db, unique):
+    """מסמכי הסיכום היומיים מ-user_actions."""
+    rows = db.user_actions.aggregate([
+        {"$group": {
+            "_id": {
+                "day": {"$dateToString": {"format": "%Y-%m-%d", "date": "$timestamp"}},
+                "action_type": {"$ifNull": ["$action_type", "unknown"]},
+            },
+            "count": {"$sum": 1},
+            "users": {"$addToSet": {"$toString": "$user_id"}},
+        }},
+    ], allowDiskUse=True)
+
+    days = {}
+    for row in rows:
+        day = row["_id"]["day"]
+        if day is None:
+            continue
+        totals = days.setdefault(day, {"actions": 0, "types": {}, "users": set()})
+        totals["actions"] += row["count"]
+        totals["types"][row["_id"]["action_type"]] = row["count"]
+        totals["users"].update(user for user in row["users"] if user is not None)
+
+    return [
+        {"_id": day, "day": day, "actions": totals["actions"], "types": totals["types"],
+         **unique.build_document(totals["users"])}
+        for day, totals in days.items()
+    ]
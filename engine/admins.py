@@ -0,0 +1,157 @@
+"""
+Engine Admins - מטמון רשימת האדמינים לכל (בוט, צ'אט)
+במקום getChatMember על כל הודעה בקבוצה (כדי לחשב sender_is_admin), רשימת
+האדמינים של הצ'אט נטענת בקריאת getChatAdministrators אחת ונשמרת בזיכרון.
+הרשימה מתרעננת אחרי ttl, ומתעדכנת מיד כשמגיע עדכון chat_member / my_chat_member.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+ADMIN_STATUSES = ("creator", "administrator")
+
+
+class _Roster:
+    """האדמינים של צ'אט אחד כפי שנטענו מטלגרם."""
+
+    __slots__ = ("user_ids", "loaded_at")
+
+    def __init__(self, user_ids, loaded_at):
+        self.user_ids = user_ids
+        self.loaded_at = loaded_at
+
+
+class AdminRosterCache:
+    """
+    מטמון (bot_token, chat_id) -> קבוצת user_id של אדמינים, מוגבל בגודל (LRU).
+    """
+
+    def __init__(self, fetch_fn, ttl=300, max_chats=10000, retry_seconds=30):
+        """
+        Args:
+            fetch_fn: פונקציה (bot_token, chat_id) שמחזירה רשימת ChatMember של האדמינים, או None
+            ttl: כמה שניות לסמוך על רשימה שנטענה
+            max_chats: מספר הצ'אטים המקסימלי במטמון
+            retry_seconds: אחרי טעינה שנכשלה - כמה זמן לא לנסות שוב את אותו צ'אט
+        """
+        self._fetch_fn = fetch_fn
+        self._ttl = ttl
+        self._max_chats = max(1, int(max_chats))
+        self._retry_seconds = retry_seconds
+
+        self._lock = threading.Lock()
+        self._rosters = OrderedDict()
+        # (bot_token, chat_id) -> זמן הכישלון האחרון
+        self._failures = {}
+
+        self._hits = 0
+        self._misses = 0
+        self._fetches = 0
+        self._fetch_errors = 0
+        self._member_updates = 0
+
+    def is_admin(self, bot_token, chat_id, user_id):
+        """
+        בודק אם משתמש הוא אדמין בצ'אט לפי הרשימה שבמטמון.
+
+        Returns:
+            bool, או None אם אי אפשר לטעון את רשימת האדמינים (למשל בוט שאינו אדמין בערוץ)
+        """
+        roster = self._roster(bot_token, chat_id)
+        if roster is None:
+            return None
+        return _user_key(user_id) in roster.user_ids
+
+    def apply_member_update(self, bot_token, member_update):
+        """
+        מעדכן את הרשימה לפי עדכון chat_member / my_chat_member מטלגרם.
+        צ'אט שהרשימה שלו לא במטמון נטען מחדש בבדיקה הבאה ממילא.
+        """
+        chat_id = (member_update.get("chat") or {}).get("id")
+        new_member = member_update.get("new_chat_member") or {}
+        user_id = (new_member.get("user") or {}).get("id")
+        if chat_id is None or user_id is None:
+            return
+
+        with self._lock:
+            self._member_updates += 1
+            self._failures.pop((bot_token, chat_id), None)
+            roster = self._rosters.get((bot_token, chat_id))
+            if roster is None:
+                return
+            if new_member.get("status") in ADMIN_STATUSES:
+                roster.user_ids = roster.user_ids | {_user_key(user_id)}
+            else:
+                roster.user_ids = roster.user_ids - {_user_key(user_id)}
+
+    def invalidate(self, bot_token, chat_id=None):
+        """מוחק מהמטמון את הרשימה של צ'אט (או של כל הצ'אטים של הבוט)."""
+        with self._lock:
+            if chat_id is not None:
+                self._rosters.pop((bot_token, chat_id), None)
+                self._failures.pop((bot_token, chat_id), None)
+                return
+            for cache_key in [k for k in self._rosters if k[0] == bot_token]:
+                del self._rosters[cache_key]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "chats": len(self._rosters),
+                "ttl": self._ttl,
+                "hits": self._hits,
+                "misses": self._misses,
+                "fetches": self._fetches,
+                "fetch_errors": self._fetch_errors,
+                "member_updates": self._member_updates,
+            }
+
+    # === Internal ===
+
+    def _roster(self, bot_token, chat_id):
+        cache_key = (bot_token, chat_id)
+        now = time.monotonic()
+        with self._lock:
+            roster = self._rosters.get(cache_key)
+            if roster is not None and now - roster.loaded_at < self._ttl:
+                self._rosters.move_to_end(cache_key)
+                self._hits += 1
+                return roster
+            self._misses += 1
+            failed_at = self._failures.get(cache_key)
+            if failed_at is not None and now - failed_at < self._retry_seconds:
+                # רשימה ישנה עדיפה על פני קריאה נוספת שכנראה תיכשל
+                return roster
+
+        members = self._fetch_fn(bot_token, chat_id)
+
+        with self._lock:
+            self._fetches += 1
+            if members is None:
+                self._fetch_errors += 1
+                self._failures[cache_key] = now
+                if len(self._failures) > self._max_chats:
+                    self._failures.clear()
+                return self._rosters.get(cache_key)
+
+            self._failures.pop(cache_key, None)
+            roster = _Roster(
+                frozenset(
+                    _user_key((member.get("user") or {}).get("id"))
+                    for member in members
+                    if member.get("status") in ADMIN_STATUSES
+                ),
+                now,
+            )
+            self._rosters[cache_key] = roster
+            self._rosters.move_to_end(cache_key)
+            while len(self._rosters) > self._max_chats:
+                self._rosters.popitem(last=False)
+        return roster
+
+
+def _user_key(user_id):
+    # user_id מגיע לפעמים כמחרוזת (מפלאגינים) ולפעמים כמספר (מטלגרם)
+    return str(user_id)
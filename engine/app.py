@@ -7,14 +7,16 @@ Engine - ליבת המערכת
 
 from flask import Flask, render_template, request
 import importlib
+import atexit
 import sys
+import threading
 import os
 import traceback
 import datetime
 from pathlib import Path
+from contextlib import contextmanager
 from dotenv import load_dotenv
-import requests
-from pymongo import MongoClient
+from pymongo import MongoClient, ReturnDocument
 from pymongo.errors import ConnectionFailure, ServerSelectionTimeoutError, DuplicateKeyError
 from functools import wraps
 
@@ -26,20 +28,43 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 import config
 from config import Config
+from engine.dispatch import UpdateQueue
+from engine.dedup import MemorySeenSet, MongoSeenSet, UpdateDeduplicator
+from engine.telegram_api import TelegramClient, WEBHOOK_ALLOWED_UPDATES
+from engine.rate_limit import OutboundScheduler
+from engine.registry import BotRegistryCache
+from engine.write_buffer import BufferedWriter
+from engine.activation import ActivationCache
+from engine.handlers import PluginEntry
+from engine.catalog import PluginCatalog, is_system_plugin, is_tenant_plugin
+from engine.tenants import TenantPluginCache
+from engine.state import StateStore, set_state_store, bind_legacy_state_helpers
+from engine.maintenance import (
+    DuplicateStateKeysError, WEBHOOK_REFRESH_MIGRATION, ensure_state_indexes, find_missing_indexes,
+    refresh_webhooks,
+)
+from engine.migrations import run_once
+from engine.admins import AdminRosterCache
+from engine.context import ChatHelpers, MessageContext
+from engine.funnel import (
+    FLOW_ROLLUP_FIELDS, apply_flow_updates, backfill_rollups, clamp_days, get_event_totals,
+    get_funnel_totals, record_event, record_flow_change,
+)
+from engine.hll import UniqueCounter
+from engine.activity import backfill_activity_rollups, record_actions
+from engine.cache import MemoryCache, MongoCache, ResponseCache
 
 
 PROJECT_ROOT = Path(__file__).resolve().parents[1]
 TEMPLATES_DIR = PROJECT_ROOT / "templates"
 PLUGINS_DIR = PROJECT_ROOT / "plugins"
+# פלאגיני מערכת (architect וכו') - משרתים את הטוקן הראשי והדשבורד
 PLUGINS_CACHE = {}
 
 # MongoDB connection
 _mongo_client = None
 _mongo_db = None
 _funnel_indexes_ready = False
-_funnel_cache = {}
-_errors_cache = {}
-_CACHE_TTL_SECONDS = 60
 
 
 def get_mongo_db():
@@ -61,8 +86,12 @@ def get_mongo_db():
         _mongo_client = MongoClient(mongo_uri, serverSelectionTimeoutMS=5000)
         # בדיקת חיבור
         _mongo_client.admin.command('ping')
-        _mongo_db = _mongo_client.get_database("bot_factory")
-        _ensure_funnel_indexes(_mongo_db)
+        db = _mongo_client.get_database("bot_factory")
+        _ensure_funnel_indexes(db)
+        _ensure_state_indexes(db)
+        # הסיכומים נבנים מהנתונים הקיימים לפני שה-DB זמין לעדכונים חיים
+        run_rollup_backfills(db)
+        _mongo_db = db
         print("✅ MongoDB connected successfully")
         return _mongo_db
     except (ConnectionFailure, ServerSelectionTimeoutError) as e:
@@ -103,32 +132,96 @@ def _ensure_funnel_indexes(db):
             expireAfterSeconds=7776000
         )
         
+        # === funnel_rollups ===
+        # נשלפים לפי _id (<window>:<day>); האינדקס משרת סריקות לפי יום
+        db.funnel_rollups.create_index([("window", 1), ("day", -1)])
+        
         _funnel_indexes_ready = True
     except Exception as e:
         print(f"⚠️ Failed to ensure funnel indexes: {e}")
 
 
-def _get_cached_value(cache, key):
-    now = datetime.datetime.utcnow().timestamp()
-    entry = cache.get(key)
-    if entry and (now - entry["timestamp"]) < _CACHE_TTL_SECONDS:
-        return entry["data"]
-    if entry:
-        cache.pop(key, None)
-    return None
+def _ensure_state_indexes(db):
+    """
+    יוצר את האינדקס הייחודי על bot_states ומדווח על אינדקסים חסרים.
+    """
+    try:
+        # בלי אינדקס מאושר, עדכונים אטומיים בודקים במפורש ערכים שב-GridFS
+        state_store.mark_unique_index(ensure_state_indexes(db))
+        for index in find_missing_indexes(db):
+            print(f"⚠️ Missing index on {index['collection']}: {index['name']}")
+    except DuplicateStateKeysError as e:
+        print(f"⚠️ {e}")
+    except Exception as e:
+        print(f"⚠️ Failed to ensure bot_states indexes: {e}")
+
+
+def _create_api_cache():
+    """יוצר את מטמון תשובות הדשבורד לפי API_CACHE_BACKEND."""
+    backend_name = Config.API_CACHE_BACKEND
+    if backend_name == "off":
+        return ResponseCache(None, ttl=Config.API_CACHE_TTL)
+    if backend_name == "mongo":
+        return ResponseCache(
+            MongoCache(get_mongo_db),
+            ttl=Config.API_CACHE_TTL,
+            local=MemoryCache(max_size=Config.API_CACHE_MAX_SIZE),
+        )
+    return ResponseCache(MemoryCache(max_size=Config.API_CACHE_MAX_SIZE), ttl=Config.API_CACHE_TTL)
 
 
-def _set_cached_value(cache, key, data):
-    cache[key] = {
-        "timestamp": datetime.datetime.utcnow().timestamp(),
-        "data": data
-    }
+# תשובות /api/funnel* - משותף ל-workers (ב-mongo), מוגבל בגודל, חישוב אחד לכל החטאה
+api_cache = _create_api_cache()
 
 # Flask defaults to searching for templates relative to this module/package.
 # In this repo templates live at "<project_root>/templates", so we set it explicitly.
 app = Flask(__name__, template_folder=str(TEMPLATES_DIR))
 app.config.from_object(Config)
 
+# לקוח Bot API משותף (connection pool + keep-alive) לכל הקריאות לטלגרם
+telegram_client = TelegramClient(
+    pool_size=Config.TELEGRAM_POOL_SIZE,
+    connect_timeout=Config.TELEGRAM_CONNECT_TIMEOUT,
+    read_timeout=Config.TELEGRAM_READ_TIMEOUT,
+)
+
+
+# מטמון token -> plugin מתוך bot_registry
+bot_registry_cache = BotRegistryCache(
+    get_mongo_db,
+    refresh_interval=Config.REGISTRY_REFRESH_SECONDS,
+)
+
+# ספירת משתמשים ייחודיים בסיכומים היומיים (HyperLogLog, מדויק לחלונות קטנים)
+unique_users = UniqueCounter.for_error(
+    Config.UNIQUE_USERS_ERROR, exact_limit=Config.UNIQUE_USERS_EXACT_LIMIT
+)
+
+# user_actions נכתבים ב-batch ברקע (insert_many) ולא insert_one על כל עדכון;
+# כל batch שנכתב מעדכן גם את user_action_rollups (הסיכום היומי של /stats)
+user_actions_writer = BufferedWriter(
+    get_mongo_db,
+    "user_actions",
+    batch_size=Config.ANALYTICS_BATCH_SIZE,
+    flush_interval=Config.ANALYTICS_FLUSH_SECONDS,
+    max_buffer=Config.ANALYTICS_MAX_BUFFER,
+    overflow=Config.ANALYTICS_OVERFLOW,
+    on_written=lambda db, docs: record_actions(db, docs, unique_users),
+)
+atexit.register(user_actions_writer.close)
+
+# שמירת מצב (bot_states) לכל הבוטים שנוצרו - דרך החיבור המשותף של המנוע
+state_store = StateStore(
+    get_mongo_db,
+    cache_ttl=Config.STATE_CACHE_TTL,
+    max_cached_users=Config.STATE_CACHE_MAX_USERS,
+    offload_bytes=Config.STATE_OFFLOAD_BYTES,
+)
+set_state_store(state_store)
+
+# מצב הפעלה לכל בוט (flow, יוצר, הופעל?) - בוט שהופעל לא עולה קריאות DB
+activation_cache = ActivationCache(get_mongo_db)
+
 
 def set_webhook():
     """
@@ -142,10 +235,11 @@ def set_webhook():
         return False
 
     webhook_url = f"{render_url.rstrip('/')}/{token}"
-    api_url = f"https://api.telegram.org/bot{token}/setWebhook?url={webhook_url}"
 
     try:
-        response = requests.get(api_url, timeout=10)
+        response = telegram_client.post(
+            token, "setWebhook", {"url": webhook_url, "allowed_updates": WEBHOOK_ALLOWED_UPDATES}
+        )
         if response.ok:
             print("✅ Telegram webhook set successfully")
         else:
@@ -156,13 +250,43 @@ def set_webhook():
         return False
 
 
+def refresh_registered_webhooks():
+    """
+    רושם מחדש, פעם אחת לכל רשימת WEBHOOK_ALLOWED_UPDATES, את ה-webhooks של
+    הבוטים שכבר רשומים - בוט שנוצר לפני שהרשימה השתנתה לא מקבל את הסוגים החדשים.
+    רץ ברקע בעליית השרת; worker אחד מבצע, והשאר מדלגים.
+    """
+    render_url = os.environ.get("RENDER_EXTERNAL_URL")
+    if not render_url:
+        return None
+    db = get_mongo_db()
+    if db is None:
+        return None
+
+    try:
+        result = run_once(
+            db, WEBHOOK_REFRESH_MIGRATION,
+            lambda: refresh_webhooks(db, telegram_client, render_url),
+            wait=False,
+        )
+    except Exception as e:
+        print(f"⚠️ Failed to refresh registered webhooks: {e}")
+        return None
+    if result is not None:
+        print(f"✅ Re-registered {result['updated']}/{result['bots']} bot webhooks "
+              f"with allowed_updates={WEBHOOK_ALLOWED_UPDATES}")
+    return result
+
+
 # Register webhook once on server startup
 set_webhook()
+threading.Thread(target=refresh_registered_webhooks, name="webhook-refresh", daemon=True).start()
 
 
 def get_plugin_for_token(bot_token):
     """
-    מחזיר את שם הפלאגין עבור טוקן מסוים מ-MongoDB.
+    מחזיר את שם הפלאגין עבור טוקן מסוים.
+    נקרא מהמטמון של bot_registry - בלי גישה ל-MongoDB ב-dispatch הרגיל.
     
     Args:
         bot_token: טוקן הבוט
@@ -170,18 +294,7 @@ def get_plugin_for_token(bot_token):
     Returns:
         str: שם הפלאגין או None אם לא נמצא
     """
-    db = get_mongo_db()
-    if db is None:
-        return None
-    
-    try:
-        result = db.bot_registry.find_one({"token": bot_token})
-        if result:
-            return result.get("plugin_filename")
-        return None
-    except Exception as e:
-        print(f"❌ Error fetching bot from MongoDB: {e}")
-        return None
+    return bot_registry_cache.get(bot_token)
 
 
 def register_bot_in_db(bot_token, plugin_filename):
@@ -211,6 +324,7 @@ def register_bot_in_db(bot_token, plugin_filename):
             }},
             upsert=True
         )
+        bot_registry_cache.put(bot_token, plugin_filename)
         print(f"✅ Bot registered in MongoDB: {plugin_filename}")
         return True
     except Exception as e:
@@ -221,6 +335,7 @@ def register_bot_in_db(bot_token, plugin_filename):
 def bot_exists_in_db(bot_token):
     """
     בודק אם בוט עם הטוקן הזה כבר קיים ב-MongoDB.
+    פגיעה במטמון מספיקה; בהחטאה נבדק ה-DB עצמו (בלי מטמון שלילי).
     
     Args:
         bot_token: טוקן הבוט
@@ -228,16 +343,7 @@ def bot_exists_in_db(bot_token):
     Returns:
         bool: האם הבוט קיים
     """
-    db = get_mongo_db()
-    if db is None:
-        return False
-    
-    try:
-        result = db.bot_registry.find_one({"token": bot_token})
-        return result is not None
-    except Exception as e:
-        print(f"❌ Error checking bot existence in MongoDB: {e}")
-        return False
+    return bot_registry_cache.get(bot_token, fresh=True) is not None
 
 
 def log_user_action(user_id, action_type, bot_token=None, details=None):
@@ -254,22 +360,19 @@ def log_user_action(user_id, action_type, bot_token=None, details=None):
     if db is None:
         return
     
-    try:
-        # הסתרת חלק מהטוקן לאבטחה
-        safe_bot_id = None
-        if bot_token and ':' in bot_token:
-            safe_bot_id = bot_token.split(':')[0]
-        
-        db.user_actions.insert_one({
-            "user_id": user_id,
-            "action_type": action_type,
-            "bot_id": safe_bot_id,
-            "details": details,
-            "timestamp": __import__('datetime').datetime.utcnow()
-        })
-    except Exception as e:
-        # לא נכשיל את הבקשה בגלל לוג
-        print(f"⚠️ Failed to log user action: {e}")
+    # הסתרת חלק מהטוקן לאבטחה
+    safe_bot_id = None
+    if bot_token and ':' in bot_token:
+        safe_bot_id = bot_token.split(':')[0]
+    
+    # נכתב ברקע ב-batch - לא מוסיף round-trip ל-MongoDB בנתיב ה-webhook
+    user_actions_writer.append({
+        "user_id": user_id,
+        "action_type": action_type,
+        "bot_id": safe_bot_id,
+        "details": details,
+        "timestamp": datetime.datetime.utcnow()
+    })
 
 
 def log_funnel_event(user_id, event_type, flow_id=None, bot_token_id=None,
@@ -307,14 +410,18 @@ def log_funnel_event(user_id, event_type, flow_id=None, bot_token_id=None,
             doc["metadata"] = metadata
         
         if unique_key:
-            db.funnel_events.update_one(
+            result = db.funnel_events.update_one(
                 {"_id": unique_key},
                 {"$setOnInsert": doc},
                 upsert=True
             )
+            if result.upserted_id is None:
+                # האירוע כבר נרשם - לא סופרים שוב
+                return True
         else:
             db.funnel_events.insert_one(doc)
         
+        _record_event_rollup(db, event_type, doc["timestamp"])
         return True
     except DuplicateKeyError:
         return False
@@ -323,6 +430,49 @@ def log_funnel_event(user_id, event_type, flow_id=None, bot_token_id=None,
         return False
 
 
+def record_flow_rollup(db, before, after):
+    """
+    מעדכן את funnel_rollups לפי שינוי ב-flow (כישלון לא עוצר את תהליך היצירה).
+    
+    Args:
+        db: חיבור ל-MongoDB
+        before: ה-flow לפני השינוי, או None ל-flow חדש
+        after: ה-flow אחרי השינוי
+    """
+    try:
+        record_flow_change(db, before, after, unique_users)
+    except Exception as e:
+        print(f"⚠️ Failed to update funnel rollups: {e}")
+
+
+def run_rollup_backfills(db):
+    """
+    בונה את funnel_rollups ואת user_action_rollups מהנתונים הקיימים אם זה עוד
+    לא נעשה (פעם אחת לכל DB). נקרא על כל חיבור חדש ל-DB לפני שהוא נמסר לקוד
+    שכותב flows, אירועים ו-user_actions, כך שאף עדכון חי לא נכתב לפני שהבניה
+    הושלמה. אחרי הפעם הראשונה - בדיקה בזיכרון.
+    כישלון לא מפיל את החיבור; הבניה תנוסה שוב בעלייה הבאה.
+    """
+    for name, backfill in (("funnel", backfill_rollups), ("activity", backfill_activity_rollups)):
+        try:
+            backfill(db, unique_users)
+        except Exception as e:
+            print(f"⚠️ Failed to backfill {name} rollups: {e}")
+
+
+def _days_arg():
+    """פרמטר days מה-query string, מוגבל ל-1..365 (גם מפתח המטמון נגזר ממנו)."""
+    return clamp_days(request.args.get('days', 7, type=int))
+
+
+def _record_event_rollup(db, event_type, timestamp):
+    """מגדיל את מונה האירוע היומי ב-funnel_rollups (כישלון לא מפיל את הרישום)."""
+    try:
+        record_event(db, event_type, timestamp)
+    except Exception as e:
+        print(f"⚠️ Failed to update funnel rollups: {e}")
+
+
 def delete_failed_plugin(plugin_name, reason="unknown"):
     """
     מוחק קובץ פלאגין שנכשל מהתיקייה ומה-MongoDB registry.
@@ -348,6 +498,7 @@ def delete_failed_plugin(plugin_name, reason="unknown"):
             print(f"⚠️ Failed to delete plugin file '{plugin_name}': {e}")
     
     # מחיקה מה-MongoDB registry
+    bot_registry_cache.remove_plugin(f"{plugin_name}.py")
     db = get_mongo_db()
     if db is not None:
         try:
@@ -360,6 +511,7 @@ def delete_failed_plugin(plugin_name, reason="unknown"):
     
     # הסרה מהמטמון
     PLUGINS_CACHE.pop(plugin_name, None)
+    tenant_plugins.pop(plugin_name)
     
     return deleted_file or deleted_from_db
 
@@ -367,17 +519,50 @@ def delete_failed_plugin(plugin_name, reason="unknown"):
 def load_plugin_by_name(plugin_name):
     """
     טוען פלאגין ספציפי לפי שם.
-    אם הטעינה נכשלת, הפלאגין יימחק אוטומטית.
+    פלאגינים של בוטים רשומים נשמרים במטמון מוגבל (tenant_plugins), פלאגיני מערכת ב-PLUGINS_CACHE.
     
     Args:
         plugin_name: שם הפלאגין (ללא סיומת .py)
     
     Returns:
-        module: מודול הפלאגין או None אם נכשל
+        PluginEntry: הפלאגין (מודול + adapters ל-handlers) או None אם נכשל
     """
+    if is_tenant_plugin(plugin_name):
+        return tenant_plugins.get(plugin_name)
+    
     if plugin_name in PLUGINS_CACHE:
         return PLUGINS_CACHE[plugin_name]
     
+    entry = _import_plugin(plugin_name)
+    if entry is not None:
+        PLUGINS_CACHE[plugin_name] = entry
+    return entry
+
+
+@contextmanager
+def use_plugin(plugin_name):
+    """
+    טוען פלאגין (כמו load_plugin_by_name) ומסמן אותו בשימוש עד סוף הבלוק -
+    מודול של בוט רשום לא נפרק מהזיכרון בזמן שה-handler שלו רץ.
+    """
+    if is_tenant_plugin(plugin_name):
+        with tenant_plugins.use(plugin_name) as entry:
+            yield entry
+    else:
+        yield load_plugin_by_name(plugin_name)
+
+
+def _import_plugin(plugin_name):
+    """
+    מייבא פלאגין מהתיקייה.
+    אם הטעינה נכשלת, הפלאגין יימחק אוטומטית.
+    
+    Args:
+        plugin_name: שם הפלאגין (ללא סיומת .py)
+    
+    Returns:
+        PluginEntry או None אם נכשל
+    """
     plugin_path = PLUGINS_DIR / f"{plugin_name}.py"
     if not plugin_path.exists():
         print(f"❌ Plugin file not found: {plugin_name}")
@@ -386,9 +571,11 @@ def load_plugin_by_name(plugin_name):
     try:
         importlib.invalidate_caches()
         plugin_module = importlib.import_module(f"plugins.{plugin_name}")
-        PLUGINS_CACHE[plugin_name] = plugin_module
+        # פלאגינים ישנים פותחים MongoClient משלהם - מחברים אותם ל-StateStore המשותף
+        bind_legacy_state_helpers(plugin_module, state_store)
+        entry = PluginEntry(plugin_name, plugin_module)
         print(f"✅ Plugin loaded: {plugin_name}")
-        return plugin_module
+        return entry
     except ImportError as e:
         print(f"❌ Failed to load plugin '{plugin_name}': {e}")
         delete_failed_plugin(plugin_name, reason=f"ImportError: {e}")
@@ -403,24 +590,32 @@ def load_plugin_by_name(plugin_name):
         return None
 
 
-def load_plugins():
+# פלאגינים של בוטים רשומים (bot_<id>) - נטענים לפי דרישה, רק הפעילים נשארים בזיכרון
+tenant_plugins = TenantPluginCache(
+    _import_plugin,
+    max_size=Config.TENANT_PLUGIN_CACHE_SIZE,
+    idle_seconds=Config.TENANT_PLUGIN_IDLE_SECONDS,
+)
+
+
+def _scan_plugins():
     """
-    טוען דינמית את כל הפלאגינים מתיקיית plugins.
-    שומר את הפלאגינים במטמון גלובלי כדי למנוע טעינה מחדש בכל בקשה.
+    מסנכרן את PLUGINS_CACHE מול פלאגיני המערכת בתיקיית plugins.
+    טוען פלאגינים חדשים ומסיר פלאגינים שנמחקו.
+    פלאגינים של בוטים רשומים (bot_<id>) לא נטענים כאן - רק דרך load_plugin_by_name.
     פלאגינים שנכשלים בטעינה יימחקו אוטומטית.
+    נקרא רק מקטלוג הפלאגינים (בטעינה הראשונה, בשינוי בתיקייה או ב-reload מפורש).
     
     Returns:
-        list: רשימת מודולי הפלאגינים שנטענו
+        list: רשימת הפלאגינים שנטענו (PluginEntry)
     """
     if not PLUGINS_DIR.exists():
         return []
 
-    importlib.invalidate_caches()
-
     plugin_names = {
         path.stem
         for path in PLUGINS_DIR.iterdir()
-        if path.is_file() and path.suffix == ".py" and not path.name.startswith("__")
+        if path.is_file() and path.suffix == ".py" and is_system_plugin(path.stem)
     }
 
     # הסרת פלאגינים שנמחקו מהתיקייה
@@ -432,23 +627,34 @@ def load_plugins():
     for plugin_name in sorted(plugin_names):
         if plugin_name in PLUGINS_CACHE:
             continue
-        try:
-            plugin_module = importlib.import_module(f"plugins.{plugin_name}")
-            PLUGINS_CACHE[plugin_name] = plugin_module
-            print(f"✅ Plugin loaded: {plugin_name}")
-        except ImportError as e:
-            print(f"❌ Failed to load plugin '{plugin_name}': {e}")
-            delete_failed_plugin(plugin_name, reason=f"ImportError: {e}")
-        except SyntaxError as e:
-            print(f"❌ Syntax error in plugin '{plugin_name}': {e}")
-            delete_failed_plugin(plugin_name, reason=f"SyntaxError: {e}")
-        except Exception as e:
-            print(f"❌ Error loading plugin '{plugin_name}': {e}")
-            delete_failed_plugin(plugin_name, reason=f"Exception: {e}")
+        entry = _import_plugin(plugin_name)
+        if entry is not None:
+            PLUGINS_CACHE[plugin_name] = entry
 
     return [PLUGINS_CACHE[name] for name in sorted(PLUGINS_CACHE)]
 
 
+# קטלוג פלאגיני המערכת - snapshot שמתחלף רק כשתיקיית plugins משתנה
+plugin_catalog = PluginCatalog(
+    _scan_plugins,
+    PLUGINS_DIR,
+    watch_mode=Config.PLUGIN_WATCH_MODE,
+    poll_interval=Config.PLUGIN_POLL_SECONDS,
+    include=is_system_plugin,
+)
+
+
+def load_plugins():
+    """
+    מחזיר את פלאגיני המערכת הטעונים מתוך ה-snapshot הנוכחי של הקטלוג.
+    לא ניגש לדיסק - הקטלוג מתרענן ברקע כשתיקיית plugins משתנה.
+    
+    Returns:
+        tuple: הפלאגינים שנטענו (PluginEntry)
+    """
+    return plugin_catalog.snapshot().plugins
+
+
 @app.route('/')
 def dashboard():
     """
@@ -461,7 +667,8 @@ def dashboard():
     plugins = load_plugins()
 
     # איסוף ווידג'טים מכל פלאגין
-    for plugin in plugins:
+    for entry in plugins:
+        plugin = entry.module
         widget = None
         if hasattr(plugin, 'get_dashboard_widget'):
             try:
@@ -506,55 +713,36 @@ def admin_required(f):
 def get_funnel_stats():
     """
     מחזיר סטטיסטיקות משפך ההמרה.
+    מסוכם ממסמכי funnel_rollups היומיים (לכל היותר days מסמכים) ולא מ-bot_flows.
     Query params:
-        - days: מספר ימים אחורה (ברירת מחדל: 7)
+        - days: מספר ימים קלנדריים (UTC) אחורה, כולל היום - 1..365 (ברירת מחדל: 7)
         - window: "start" (cohort לפי התחלה) או "activity" (פעילות אחרונה)
     """
-    days = request.args.get('days', 7, type=int)
+    days = _days_arg()
     window = request.args.get('window', 'start')
-    since = datetime.datetime.utcnow() - datetime.timedelta(days=days)
-    
-    cache_key = f"{days}:{window}"
-    cached = _get_cached_value(_funnel_cache, cache_key)
-    if cached:
-        return cached
+    if window not in ("start", "activity"):
+        window = "activity"
     
     db = get_mongo_db()
     if db is None:
         return {"error": "Database not connected"}, 500
     
-    time_field = "created_at" if window == "start" else "updated_at"
-    
-    pipeline = [
-        {"$match": {time_field: {"$gte": since}}},
-        {"$group": {
-            "_id": None,
-            "total_flows": {"$sum": 1},
-            "reached_stage_1": {"$sum": {"$cond": [{"$gte": ["$current_stage", 1]}, 1, 0]}},
-            "reached_stage_2": {"$sum": {"$cond": [{"$gte": ["$current_stage", 2]}, 1, 0]}},
-            "reached_stage_3": {"$sum": {"$cond": [{"$gte": ["$current_stage", 3]}, 1, 0]}},
-            "reached_stage_4": {"$sum": {"$cond": [{"$gte": ["$current_stage", 4]}, 1, 0]}},
-            "reached_stage_5": {"$sum": {"$cond": [{"$gte": ["$current_stage", 5]}, 1, 0]}},
-            "cancelled": {"$sum": {"$cond": [{"$eq": ["$final_status", "cancelled"]}, 1, 0]}},
-            "failed": {"$sum": {"$cond": [{"$eq": ["$final_status", "failed"]}, 1, 0]}},
-            "unique_users": {"$addToSet": "$user_id"}
-        }}
-    ]
-    
-    results = list(db.bot_flows.aggregate(pipeline))
+    return api_cache.get_or_compute(
+        f"funnel:{days}:{window}", lambda: _compute_funnel_stats(db, days, window)
+    )
+
+
+def _compute_funnel_stats(db, days, window):
+    data = get_funnel_totals(db, window, days, unique_users)
+    total = data.get("total_flows", 0)
     
-    if not results:
-        response_data = {
+    if not total:
+        return {
             "period_days": days,
             "total_flows": 0,
             "funnel": [],
             "summary": {}
         }
-        _set_cached_value(_funnel_cache, cache_key, response_data)
-        return response_data
-    
-    data = results[0]
-    total = data.get("total_flows", 0)
     
     stages = [
         {"name": "flow_started", "label": "התחילו תהליך", "count": data.get("reached_stage_1", 0)},
@@ -583,7 +771,8 @@ def get_funnel_stats():
     
     summary = {
         "total_flows": total,
-        "unique_users": len(data.get("unique_users", [])),
+        "unique_users": data["unique_users"],
+        "unique_users_exact": data["unique_users_exact"],
         "successful_creations": data.get("reached_stage_4", 0),
         "successful_activations": data.get("reached_stage_5", 0),
         "cancelled": data.get("cancelled", 0),
@@ -592,16 +781,16 @@ def get_funnel_stats():
             (data.get("reached_stage_5", 0) / total * 100) if total > 0 else 0, 1
         ),
         "avg_attempts_per_user": round(
-            total / len(data.get("unique_users", [1])), 2
-        ) if data.get("unique_users") else 0
+            total / data["unique_users"], 2
+        ) if data["unique_users"] else 0
     }
     
     response_data = {
         "period_days": days,
         "funnel": funnel_data,
-        "summary": summary
+        "summary": summary,
+        "events": get_event_totals(db, days)
     }
-    _set_cached_value(_funnel_cache, cache_key, response_data)
     return response_data
 
 
@@ -611,19 +800,27 @@ def get_funnel_users():
     """
     מחזיר נתוני משפך לפי משתמש - איפה כל משתמש נעצר.
     Query params:
-        - days: מספר ימים אחורה (ברירת מחדל: 7)
+        - days: מספר ימים אחורה, 1..365 (ברירת מחדל: 7)
         - stage: סינון לפי שלב ספציפי (אופציונלי)
-        - limit: מספר תוצאות מקסימלי (ברירת מחדל: 50)
+        - limit: מספר תוצאות מקסימלי, 1..500 (ברירת מחדל: 50)
     """
-    days = request.args.get('days', 7, type=int)
+    days = _days_arg()
     stage_filter = request.args.get('stage', type=int)
-    limit = request.args.get('limit', 50, type=int)
-    since = datetime.datetime.utcnow() - datetime.timedelta(days=days)
+    limit = max(1, min(500, request.args.get('limit', 50, type=int)))
     
     db = get_mongo_db()
     if db is None:
         return {"error": "Database not connected"}, 500
     
+    return api_cache.get_or_compute(
+        f"funnel_users:{days}:{stage_filter}:{limit}",
+        lambda: _compute_funnel_users(db, days, stage_filter, limit)
+    )
+
+
+def _compute_funnel_users(db, days, stage_filter, limit):
+    since = datetime.datetime.utcnow() - datetime.timedelta(days=days)
+    
     # שלב 1: שליפת כל ה-flows עם פרטי המשתמש
     match_query = {"created_at": {"$gte": since}}
     if stage_filter:
@@ -728,19 +925,23 @@ def get_funnel_users():
 def get_funnel_errors():
     """
     מחזיר סטטיסטיקות שגיאות נפוצות ביצירת בוטים.
+    Query params:
+        - days: מספר ימים אחורה, 1..365 (ברירת מחדל: 7)
     """
-    days = request.args.get('days', 7, type=int)
-    since = datetime.datetime.utcnow() - datetime.timedelta(days=days)
-    
-    cache_key = f"{days}"
-    cached = _get_cached_value(_errors_cache, cache_key)
-    if cached:
-        return cached
+    days = _days_arg()
     
     db = get_mongo_db()
     if db is None:
         return {"error": "Database not connected"}, 500
     
+    return api_cache.get_or_compute(
+        f"funnel_errors:{days}", lambda: _compute_funnel_errors(db, days)
+    )
+
+
+def _compute_funnel_errors(db, days):
+    since = datetime.datetime.utcnow() - datetime.timedelta(days=days)
+    
     pipeline = [
         {"$match": {
             "event_type": "creation_failed",
@@ -756,12 +957,10 @@ def get_funnel_errors():
     
     results = list(db.funnel_events.aggregate(pipeline))
     
-    response_data = {
+    return {
         "period_days": days,
         "top_errors": [{"error": r["_id"], "count": r["count"]} for r in results]
     }
-    _set_cached_value(_errors_cache, cache_key, response_data)
-    return response_data
 
 
 @app.route('/health')
@@ -770,6 +969,139 @@ def health():
     return {"status": "healthy", "bot": Config.BOT_NAME}
 
 
+# מתזמן שליחה יוצא: הגבלת קצב לכל בוט ולכל צ'אט + כיבוד retry_after
+outbound_scheduler = None
+if Config.OUTBOUND_RATE_LIMIT:
+    outbound_scheduler = OutboundScheduler(
+        lambda token, method, payload: telegram_client.post(token, method, payload),
+        bot_rate=Config.OUTBOUND_BOT_RATE,
+        chat_rate=Config.OUTBOUND_CHAT_RATE,
+        group_rate=Config.OUTBOUND_GROUP_RATE_PER_MIN / 60,
+        workers=Config.OUTBOUND_SENDERS,
+    )
+    atexit.register(outbound_scheduler.drain)
+
+
+# === Reply-in-webhook-response ===
+# טלגרם מאפשר להחזיר קריאה אחת ל-Bot API בתוך תשובת ה-webhook עצמה.
+# בעיבוד סינכרוני (WEBHOOK_INLINE_REPLY), הקריאה הראשונה (תשובה או
+# answerCallbackQuery) נשמרת כאן ומוחזרת בתשובת ה-HTTP במקום לצאת כבקשה נפרדת.
+# המחיר: טלגרם לא מחזיר תשובה על קריאה כזו, כך ששגיאה בה לא נראית ולא נרשמת
+# ביומן - לכן הודעה עם parse_mode (שעלולה להיכשל בפענוח) נשלחת כרגיל.
+# פעולות ישירות של אותו handler דרך פונקציות המנוע (מחיקה, באן, השתקה)
+# שולחות קודם את הקריאה השמורה, כדי לא להקדים אותה; קריאות שהפלאגין שולח
+# בעצמו ל-api.telegram.org לא עוברות כאן ועלולות לצאת לפני התשובה.
+_inline_reply = threading.local()
+
+
+def _open_inline_reply(bot_token):
+    """פותח "משבצת" לקריאה אחת שתוחזר בתשובת ה-webhook."""
+    _inline_reply.slot = {"bot_token": bot_token, "call": None}
+
+
+def _close_inline_reply():
+    """
+    סוגר את המשבצת.
+
+    Returns:
+        tuple: (method, payload) של הקריאה השמורה או None
+    """
+    slot = getattr(_inline_reply, "slot", None)
+    _inline_reply.slot = None
+    if slot is None:
+        return None
+    return slot["call"]
+
+
+def _claim_inline_reply(bot_token, method, payload):
+    """
+    מנסה לשמור קריאה לתשובת ה-webhook במקום לשלוח אותה.
+
+    Returns:
+        bool: True אם הקריאה נשמרה (ואין לשלוח אותה), False אם יש לשלוח כרגיל
+    """
+    slot = getattr(_inline_reply, "slot", None)
+    if slot is None or slot["bot_token"] != bot_token:
+        return False
+
+    buffered = slot["call"]
+    if buffered is None:
+        # שגיאת פענוח של parse_mode לא הייתה נראית בתשובת ה-webhook
+        if payload.get("parse_mode"):
+            return False
+        # הודעה שחוזרת בתשובה לא עוברת בתור השליחה - מותר רק אם אין לפניה
+        # הודעות ממתינות לאותו צ'אט ויש אסימון פנוי במגביל הקצב
+        if (method == "sendMessage" and outbound_scheduler is not None
+                and not outbound_scheduler.try_acquire(bot_token, payload.get("chat_id"))):
+            return False
+        slot["call"] = (method, payload)
+        return True
+
+    # answerCallbackQuery לא תלוי בסדר מול הודעות - נשאר בתשובת ה-webhook
+    if buffered[0] == "answerCallbackQuery":
+        return False
+
+    # הודעה נוספת: שולחים מיד את השמורה (שמירה על סדר ההודעות בצ'אט),
+    # וכל השאר יוצא בדרך הרגילה
+    _flush_inline_reply()
+    return False
+
+
+def _flush_inline_reply():
+    """שולח מיד את הקריאה השמורה (אם יש) וסוגר את המשבצת."""
+    slot = getattr(_inline_reply, "slot", None)
+    call = _close_inline_reply()
+    if call is not None:
+        _send_buffered_call(slot["bot_token"], call)
+
+
+def _flush_inline_reply_before(bot_token):
+    """שולח את הקריאה השמורה לפני פעולה ישירה של אותו בוט (שמירה על הסדר)."""
+    slot = getattr(_inline_reply, "slot", None)
+    if slot is not None and slot["call"] is not None and slot["bot_token"] == bot_token:
+        _flush_inline_reply()
+
+
+def _send_buffered_call(bot_token, call):
+    method, payload = call
+    _send_telegram(bot_token, payload.get("chat_id"), method, payload)
+
+
+def _send_telegram(bot_token, chat_id, method, payload):
+    """
+    קריאה ל-Bot API בלי לחכות לתשובה. עם OUTBOUND_RATE_LIMIT היא נכנסת לתור
+    של הצ'אט (chat_id=None - רק דלי הבוט) ונשלחת שוב אחרי retry_after על 429.
+    """
+    if outbound_scheduler is not None:
+        if not outbound_scheduler.submit(bot_token, chat_id, method, payload):
+            print(f"⚠️ Outbound queue full, dropping {method} for bot {bot_token[:10]}...")
+        return
+
+    try:
+        telegram_client.post(bot_token, method, payload)
+    except Exception as e:
+        print(f"❌ Failed sending Telegram {method}: {e}")
+
+
+def _call_telegram(bot_token, chat_id, method, payload):
+    """
+    קריאה ל-Bot API שהתוצאה שלה נדרשת. עם OUTBOUND_RATE_LIMIT היא עוברת בתור
+    של הצ'אט וממתינה לתשובה: צורכת אסימונים, לא עוקפת הודעות שממתינות לפניה
+    ומכבדת retry_after.
+
+    Returns:
+        requests.Response, או None אם הקריאה לא נשלחה (התור מלא / פג הזמן)
+    """
+    if outbound_scheduler is None:
+        return telegram_client.post(bot_token, method, payload)
+    return outbound_scheduler.call(bot_token, chat_id, method, payload)
+
+
+def _api_ok(response):
+    """האם קריאה ל-Bot API הצליחה."""
+    return response is not None and response.ok and response.json().get("ok", False)
+
+
 def send_telegram_message(bot_token, chat_id, reply):
     """
     שולח הודעה לטלגרם - תומך בטקסט פשוט או בתשובה מורכבת עם כפתורים.
@@ -796,31 +1128,24 @@ def send_telegram_message(bot_token, chat_id, reply):
     else:
         return
     
-    try:
-        requests.post(
-            f"https://api.telegram.org/bot{bot_token}/sendMessage",
-            json=payload,
-            timeout=10,
-        )
-    except Exception as e:
-        print(f"❌ Failed sending Telegram message: {e}")
+    if _claim_inline_reply(bot_token, "sendMessage", payload):
+        return
+
+    # עם OUTBOUND_RATE_LIMIT - דרך תור עם הגבלת קצב (לא חוסם, לא נזרק ב-429)
+    _send_telegram(bot_token, chat_id, "sendMessage", payload)
 
 
 def answer_callback_query(bot_token, callback_query_id, text=None):
     """
     עונה ל-callback query (לחיצה על כפתור).
     """
-    try:
-        payload = {"callback_query_id": callback_query_id}
-        if text:
-            payload["text"] = text
-        requests.post(
-            f"https://api.telegram.org/bot{bot_token}/answerCallbackQuery",
-            json=payload,
-            timeout=10,
-        )
-    except Exception as e:
-        print(f"❌ Failed answering callback query: {e}")
+    payload = {"callback_query_id": callback_query_id}
+    if text:
+        payload["text"] = text
+    if _claim_inline_reply(bot_token, "answerCallbackQuery", payload):
+        return
+    # לא שייך לתור של צ'אט - צורך רק מדלי הבוט
+    _send_telegram(bot_token, None, "answerCallbackQuery", payload)
 
 
 # === Group Management Helper Functions ===
@@ -837,13 +1162,12 @@ def delete_message(bot_token, chat_id, message_id):
     Returns:
         bool: האם המחיקה הצליחה
     """
+    _flush_inline_reply_before(bot_token)
     try:
-        response = requests.post(
-            f"https://api.telegram.org/bot{bot_token}/deleteMessage",
-            json={"chat_id": chat_id, "message_id": message_id},
-            timeout=10,
+        response = _call_telegram(
+            bot_token, chat_id, "deleteMessage", {"chat_id": chat_id, "message_id": message_id}
         )
-        return response.ok and response.json().get("ok", False)
+        return _api_ok(response)
     except Exception as e:
         print(f"❌ Failed deleting message: {e}")
         return False
@@ -862,16 +1186,13 @@ def ban_user(bot_token, chat_id, user_id, until_date=None):
     Returns:
         bool: האם הפעולה הצליחה
     """
+    _flush_inline_reply_before(bot_token)
     try:
         payload = {"chat_id": chat_id, "user_id": user_id}
         if until_date:
             payload["until_date"] = until_date
-        response = requests.post(
-            f"https://api.telegram.org/bot{bot_token}/banChatMember",
-            json=payload,
-            timeout=10,
-        )
-        return response.ok and response.json().get("ok", False)
+        response = _call_telegram(bot_token, chat_id, "banChatMember", payload)
+        return _api_ok(response)
     except Exception as e:
         print(f"❌ Failed banning user: {e}")
         return False
@@ -889,22 +1210,20 @@ def kick_user(bot_token, chat_id, user_id):
     Returns:
         bool: האם הפעולה הצליחה
     """
+    _flush_inline_reply_before(bot_token)
     try:
         # קודם באן
-        response = requests.post(
-            f"https://api.telegram.org/bot{bot_token}/banChatMember",
-            json={"chat_id": chat_id, "user_id": user_id},
-            timeout=10,
+        response = _call_telegram(
+            bot_token, chat_id, "banChatMember", {"chat_id": chat_id, "user_id": user_id}
         )
-        if not (response.ok and response.json().get("ok", False)):
+        if not _api_ok(response):
             return False
         # אז unban כדי שיוכל לחזור
-        response = requests.post(
-            f"https://api.telegram.org/bot{bot_token}/unbanChatMember",
-            json={"chat_id": chat_id, "user_id": user_id, "only_if_banned": True},
-            timeout=10,
+        response = _call_telegram(
+            bot_token, chat_id, "unbanChatMember",
+            {"chat_id": chat_id, "user_id": user_id, "only_if_banned": True}
         )
-        return response.ok and response.json().get("ok", False)
+        return _api_ok(response)
     except Exception as e:
         print(f"❌ Failed kicking user: {e}")
         return False
@@ -923,6 +1242,7 @@ def mute_user(bot_token, chat_id, user_id, until_date=None):
     Returns:
         bool: האם הפעולה הצליחה
     """
+    _flush_inline_reply_before(bot_token)
     try:
         payload = {
             "chat_id": chat_id,
@@ -936,12 +1256,8 @@ def mute_user(bot_token, chat_id, user_id, until_date=None):
         }
         if until_date:
             payload["until_date"] = until_date
-        response = requests.post(
-            f"https://api.telegram.org/bot{bot_token}/restrictChatMember",
-            json=payload,
-            timeout=10,
-        )
-        return response.ok and response.json().get("ok", False)
+        response = _call_telegram(bot_token, chat_id, "restrictChatMember", payload)
+        return _api_ok(response)
     except Exception as e:
         print(f"❌ Failed muting user: {e}")
         return False
@@ -959,6 +1275,7 @@ def unmute_user(bot_token, chat_id, user_id):
     Returns:
         bool: האם הפעולה הצליחה
     """
+    _flush_inline_reply_before(bot_token)
     try:
         payload = {
             "chat_id": chat_id,
@@ -970,12 +1287,8 @@ def unmute_user(bot_token, chat_id, user_id):
                 "can_add_web_page_previews": True,
             }
         }
-        response = requests.post(
-            f"https://api.telegram.org/bot{bot_token}/restrictChatMember",
-            json=payload,
-            timeout=10,
-        )
-        return response.ok and response.json().get("ok", False)
+        response = _call_telegram(bot_token, chat_id, "restrictChatMember", payload)
+        return _api_ok(response)
     except Exception as e:
         print(f"❌ Failed unmuting user: {e}")
         return False
@@ -994,10 +1307,8 @@ def get_chat_member(bot_token, chat_id, user_id):
         dict: מידע על המשתמש או None אם נכשל
     """
     try:
-        response = requests.post(
-            f"https://api.telegram.org/bot{bot_token}/getChatMember",
-            json={"chat_id": chat_id, "user_id": user_id},
-            timeout=10,
+        response = telegram_client.post(
+            bot_token, "getChatMember", {"chat_id": chat_id, "user_id": user_id}
         )
         if response.ok:
             result = response.json()
@@ -1009,9 +1320,43 @@ def get_chat_member(bot_token, chat_id, user_id):
         return None
 
 
+def get_chat_administrators(bot_token, chat_id):
+    """
+    מחזיר את רשימת האדמינים של צ'אט.
+    
+    Args:
+        bot_token: טוקן הבוט
+        chat_id: מזהה הצ'אט/קבוצה
+    
+    Returns:
+        list: רשימת ChatMember של האדמינים או None אם נכשל
+    """
+    try:
+        response = telegram_client.post(
+            bot_token, "getChatAdministrators", {"chat_id": chat_id}
+        )
+        if response.ok:
+            result = response.json()
+            if result.get("ok"):
+                return result.get("result") or []
+        return None
+    except Exception as e:
+        print(f"❌ Failed getting chat administrators: {e}")
+        return None
+
+
+# רשימת האדמינים לכל (בוט, צ'אט) - getChatAdministrators אחד במקום getChatMember על כל הודעה
+admin_roster = AdminRosterCache(
+    get_chat_administrators,
+    ttl=Config.ADMIN_CACHE_TTL,
+    max_chats=Config.ADMIN_CACHE_MAX_CHATS,
+)
+
+
 def is_user_admin(bot_token, chat_id, user_id):
     """
     בודק אם משתמש הוא אדמין בצ'אט.
+    נענה מרשימת האדמינים שבמטמון; רק אם אי אפשר לטעון אותה נשאל getChatMember.
     
     Args:
         bot_token: טוקן הבוט
@@ -1021,6 +1366,9 @@ def is_user_admin(bot_token, chat_id, user_id):
     Returns:
         bool: האם המשתמש אדמין
     """
+    is_admin = admin_roster.is_admin(bot_token, chat_id, user_id)
+    if is_admin is not None:
+        return is_admin
     member = get_chat_member(bot_token, chat_id, user_id)
     if member:
         status = member.get("status", "")
@@ -1028,53 +1376,31 @@ def is_user_admin(bot_token, chat_id, user_id):
     return False
 
 
+# פונקציות העזר שה-context חושף לפלאגינים
+context_helpers = ChatHelpers(
+    delete_message=delete_message,
+    ban_user=ban_user,
+    kick_user=kick_user,
+    mute_user=mute_user,
+    unmute_user=unmute_user,
+    is_user_admin=is_user_admin,
+    send_message=send_telegram_message,
+)
+
+
 def build_message_context(bot_token, message):
     """
     בונה אובייקט context עם כל המידע על ההודעה.
+    השדות (כולל בדיקת האדמין של השולח) מחושבים רק כשהפלאגין ניגש אליהם.
     
     Args:
         bot_token: טוקן הבוט
         message: אובייקט ההודעה מטלגרם
     
     Returns:
-        dict: context עם כל המידע הרלוונטי
+        MessageContext: context עם כל המידע הרלוונטי (Mapping, כמו dict לקריאה)
     """
-    chat = message.get("chat") or {}
-    from_user = message.get("from") or {}
-    
-    chat_id = chat.get("id")
-    user_id = from_user.get("id")
-    chat_type = chat.get("type", "private")
-    
-    # בדיקה אם השולח הוא אדמין (רק בקבוצות)
-    sender_is_admin = False
-    if chat_type in ("group", "supergroup") and user_id:
-        sender_is_admin = is_user_admin(bot_token, chat_id, user_id)
-    
-    return {
-        "bot_token": bot_token,
-        "chat_id": chat_id,
-        "chat_type": chat_type,  # "private", "group", "supergroup", "channel"
-        "chat_title": chat.get("title"),  # שם הקבוצה (אם רלוונטי)
-        "message_id": message.get("message_id"),
-        "user_id": user_id,
-        "username": from_user.get("username"),
-        "first_name": from_user.get("first_name"),
-        "last_name": from_user.get("last_name"),
-        "is_group": chat_type in ("group", "supergroup"),
-        "is_private": chat_type == "private",
-        "sender_is_admin": sender_is_admin,
-        # פונקציות עזר - מוכנות לשימוש
-        "delete_message": lambda msg_id=None: delete_message(
-            bot_token, chat_id, msg_id or message.get("message_id")
-        ),
-        "ban_user": lambda uid, until=None: ban_user(bot_token, chat_id, uid, until),
-        "kick_user": lambda uid: kick_user(bot_token, chat_id, uid),
-        "mute_user": lambda uid, until=None: mute_user(bot_token, chat_id, uid, until),
-        "unmute_user": lambda uid: unmute_user(bot_token, chat_id, uid),
-        "is_admin": lambda uid: is_user_admin(bot_token, chat_id, uid),
-        "reply": lambda text: send_telegram_message(bot_token, chat_id, text),
-    }
+    return MessageContext(bot_token, message, context_helpers)
 
 
 def _log_activation_if_creator(bot_token, sender_id):
@@ -1087,35 +1413,37 @@ def _log_activation_if_creator(bot_token, sender_id):
     
     bot_token_id = bot_token.split(':')[0] if ':' in bot_token else bot_token[:10]
     
-    flow_doc = db.bot_flows.find_one({"bot_token_id": bot_token_id})
-    if not flow_doc:
+    flow = activation_cache.get(bot_token_id)
+    if flow is None or flow.activated:
         return
     
-    creator_id = flow_doc.get("creator_id")
-    if str(sender_id) != str(creator_id):
+    if str(sender_id) != str(flow.creator_id):
         return
     
-    flow_id = flow_doc["_id"]
+    flow_id = flow.flow_id
     now = datetime.datetime.utcnow()
     
-    if flow_doc.get("status") != "activated":
-        db.bot_flows.update_one(
-            {"_id": flow_id, "status": {"$ne": "activated"}},
-            {
-                "$set": {
-                    "status": "activated",
-                    "updated_at": now,
-                    "final_status": "activated",
-                    "completed_at": now,
-                    "stage_times.stage_5_at": now
-                },
-                "$max": {"current_stage": 5}
-            }
-        )
+    updates = {
+        "status": "activated",
+        "updated_at": now,
+        "final_status": "activated",
+        "completed_at": now,
+        "stage_times.stage_5_at": now
+    }
+    before = db.bot_flows.find_one_and_update(
+        {"_id": flow_id, "status": {"$ne": "activated"}},
+        {"$set": updates, "$max": {"current_stage": 5}},
+        projection=FLOW_ROLLUP_FIELDS,
+        return_document=ReturnDocument.BEFORE
+    )
+    if before:
+        after = apply_flow_updates(before, updates)
+        after["current_stage"] = max(before.get("current_stage") or 0, 5)
+        record_flow_rollup(db, before, after)
     
     unique_key = f"activation_{flow_id}"
     try:
-        db.funnel_events.update_one(
+        result = db.funnel_events.update_one(
             {"_id": unique_key},
             {"$setOnInsert": {
                 "_id": unique_key,
@@ -1127,19 +1455,116 @@ def _log_activation_if_creator(bot_token, sender_id):
             }},
             upsert=True
         )
+        if result.upserted_id is not None:
+            _record_event_rollup(db, "bot_activated_by_creator", now)
+        activation_cache.mark_activated(bot_token_id)
     except Exception as e:
         print(f"⚠️ Error logging activation: {e}")
 
 
+def _is_processable_update(update):
+    """
+    בדיקה זולה האם יש בעדכון משהו שהמנוע מטפל בו
+    (callback query, הודעת טקסט או שינוי חברות בצ'אט - עם chat_id).
+    """
+    if not isinstance(update, dict):
+        return False
+
+    member_update = update.get("chat_member") or update.get("my_chat_member")
+    if member_update:
+        return (member_update.get("chat") or {}).get("id") is not None
+
+    callback_query = update.get("callback_query")
+    if callback_query:
+        message = callback_query.get("message") or {}
+        return (message.get("chat") or {}).get("id") is not None
+
+    message = update.get("message") or {}
+    if not message.get("text"):
+        return False
+    return (message.get("chat") or {}).get("id") is not None
+
+
 @app.route('/<bot_token>', methods=['POST'])
 def telegram_webhook(bot_token):
     """
     מקבל עדכונים מטלגרם עבור בוט ספציפי.
+    במצב אסינכרוני (WEBHOOK_ASYNC_MODE) העדכון נכנס לתור ומעובד ברקע,
+    אחרת הוא מעובד מיד בתוך הבקשה. עם WEBHOOK_INLINE_REPLY הקריאה הראשונה
+    ל-Bot API מוחזרת בגוף התשובה במקום בבקשה נפרדת.
+    """
+    update = request.get_json(silent=True) or {}
+
+    if not _is_processable_update(update):
+        return {"ok": True}
+
+    # טלגרם שולח שוב עדכונים כשה-webhook איטי - מפילים כפילויות לפני ה-dispatch
+    if update_deduplicator and update_deduplicator.is_duplicate(bot_token, update):
+        return {"ok": True}
+
+    if Config.WEBHOOK_ASYNC_MODE:
+        if not update_queue.submit(bot_token, update):
+            # התור מלא - מחזירים שגיאה כדי שטלגרם ישלח את העדכון שוב מאוחר יותר
+            print(f"⚠️ Update queue full, rejecting update for bot {bot_token[:10]}...")
+            if update_deduplicator:
+                update_deduplicator.forget(bot_token, update)
+            return {"ok": False, "error": "queue_full"}, 503
+        return {"ok": True}
+
+    if not Config.WEBHOOK_INLINE_REPLY:
+        _process_update_sync(bot_token, update)
+        return {"ok": True}
+
+    _open_inline_reply(bot_token)
+    try:
+        _process_update_sync(bot_token, update)
+    except BaseException:
+        _flush_inline_reply()
+        raise
+
+    inline_call = _close_inline_reply()
+    if inline_call is None:
+        return {"ok": True}
+
+    # הקריאה הראשונה חוזרת בגוף התשובה - טלגרם מבצע אותה בעצמו
+    method, payload = inline_call
+    return {"method": method, **payload}
+
+
+def _process_update_sync(bot_token, update):
+    """
+    מעבד עדכון בתוך בקשת ה-webhook. אם העיבוד נכשל, הסימון של סינון
+    הכפילויות מבוטל - טלגרם ישלח את העדכון שוב אחרי ה-500.
+    """
+    try:
+        process_update(bot_token, update)
+    except BaseException:
+        if update_deduplicator:
+            update_deduplicator.forget(bot_token, update)
+        raise
+
+
+def process_update(bot_token, update):
+    """
+    מעבד עדכון בודד מטלגרם עבור בוט ספציפי.
+    כתיבות save_state של הפלאגין נאספות ונכתבות יחד בסוף הטיפול.
+    """
+    with state_store.batch():
+        _dispatch_update(bot_token, update)
+
+
+def _dispatch_update(bot_token, update):
+    """
+    מנתב עדכון בודד מטלגרם לפלאגין המתאים.
     טוען את הפלאגין המשויך לטוקן ומפעיל את handle_message שלו.
     תומך גם בטוקן הראשי (מ-config) וגם בבוטים רשומים ב-bot_registry.
     תומך גם ב-callback queries (לחיצות על כפתורים).
     """
-    update = request.get_json(silent=True) or {}
+    # שינוי הרשאות / חברות בצ'אט - מעדכן את מטמון האדמינים בלבד
+    member_update = update.get("chat_member") or update.get("my_chat_member")
+    if member_update:
+        admin_roster.apply_member_update(bot_token, member_update)
+        return
 
     # טיפול ב-callback query (לחיצה על כפתור)
     callback_query = update.get("callback_query")
@@ -1151,7 +1576,7 @@ def telegram_webhook(bot_token):
         user_id = (callback_query.get("from") or {}).get("id")
         
         if chat_id is None:
-            return {"ok": True}
+            return
         
         # רישום פעולת משתמש לאנליטיקס
         log_user_action(user_id, "callback", bot_token, {"data": callback_data})
@@ -1161,13 +1586,13 @@ def telegram_webhook(bot_token):
         
         # טיפול בבוט הראשי
         if config.TELEGRAM_TOKEN and bot_token == config.TELEGRAM_TOKEN:
-            plugins = load_plugins()
-            for plugin in plugins:
-                if hasattr(plugin, "handle_callback"):
+            routing = plugin_catalog.snapshot().routing
+            for plugin in routing.callback_candidates(callback_data):
+                if plugin.on_callback:
                     try:
-                        reply = plugin.handle_callback(callback_data, user_id)
+                        reply = plugin.on_callback(callback_data, user_id)
                     except Exception as e:
-                        print(f"❌ Error in handle_callback for {plugin.__name__}: {e}")
+                        print(f"❌ Error in handle_callback for {plugin.name}: {e}")
                         traceback.print_exc()
                         error_message = "⚠️ אירעה שגיאה פנימית בבוט זה.\nנסה שוב מאוחר יותר או שלח /start"
                         send_telegram_message(bot_token, chat_id, error_message)
@@ -1176,26 +1601,25 @@ def telegram_webhook(bot_token):
                     if reply:
                         send_telegram_message(bot_token, chat_id, reply)
                         break
-            return {"ok": True}
+            return
         
         # טיפול בבוטים רשומים (מ-MongoDB)
         plugin_filename = get_plugin_for_token(bot_token)
         if plugin_filename:
             plugin_name = plugin_filename.replace('.py', '')
-            plugin = load_plugin_by_name(plugin_name)
-            
-            if plugin and hasattr(plugin, "handle_callback"):
-                try:
-                    reply = plugin.handle_callback(callback_data, user_id)
-                    if reply:
-                        send_telegram_message(bot_token, chat_id, reply)
-                except Exception as e:
-                    print(f"❌ Error in handle_callback for {plugin.__name__}: {e}")
-                    traceback.print_exc()
-                    error_message = "⚠️ אירעה שגיאה פנימית בבוט זה.\nנסה שוב מאוחר יותר או שלח /start"
-                    send_telegram_message(bot_token, chat_id, error_message)
+            with use_plugin(plugin_name) as plugin:
+                if plugin and plugin.on_callback:
+                    try:
+                        reply = plugin.on_callback(callback_data, user_id)
+                        if reply:
+                            send_telegram_message(bot_token, chat_id, reply)
+                    except Exception as e:
+                        print(f"❌ Error in handle_callback for {plugin.name}: {e}")
+                        traceback.print_exc()
+                        error_message = "⚠️ אירעה שגיאה פנימית בבוט זה.\nנסה שוב מאוחר יותר או שלח /start"
+                        send_telegram_message(bot_token, chat_id, error_message)
         
-        return {"ok": True}
+        return
 
     # טיפול בהודעות רגילות
     message = update.get("message") or {}
@@ -1203,12 +1627,12 @@ def telegram_webhook(bot_token):
 
     # רק הודעות טקסט מעניינות אותנו כרגע
     if not text:
-        return {"ok": True}
+        return
 
     chat_id = (message.get("chat") or {}).get("id")
     user_id = (message.get("from") or {}).get("id")
     if chat_id is None:
-        return {"ok": True}
+        return
 
     # רישום פעולת משתמש לאנליטיקס
     action_type = "command" if text.startswith("/") else "message"
@@ -1216,18 +1640,14 @@ def telegram_webhook(bot_token):
 
     # בדיקה אם זה הטוקן הראשי (הבוט המקורי)
     if config.TELEGRAM_TOKEN and bot_token == config.TELEGRAM_TOKEN:
-        # התנהגות מקורית - טען את כל הפלאגינים
-        plugins = load_plugins()
-        for plugin in plugins:
-            if hasattr(plugin, "handle_message"):
+        # ניתוב לפי הפקודות שהפלאגינים הצהירו עליהן, ואחריהן שרשרת ה-catch-all
+        routing = plugin_catalog.snapshot().routing
+        for plugin in routing.message_candidates(text):
+            if plugin.on_message:
                 try:
-                    # ננסה לשלוח גם user_id אם הפלאגין תומך
-                    try:
-                        reply = plugin.handle_message(text, user_id)
-                    except TypeError:
-                        reply = plugin.handle_message(text)
+                    reply = plugin.on_message(text, user_id, None)
                 except Exception as e:
-                    print(f"❌ Error in handle_message for {plugin.__name__}: {e}")
+                    print(f"❌ Error in handle_message for {plugin.name}: {e}")
                     traceback.print_exc()
                     # שליחת הודעת שגיאה ידידותית למשתמש
                     error_message = "⚠️ אירעה שגיאה פנימית בבוט זה.\nנסה שוב מאוחר יותר או שלח /start"
@@ -1237,50 +1657,102 @@ def telegram_webhook(bot_token):
                 if reply:
                     send_telegram_message(bot_token, chat_id, reply)
                     break
-        return {"ok": True}
+        return
 
     # בדיקה אם הטוקן רשום ב-MongoDB
     plugin_filename = get_plugin_for_token(bot_token)
     if not plugin_filename:
         print(f"⚠️ Unknown bot token received: {bot_token[:10]}...")
-        return {"ok": True}
+        return
     
     _log_activation_if_creator(bot_token, user_id)
 
     # הסר את סיומת .py אם קיימת
     plugin_name = plugin_filename.replace('.py', '')
     
-    plugin = load_plugin_by_name(plugin_name)
-    if not plugin:
-        print(f"❌ Failed to load plugin for bot: {plugin_name}")
-        return {"ok": True}
+    with use_plugin(plugin_name) as plugin:
+        if not plugin:
+            print(f"❌ Failed to load plugin for bot: {plugin_name}")
+            return
 
-    if hasattr(plugin, "handle_message"):
-        try:
-            # בניית context מלא עבור הפלאגין
-            context = build_message_context(bot_token, message)
-            
-            # ננסה לשלוח עם context, אחר כך user_id, אחר כך בלי כלום
-            reply = None
+        if plugin.on_message:
             try:
-                reply = plugin.handle_message(text, user_id, context)
-            except TypeError:
-                try:
-                    reply = plugin.handle_message(text, user_id)
-                except TypeError:
-                    reply = plugin.handle_message(text)
-            
-            if reply:
-                send_telegram_message(bot_token, chat_id, reply)
-        except Exception as e:
-            # תפיסת כל שגיאה מהפלאגין - רישום לוג והחזרת הודעה ידידותית למשתמש
-            print(f"❌ Error in handle_message for {plugin.__name__}: {e}")
-            traceback.print_exc()
-            # שליחת הודעת שגיאה ידידותית למשתמש
-            error_message = "⚠️ אירעה שגיאה פנימית בבוט זה.\nנסה שוב מאוחר יותר או שלח /start"
-            send_telegram_message(bot_token, chat_id, error_message)
-
-    return {"ok": True}
+                # בניית context מלא עבור הפלאגין
+                context = build_message_context(bot_token, message)
+                
+                # ה-adapter מעביר רק את הארגומנטים שהפלאגין מקבל (נקבע בזמן הטעינה)
+                reply = plugin.on_message(text, user_id, context)
+                
+                if reply:
+                    send_telegram_message(bot_token, chat_id, reply)
+            except Exception as e:
+                # תפיסת כל שגיאה מהפלאגין - רישום לוג והחזרת הודעה ידידותית למשתמש
+                print(f"❌ Error in handle_message for {plugin.name}: {e}")
+                traceback.print_exc()
+                # שליחת הודעת שגיאה ידידותית למשתמש
+                error_message = "⚠️ אירעה שגיאה פנימית בבוט זה.\nנסה שוב מאוחר יותר או שלח /start"
+                send_telegram_message(bot_token, chat_id, error_message)
+
+
+# תור העדכונים למצב אסינכרוני - סדר לפי (בוט, צ'אט), מקביליות בין צ'אטים
+# (ה-workers עולים רק בשימוש הראשון)
+update_queue = UpdateQueue(
+    process_update,
+    workers=Config.WEBHOOK_WORKERS,
+    maxsize=Config.WEBHOOK_QUEUE_SIZE,
+)
+atexit.register(update_queue.drain)
+
+
+def _create_update_deduplicator():
+    """יוצר את שכבת סינון הכפילויות לפי UPDATE_DEDUP_BACKEND."""
+    backend_name = Config.UPDATE_DEDUP_BACKEND
+    if backend_name == "off":
+        return None
+    if backend_name == "mongo":
+        backend = MongoSeenSet(get_mongo_db, window_seconds=Config.UPDATE_DEDUP_WINDOW)
+    else:
+        backend = MemorySeenSet(
+            window_seconds=Config.UPDATE_DEDUP_WINDOW,
+            max_size=Config.UPDATE_DEDUP_MAX_SIZE,
+        )
+    return UpdateDeduplicator(backend)
+
+
+update_deduplicator = _create_update_deduplicator()
+
+
+@app.route('/api/engine/stats')
+@admin_required
+def get_engine_stats():
+    """
+    מחזיר מדדי ביצועים פנימיים של המנוע (תור עדכונים וכו').
+    """
+    return {
+        "webhook_async_mode": Config.WEBHOOK_ASYNC_MODE,
+        "update_queue": update_queue.stats(),
+        "update_dedup": update_deduplicator.stats() if update_deduplicator else None,
+        "telegram_api": telegram_client.stats(),
+        "outbound": outbound_scheduler.stats() if outbound_scheduler else None,
+        "bot_registry": bot_registry_cache.stats(),
+        "user_actions_writer": user_actions_writer.stats(),
+        "activation_cache": activation_cache.stats(),
+        "plugin_catalog": plugin_catalog.stats(),
+        "tenant_plugins": tenant_plugins.stats(),
+        "bot_states": state_store.stats(),
+        "admin_roster": admin_roster.stats(),
+        "api_cache": api_cache.stats(),
+    }
+
+
+@app.route('/api/plugins/reload', methods=['POST'])
+@admin_required
+def reload_plugins():
+    """
+    סורק מחדש את תיקיית plugins ומחליף את ה-snapshot של הקטלוג.
+    """
+    plugin_catalog.reload()
+    return plugin_catalog.stats()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,307 @@
+"""
+Engine Cache - מטמון לתשובות ה-API של הדשבורד
+כל worker של gunicorn חישב מחדש את אותם aggregations, במטמון dict בלי הגבלת
+גודל (days הוא קלט חופשי). כאן:
+    MemoryCache - LRU + TTL בזיכרון התהליך, מוגבל בגודל
+    MongoCache  - מטמון משותף לכל ה-workers, ב-collection עם אינדקס TTL
+    ResponseCache - get_or_compute עם single-flight: כשכמה בקשות מחטיאות
+                    את אותו מפתח יחד, רק אחת מריצה את החישוב
+"""
+
+import datetime
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from pymongo.errors import DuplicateKeyError
+
+
+_MISS = object()
+
+
+class MemoryCache:
+    """
+    מטמון בזיכרון התהליך עם LRU ו-TTL לכל מפתח.
+    """
+
+    def __init__(self, max_size=256):
+        self._max_size = max(1, int(max_size))
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """מחזיר את הערך, או _MISS אם אין / פג תוקף."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return _MISS
+            value, expires_at = entry
+            if now >= expires_at:
+                del self._entries[key]
+                return _MISS
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def size(self):
+        return len(self._entries)
+
+
+class MongoCache:
+    """
+    מטמון משותף לכל ה-workers. הערכים נשמרים כ-JSON (כמו שהם חוזרים ללקוח),
+    ומסמך שפג תוקפו נמחק ע"י אינדקס ה-TTL.
+    """
+
+    def __init__(self, get_db, collection="api_cache"):
+        """
+        Args:
+            get_db: פונקציה שמחזירה חיבור ל-MongoDB (או None)
+            collection: שם ה-collection
+        """
+        self._get_db = get_db
+        self._collection_name = collection
+        self._index_ready = False
+
+    def get(self, key):
+        collection = self._collection()
+        if collection is None:
+            return _MISS
+        try:
+            doc = collection.find_one(
+                {"_id": key, "expires_at": {"$gt": datetime.datetime.utcnow()}}, {"value": 1}
+            )
+        except Exception as e:
+            print(f"⚠️ Failed to read API cache: {e}")
+            return _MISS
+        if not doc:
+            return _MISS
+        return json.loads(doc["value"])
+
+    def set(self, key, value, ttl):
+        collection = self._collection()
+        if collection is None:
+            return
+        expires_at = datetime.datetime.utcnow() + datetime.timedelta(seconds=ttl)
+        try:
+            collection.replace_one(
+                {"_id": key},
+                {"value": json.dumps(value, default=str), "expires_at": expires_at},
+                upsert=True
+            )
+        except Exception as e:
+            print(f"⚠️ Failed to write API cache: {e}")
+
+    def delete(self, key):
+        collection = self._collection()
+        if collection is None:
+            return
+        try:
+            collection.delete_one({"_id": key})
+        except Exception as e:
+            print(f"⚠️ Failed to delete API cache key: {e}")
+
+    def acquire(self, key, lease_seconds):
+        """
+        מנסה לקבל את הזכות לחשב את המפתח (בין workers).
+
+        Returns:
+            bool: True אם ה-worker הזה מחשב, False אם worker אחר כבר מחשב
+        """
+        collection = self._collection()
+        if collection is None:
+            return True
+        lock_id = f"lock:{key}"
+        now = datetime.datetime.utcnow()
+        try:
+            # נעילה של worker שנפל לפני שסיים
+            collection.delete_one({"_id": lock_id, "expires_at": {"$lte": now}})
+            collection.insert_one({
+                "_id": lock_id, "expires_at": now + datetime.timedelta(seconds=lease_seconds)
+            })
+            return True
+        except DuplicateKeyError:
+            return False
+        except Exception as e:
+            print(f"⚠️ Failed to acquire API cache lease: {e}")
+            return True
+
+    def release(self, key):
+        self.delete(f"lock:{key}")
+
+    def size(self):
+        return None
+
+    def _collection(self):
+        db = self._get_db()
+        if db is None:
+            return None
+        collection = db[self._collection_name]
+        if not self._index_ready:
+            try:
+                collection.create_index([("expires_at", 1)], expireAfterSeconds=0)
+                self._index_ready = True
+            except Exception as e:
+                print(f"⚠️ Failed to ensure API cache TTL index: {e}")
+        return collection
+
+
+class _Flight:
+    """חישוב אחד שרץ כרגע עבור מפתח (בתוך התהליך)."""
+
+    __slots__ = ("done", "value")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = _MISS
+
+
+class ResponseCache:
+    """
+    שכבת מטמון לתשובות: backend (זיכרון / MongoDB) + single-flight.
+    עם backend משותף נשמר גם מטמון מקומי קצר, כדי שלא כל בקשה תפנה ל-MongoDB.
+    """
+
+    def __init__(self, backend, ttl=60, local=None, local_ttl=5, lease_seconds=30,
+                 wait_seconds=10):
+        """
+        Args:
+            backend: MemoryCache / MongoCache, או None (בלי מטמון - רק single-flight)
+            ttl: כמה שניות תשובה נשמרת
+            local: MemoryCache מקומי מעל backend משותף (אופציונלי)
+            local_ttl: כמה שניות לסמוך על המטמון המקומי
+            lease_seconds: כמה זמן נעילת חישוב בין workers תקפה
+            wait_seconds: כמה זמן לחכות לחישוב של בקשה / worker אחר לפני שמחשבים בעצמנו
+        """
+        self._backend = backend
+        self._ttl = ttl
+        self._local = local
+        self._local_ttl = min(local_ttl, ttl)
+        self._lease_seconds = lease_seconds
+        self._wait_seconds = wait_seconds
+
+        self._lock = threading.Lock()
+        self._flights = {}
+
+        self._hits = 0
+        self._misses = 0
+        self._computes = 0
+        self._coalesced = 0
+        self._shared_waits = 0
+
+    def get_or_compute(self, key, compute):
+        """
+        מחזיר את הערך מהמטמון, או מחשב אותו (פעם אחת לכל המבקשים במקביל).
+
+        Args:
+            key: מפתח המטמון (כולל שם ה-endpoint והפרמטרים)
+            compute: פונקציה בלי ארגומנטים שמחזירה ערך שניתן לשמור (dict)
+
+        Returns:
+            הערך
+        """
+        value = self._lookup(key)
+        if value is not _MISS:
+            with self._lock:
+                self._hits += 1
+            return value
+
+        with self._lock:
+            self._misses += 1
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                self._coalesced += 1
+
+        if not leader:
+            # בקשה אחרת בתהליך כבר מחשבת - מחכים לתוצאה שלה
+            flight.done.wait(self._wait_seconds)
+            if flight.value is not _MISS:
+                return flight.value
+            return self._compute(key, compute)
+
+        try:
+            flight.value = self._compute_shared(key, compute)
+            return flight.value
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+    def invalidate(self, key):
+        if self._local is not None:
+            self._local.delete(key)
+        if self._backend is not None:
+            self._backend.delete(key)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "backend": type(self._backend).__name__ if self._backend else None,
+                "ttl": self._ttl,
+                "size": self._backend.size() if self._backend else 0,
+                "hits": self._hits,
+                "misses": self._misses,
+                "computes": self._computes,
+                "coalesced": self._coalesced,
+                "shared_waits": self._shared_waits,
+            }
+
+    # === Internal ===
+
+    def _lookup(self, key):
+        if self._backend is None:
+            return _MISS
+        if self._local is not None:
+            value = self._local.get(key)
+            if value is not _MISS:
+                return value
+        value = self._backend.get(key)
+        if value is not _MISS and self._local is not None:
+            self._local.set(key, value, self._local_ttl)
+        return value
+
+    def _compute_shared(self, key, compute):
+        """מחשב כשאין worker אחר שמחשב את אותו מפתח; אחרת מחכה לתוצאה שלו."""
+        acquire = getattr(self._backend, "acquire", None)
+        if acquire is None or acquire(key, self._lease_seconds):
+            try:
+                return self._compute(key, compute)
+            finally:
+                if acquire is not None:
+                    self._backend.release(key)
+
+        with self._lock:
+            self._shared_waits += 1
+        deadline = time.monotonic() + self._wait_seconds
+        while time.monotonic() < deadline:
+            time.sleep(0.1)
+            value = self._lookup(key)
+            if value is not _MISS:
+                return value
+        # ה-worker השני לא סיים בזמן - מחשבים בעצמנו
+        return self._compute(key, compute)
+
+    def _compute(self, key, compute):
+        value = compute()
+        with self._lock:
+            self._computes += 1
+        if self._backend is not None:
+            self._backend.set(key, value, self._ttl)
+            if self._local is not None:
+                self._local.set(key, value, self._local_ttl)
+        return value
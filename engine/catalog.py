@@ -0,0 +1,230 @@
+"""
+Engine Catalog - קטלוג הפלאגינים הטעונים
+במקום לסרוק את תיקיית plugins בכל עדכון ובכל כניסה לדשבורד,
+הקטלוג מחזיק snapshot בלתי ניתן לשינוי של הפלאגינים הטעונים (עם מונה generation).
+ה-snapshot מתחלף רק כשתיקיית הפלאגינים משתנה (inotify, או polling כגיבוי)
+או בקריאה מפורשת ל-reload().
+"""
+
+import ctypes
+import ctypes.util
+import os
+import re
+import struct
+import threading
+import time
+
+from engine.routing import RoutingIndex
+
+
+# inotify (linux/inotify.h)
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_MOVE_SELF = 0x00000800
+_IN_CLOEXEC = 0o2000000
+_WATCH_MASK = (_IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE
+               | _IN_DELETE | _IN_DELETE_SELF | _IN_MOVE_SELF)
+_EVENT_HEADER = struct.Struct("iIII")
+
+# פלאגינים של בוטים רשומים (נוצרו ע"י ה-Architect) - לא חלק מקטלוג המערכת
+TENANT_PLUGIN_PATTERN = re.compile(r"^bot_\d+$")
+
+# כמה זמן לאסוף אירועים נוספים לפני רענון (שמירת קובץ יוצרת כמה אירועים)
+_DEBOUNCE_SECONDS = 0.25
+
+
+class CatalogSnapshot:
+    """מצב הקטלוג ברגע נתון. לא משתנה אחרי שנוצר."""
+
+    __slots__ = ("generation", "plugins", "routing", "loaded_at")
+
+    def __init__(self, generation, plugins):
+        self.generation = generation
+        self.plugins = tuple(plugins)
+        self.routing = RoutingIndex(self.plugins)
+        self.loaded_at = time.time()
+
+
+class PluginCatalog:
+    """
+    קטלוג פלאגינים עם רענון ברקע.
+    הנתיב החם קורא רק ל-snapshot() - בלי גישה לדיסק.
+    """
+
+    def __init__(self, scan_fn, watch_dir, watch_mode="auto", poll_interval=5.0,
+                 include=None):
+        """
+        Args:
+            scan_fn: פונקציה שמסנכרנת את הפלאגינים מול הדיסק ומחזירה רשימת PluginEntry
+            watch_dir: התיקייה שבה נמצאים הפלאגינים
+            watch_mode: auto / inotify / poll / off
+            poll_interval: כל כמה שניות לבדוק את התיקייה במצב polling
+            include: פונקציה (שם פלאגין) -> bool; שינויים בקבצים אחרים לא מרעננים את הקטלוג
+        """
+        self._scan_fn = scan_fn
+        self._include = include or (lambda name: True)
+        self._watch_dir = str(watch_dir)
+        self._watch_mode = watch_mode
+        self._poll_interval = poll_interval
+
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._watcher = None
+        self._watcher_mode = None
+        self._reloads = 0
+
+    def snapshot(self):
+        """
+        מחזיר את ה-snapshot הנוכחי.
+        בקריאה הראשונה מפעיל את ה-watcher וטוען את הפלאגינים
+        (ה-watcher קודם, כדי ששינוי שקורה תוך כדי הסריקה לא ילך לאיבוד).
+        """
+        snapshot = self._snapshot
+        if snapshot is not None:
+            return snapshot
+        self._start_watcher()
+        return self.reload()
+
+    def reload(self):
+        """
+        סורק מחדש את תיקיית הפלאגינים ומחליף את ה-snapshot אם משהו השתנה.
+
+        Returns:
+            CatalogSnapshot: ה-snapshot העדכני
+        """
+        with self._lock:
+            plugins = tuple(self._scan_fn())
+            current = self._snapshot
+            self._reloads += 1
+            if current is not None and _same_plugins(current.plugins, plugins):
+                return current
+            generation = current.generation + 1 if current is not None else 1
+            self._snapshot = CatalogSnapshot(generation, plugins)
+            if current is not None:
+                print(f"🔄 Plugin catalog reloaded: generation {generation}, {len(plugins)} plugins")
+            return self._snapshot
+
+    def stats(self):
+        snapshot = self._snapshot
+        return {
+            "generation": snapshot.generation if snapshot else 0,
+            "plugins": len(snapshot.plugins) if snapshot else 0,
+            "reloads": self._reloads,
+            "watcher": self._watcher_mode,
+        }
+
+    # === Watcher ===
+
+    def _start_watcher(self):
+        if self._watcher is not None or self._watch_mode == "off":
+            return
+        with self._lock:
+            if self._watcher is not None:
+                return
+
+            fd = None
+            if self._watch_mode in ("auto", "inotify"):
+                fd = _inotify_open(self._watch_dir)
+                if fd is None and self._watch_mode == "inotify":
+                    print("⚠️ inotify unavailable - falling back to polling plugins directory")
+
+            if fd is not None:
+                target, args, mode = self._inotify_loop, (fd,), "inotify"
+            else:
+                target, args, mode = self._poll_loop, (_list_plugin_files(self._watch_dir, self._include),), "poll"
+
+            self._watcher = threading.Thread(
+                target=target, args=args, name="plugin-catalog-watcher", daemon=True
+            )
+            self._watcher_mode = mode
+            self._watcher.start()
+
+    def _inotify_loop(self, fd):
+        while True:
+            try:
+                data = os.read(fd, 4096)
+            except OSError as e:
+                print(f"⚠️ Plugin watcher stopped: {e}")
+                self._watcher_mode = "poll"
+                self._poll_loop(_list_plugin_files(self._watch_dir, self._include))
+                return
+
+            if not _has_plugin_event(data, self._include):
+                continue
+
+            # איסוף אירועים נוספים מאותה שמירה / העתקה
+            time.sleep(_DEBOUNCE_SECONDS)
+            self._safe_reload()
+
+    def _poll_loop(self, last_names):
+        while True:
+            time.sleep(self._poll_interval)
+            names = _list_plugin_files(self._watch_dir, self._include)
+            if names != last_names:
+                last_names = names
+                self._safe_reload()
+
+    def _safe_reload(self):
+        try:
+            self.reload()
+        except Exception as e:
+            print(f"⚠️ Plugin catalog reload failed: {e}")
+
+
+def _same_plugins(old, new):
+    return len(old) == len(new) and all(a is b for a, b in zip(old, new))
+
+
+def is_tenant_plugin(plugin_name):
+    """בודק אם שם הפלאגין הוא של בוט רשום (bot_<id>) ולא פלאגין מערכת."""
+    return bool(TENANT_PLUGIN_PATTERN.match(plugin_name))
+
+
+def is_system_plugin(plugin_name):
+    return not plugin_name.startswith("__") and not is_tenant_plugin(plugin_name)
+
+
+def _list_plugin_files(directory, include):
+    try:
+        return frozenset(
+            name for name in os.listdir(directory)
+            if name.endswith(".py") and not name.startswith("__") and include(name[:-3])
+        )
+    except OSError:
+        return frozenset()
+
+
+def _inotify_open(directory):
+    """פותח inotify על התיקייה. מחזיר file descriptor או None אם לא נתמך."""
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        fd = libc.inotify_init1(_IN_CLOEXEC)
+        if fd < 0:
+            return None
+        watch = libc.inotify_add_watch(fd, directory.encode(), _WATCH_MASK)
+        if watch < 0:
+            os.close(fd)
+            return None
+        return fd
+    except (OSError, AttributeError):
+        return None
+
+
+def _has_plugin_event(data, include):
+    """בודק אם בקבוצת אירועי inotify יש שינוי בקובץ .py או בתיקייה עצמה."""
+    offset = 0
+    while offset + _EVENT_HEADER.size <= len(data):
+        _, mask, _, name_len = _EVENT_HEADER.unpack_from(data, offset)
+        offset += _EVENT_HEADER.size
+        name = data[offset:offset + name_len].rstrip(b"\0")
+        offset += name_len
+        if mask & (_IN_DELETE_SELF | _IN_MOVE_SELF):
+            return True
+        if name.endswith(b".py") and not name.startswith(b"__") \
+                and include(name[:-3].decode(errors="replace")):
+            return True
+    return False
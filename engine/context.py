@@ -0,0 +1,134 @@
+"""
+Engine Context - ה-context שמועבר ל-handle_message של בוטים רשומים
+במקום dict שנבנה מראש (כולל בדיקת אדמין ושבע פונקציות עזר) לכל הודעה,
+MessageContext מחשב כל שדה רק כשהפלאגין ניגש אליו. הוא Mapping רגיל,
+כך ש-context["chat_id"], context.get(...) ו-"x" in context ממשיכים לעבוד.
+"""
+
+from collections.abc import Mapping
+
+
+class ChatHelpers:
+    """פונקציות המנוע שה-context חושף לפלאגינים (נקבעות פעם אחת ב-app)."""
+
+    __slots__ = ("delete_message", "ban_user", "kick_user", "mute_user",
+                 "unmute_user", "is_user_admin", "send_message")
+
+    def __init__(self, delete_message, ban_user, kick_user, mute_user,
+                 unmute_user, is_user_admin, send_message):
+        self.delete_message = delete_message
+        self.ban_user = ban_user
+        self.kick_user = kick_user
+        self.mute_user = mute_user
+        self.unmute_user = unmute_user
+        self.is_user_admin = is_user_admin
+        self.send_message = send_message
+
+
+_UNSET = object()
+
+
+class MessageContext(Mapping):
+    """
+    context של הודעה אחת. השדות והפונקציות מחושבים בגישה הראשונה
+    (בדיקת האדמין של השולח נשמרת אחרי החישוב).
+    """
+
+    __slots__ = ("_bot_token", "_message", "_helpers", "_sender_is_admin")
+
+    def __init__(self, bot_token, message, helpers):
+        """
+        Args:
+            bot_token: טוקן הבוט
+            message: אובייקט ההודעה מטלגרם
+            helpers: ChatHelpers עם פונקציות המנוע
+        """
+        self._bot_token = bot_token
+        self._message = message
+        self._helpers = helpers
+        self._sender_is_admin = _UNSET
+
+    def __getitem__(self, key):
+        getter = _FIELDS.get(key)
+        if getter is None:
+            raise KeyError(key)
+        return getter(self)
+
+    def __iter__(self):
+        return iter(_FIELDS)
+
+    def __len__(self):
+        return len(_FIELDS)
+
+    def __contains__(self, key):
+        return key in _FIELDS
+
+    def __repr__(self):
+        return f"MessageContext(chat_id={self._chat_id()!r}, message_id={self._message.get('message_id')!r})"
+
+    # === Fields ===
+
+    def _chat(self):
+        return self._message.get("chat") or {}
+
+    def _from(self):
+        return self._message.get("from") or {}
+
+    def _chat_id(self):
+        return self._chat().get("id")
+
+    def _chat_type(self):
+        return self._chat().get("type", "private")
+
+    def _is_group(self):
+        return self._chat_type() in ("group", "supergroup")
+
+    def _sender_admin(self):
+        if self._sender_is_admin is _UNSET:
+            user_id = self._from().get("id")
+            # בדיקת אדמין רלוונטית רק בקבוצות
+            self._sender_is_admin = bool(
+                self._is_group() and user_id
+                and self._helpers.is_user_admin(self._bot_token, self._chat_id(), user_id)
+            )
+        return self._sender_is_admin
+
+    def _delete_message(self):
+        helpers, bot_token, chat_id = self._helpers, self._bot_token, self._chat_id()
+        message_id = self._message.get("message_id")
+        return lambda msg_id=None: helpers.delete_message(bot_token, chat_id, msg_id or message_id)
+
+    def _bind_chat(self, helper_name):
+        """פונקציית עזר שמקבלת (bot_token, chat_id, ...) - עם הבוט והצ'אט של ההודעה."""
+        helper = getattr(self._helpers, helper_name)
+        bot_token, chat_id = self._bot_token, self._chat_id()
+        return lambda *args: helper(bot_token, chat_id, *args)
+
+
+_FIELDS = {
+    "bot_token": lambda ctx: ctx._bot_token,
+    "chat_id": lambda ctx: ctx._chat_id(),
+    "chat_type": lambda ctx: ctx._chat_type(),  # "private", "group", "supergroup", "channel"
+    "chat_title": lambda ctx: ctx._chat().get("title"),  # שם הקבוצה (אם רלוונטי)
+    "message_id": lambda ctx: ctx._message.get("message_id"),
+    "user_id": lambda ctx: ctx._from().get("id"),
+    "username": lambda ctx: ctx._from().get("username"),
+    "first_name": lambda ctx: ctx._from().get("first_name"),
+    "last_name": lambda ctx: ctx._from().get("last_name"),
+    "is_group": lambda ctx: ctx._is_group(),
+    "is_private": lambda ctx: ctx._chat_type() == "private",
+    "sender_is_admin": lambda ctx: ctx._sender_admin(),
+    # פונקציות עזר - נוצרות רק כשהפלאגין ניגש אליהן
+    "delete_message": lambda ctx: ctx._delete_message(),
+    "ban_user": lambda ctx: _with_optional(ctx._bind_chat("ban_user")),
+    "kick_user": lambda ctx: ctx._bind_chat("kick_user"),
+    "mute_user": lambda ctx: _with_optional(ctx._bind_chat("mute_user")),
+    "unmute_user": lambda ctx: ctx._bind_chat("unmute_user"),
+    "is_admin": lambda ctx: ctx._bind_chat("is_user_admin"),
+    "reply": lambda ctx: ctx._bind_chat("send_message"),
+}
+
+
+def _with_optional(bound):
+    """ban_user / mute_user מקבלים until אופציונלי (None = לצמיתות)."""
+    return lambda uid, until=None: bound(uid, until)
@@ -0,0 +1,178 @@
+"""
+Engine Dedup - סינון עדכונים כפולים מטלגרם
+כשה-webhook איטי טלגרם שולח שוב את אותו עדכון (אותו update_id).
+השכבה הזו זוכרת את העדכונים שכבר התקבלו בחלון זמן מוגבל ומפילה כפילויות.
+"""
+
+import datetime
+import threading
+import time
+from collections import OrderedDict
+
+from pymongo.errors import DuplicateKeyError
+
+
+class MemorySeenSet:
+    """
+    קבוצת מפתחות בזיכרון התהליך, מוגבלת בגודל ובזמן.
+    מתאים ל-worker יחיד (ברירת המחדל של gunicorn).
+    """
+
+    def __init__(self, window_seconds=3600, max_size=10000):
+        self._window = window_seconds
+        self._max_size = max(1, int(max_size))
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, key):
+        """
+        מוסיף מפתח.
+
+        Returns:
+            bool: True אם המפתח חדש, False אם כבר נראה בחלון הזמן
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            if key in self._entries:
+                return False
+            self._entries[key] = now
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+            return True
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def size(self):
+        return len(self._entries)
+
+    def _expire(self, now):
+        # המפתחות מסודרים לפי זמן הוספה - מספיק לבדוק מההתחלה
+        while self._entries:
+            added_at = next(iter(self._entries.values()))
+            if now - added_at < self._window:
+                break
+            self._entries.popitem(last=False)
+
+
+class MongoSeenSet:
+    """
+    קבוצת מפתחות משותפת לכל ה-workers, ב-collection עם אינדקס TTL.
+    ההכנסה עצמה (unique _id) היא הבדיקה - אטומית גם בין תהליכים.
+    """
+
+    def __init__(self, get_db, window_seconds=3600, collection="processed_updates"):
+        """
+        Args:
+            get_db: פונקציה שמחזירה חיבור ל-MongoDB (או None)
+            window_seconds: כמה זמן לזכור עדכון
+            collection: שם ה-collection
+        """
+        self._get_db = get_db
+        self._window = int(window_seconds)
+        self._collection_name = collection
+        self._index_ready = False
+
+    def add(self, key):
+        collection = self._collection()
+        if collection is None:
+            # בלי DB לא נחסום עדכונים
+            return True
+        try:
+            collection.insert_one({"_id": key, "created_at": datetime.datetime.utcnow()})
+            return True
+        except DuplicateKeyError:
+            return False
+
+    def discard(self, key):
+        collection = self._collection()
+        if collection is None:
+            return
+        try:
+            collection.delete_one({"_id": key})
+        except Exception as e:
+            print(f"⚠️ Failed to discard dedup key: {e}")
+
+    def size(self):
+        return None
+
+    def _collection(self):
+        db = self._get_db()
+        if db is None:
+            return None
+        collection = db[self._collection_name]
+        if not self._index_ready:
+            try:
+                collection.create_index([("created_at", 1)], expireAfterSeconds=self._window)
+                self._index_ready = True
+            except Exception as e:
+                print(f"⚠️ Failed to ensure dedup TTL index: {e}")
+        return collection
+
+
+class UpdateDeduplicator:
+    """
+    מסנן עדכונים כפולים לפי (bot_id, update_id) לפני ה-dispatch.
+    """
+
+    def __init__(self, backend):
+        self._backend = backend
+        self._lock = threading.Lock()
+        self._checked = 0
+        self._duplicates = 0
+        self._errors = 0
+
+    @staticmethod
+    def _key(bot_token, update):
+        update_id = update.get("update_id")
+        if update_id is None:
+            return None
+        bot_id = bot_token.split(':')[0] if ':' in bot_token else bot_token[:10]
+        return f"{bot_id}:{update_id}"
+
+    def is_duplicate(self, bot_token, update):
+        """
+        מסמן את העדכון כ"נראה" ומחזיר האם הוא כפילות.
+        שגיאה ב-backend לא חוסמת את העדכון (fail-open).
+        """
+        key = self._key(bot_token, update)
+        if key is None:
+            return False
+
+        try:
+            is_new = self._backend.add(key)
+        except Exception as e:
+            print(f"⚠️ Update dedup check failed: {e}")
+            with self._lock:
+                self._errors += 1
+            return False
+
+        with self._lock:
+            self._checked += 1
+            if not is_new:
+                self._duplicates += 1
+        return not is_new
+
+    def forget(self, bot_token, update):
+        """
+        מבטל את הסימון (למשל כשהעדכון נדחה ואנחנו רוצים שטלגרם ישלח אותו שוב).
+        """
+        key = self._key(bot_token, update)
+        if key is None:
+            return
+        try:
+            self._backend.discard(key)
+        except Exception as e:
+            print(f"⚠️ Failed to forget update: {e}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "backend": type(self._backend).__name__,
+                "checked": self._checked,
+                "duplicates": self._duplicates,
+                "errors": self._errors,
+                "size": self._backend.size(),
+            }
@@ -0,0 +1,212 @@
+"""
+Engine Dispatch - עיבוד עדכוני טלגרם ברקע
+תור חסום (bounded) עם מאגר workers קבוע, כדי שה-webhook יחזיר תשובה מיד.
+עדכונים של אותו צ'אט רצים לפי הסדר, צ'אטים ובוטים שונים רצים במקביל.
+"""
+
+import threading
+import time
+import traceback
+from collections import deque
+
+
+class KeyedExecutor:
+    """
+    מאגר workers שמבצע משימות לפי מפתח:
+    - משימות עם אותו מפתח רצות אחת אחרי השנייה, לפי סדר ההגשה
+    - משימות עם מפתחות שונים רצות במקביל על ה-workers הפנויים
+    - אחרי כל משימה המפתח חוזר לסוף התור, כך שמפתח עמוס לא מרעיב אחרים
+    """
+
+    def __init__(self, workers=4, maxsize=1000, name="keyed-worker"):
+        """
+        Args:
+            workers: מספר ה-threads במאגר
+            maxsize: מספר המשימות המקסימלי שממתינות (בכל המפתחות יחד)
+            name: קידומת לשמות ה-threads
+        """
+        self._workers = max(1, int(workers))
+        self._maxsize = max(1, int(maxsize))
+        self._name = name
+        self._cond = threading.Condition()
+        self._threads = []
+        self._started = False
+
+        # key -> deque של משימות ממתינות
+        self._pending = {}
+        # מפתחות שיש להם משימה ממתינה ואף worker לא מריץ אותם כרגע
+        self._ready = deque()
+        # מפתחות שמשימה שלהם רצה כרגע
+        self._running = set()
+        self._size = 0
+
+        # מדדי backpressure
+        self._enqueued = 0
+        self._processed = 0
+        self._failed = 0
+        self._dropped = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._wait_last = 0.0
+
+    def start(self):
+        """מפעיל את ה-workers (פעם אחת בלבד, lazy)."""
+        if self._started:
+            return
+        with self._cond:
+            if self._started:
+                return
+            for index in range(self._workers):
+                thread = threading.Thread(
+                    target=self._worker_loop,
+                    name=f"{self._name}-{index}",
+                    daemon=True,
+                )
+                thread.start()
+                self._threads.append(thread)
+            self._started = True
+
+    def submit(self, key, fn, *args):
+        """
+        מגיש משימה בלי לחסום.
+
+        Returns:
+            bool: האם המשימה התקבלה (False = המאגר מלא)
+        """
+        self.start()
+        with self._cond:
+            if self._size >= self._maxsize:
+                self._dropped += 1
+                return False
+
+            tasks = self._pending.get(key)
+            if tasks is None:
+                tasks = self._pending[key] = deque()
+            tasks.append((time.monotonic(), fn, args))
+            self._size += 1
+            self._enqueued += 1
+
+            if len(tasks) == 1 and key not in self._running:
+                self._ready.append(key)
+                self._cond.notify()
+        return True
+
+    def drain(self, timeout=10.0):
+        """
+        ממתין עד שכל המשימות הסתיימו (לשימוש בכיבוי השרת).
+
+        Returns:
+            bool: האם המאגר התרוקן לפני ה-timeout
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._size or self._running:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def stats(self):
+        """מחזיר מדדי backpressure של המאגר."""
+        with self._cond:
+            processed = self._processed
+            return {
+                "workers": self._workers,
+                "busy_workers": len(self._running),
+                "max_size": self._maxsize,
+                "queue_depth": self._size,
+                "active_keys": len(self._pending),
+                "enqueued": self._enqueued,
+                "processed": processed,
+                "failed": self._failed,
+                "dropped": self._dropped,
+                "avg_wait_ms": round(self._wait_total / processed * 1000, 2) if processed else 0,
+                "max_wait_ms": round(self._wait_max * 1000, 2),
+                "last_wait_ms": round(self._wait_last * 1000, 2),
+            }
+
+    def _worker_loop(self):
+        while True:
+            with self._cond:
+                while not self._ready:
+                    self._cond.wait()
+                key = self._ready.popleft()
+                self._running.add(key)
+                enqueued_at, fn, args = self._pending[key].popleft()
+                self._size -= 1
+
+            wait = time.monotonic() - enqueued_at
+            failed = False
+            try:
+                fn(*args)
+            except Exception as e:
+                failed = True
+                print(f"❌ Error in background task ({key!r}): {e}")
+                traceback.print_exc()
+
+            with self._cond:
+                self._running.discard(key)
+                if self._pending[key]:
+                    # חזרה לסוף התור - הוגנות בין מפתחות
+                    self._ready.append(key)
+                else:
+                    del self._pending[key]
+
+                self._processed += 1
+                if failed:
+                    self._failed += 1
+                self._wait_total += wait
+                self._wait_last = wait
+                if wait > self._wait_max:
+                    self._wait_max = wait
+                self._cond.notify_all()
+
+
+def update_chat_id(update):
+    """מחזיר את ה-chat_id של עדכון טלגרם (הודעה, callback או שינוי חברות), או None."""
+    member_update = update.get("chat_member") or update.get("my_chat_member")
+    if member_update:
+        return (member_update.get("chat") or {}).get("id")
+    callback_query = update.get("callback_query")
+    if callback_query:
+        message = callback_query.get("message") or {}
+    else:
+        message = update.get("message") or {}
+    return (message.get("chat") or {}).get("id")
+
+
+class UpdateQueue:
+    """
+    תור עדכוני טלגרם מעל KeyedExecutor.
+    המפתח הוא (bot_token, chat_id): הודעות באותו צ'אט מגיעות לפלאגין לפי הסדר,
+    וצ'אט עמוס אחד לא עוצר את שאר הבוטים והצ'אטים.
+    """
+
+    def __init__(self, handler, workers=4, maxsize=1000):
+        """
+        Args:
+            handler: פונקציה (bot_token, update) שמעבדת עדכון בודד
+            workers: מספר ה-threads שמרוקנים את התור
+            maxsize: מספר העדכונים המקסימלי שממתינים בתור
+        """
+        self._handler = handler
+        self._executor = KeyedExecutor(workers=workers, maxsize=maxsize, name="update-worker")
+
+    def submit(self, bot_token, update):
+        """
+        מכניס עדכון לתור בלי לחסום.
+
+        Returns:
+            bool: האם העדכון נכנס לתור (False = התור מלא)
+        """
+        key = (bot_token, update_chat_id(update))
+        return self._executor.submit(key, self._handler, bot_token, update)
+
+    def drain(self, timeout=10.0):
+        """ממתין עד שכל העדכונים בתור עובדו."""
+        return self._executor.drain(timeout)
+
+    def stats(self):
+        """מחזיר מדדי backpressure של התור."""
+        return self._executor.stats()
@@ -0,0 +1,299 @@
+"""
+Engine Funnel - סיכומים יומיים של משפך ההמרה (funnel_rollups)
+במקום $group על כל bot_flows בחלון הזמן בכל בקשה ל-/api/funnel, כל שינוי
+ב-flow מעדכן ($inc) מסמך סיכום קטן ליום, ו-/api/funnel מסכם לכל היותר
+days מסמכים.
+
+לכל יום נשמרים שני מסמכים:
+    start:<day>    - ה-flows שנוצרו באותו יום (cohort לפי התחלה)
+    activity:<day> - ה-flows שהעדכון האחרון שלהם היה באותו יום
+ו-events:<day> - מונה לכל סוג אירוע ב-funnel_events.
+כל flow נספר בדיוק פעם אחת בכל חלון: כשהוא מתעדכן, התרומה הקודמת שלו
+מופחתת והחדשה מתווספת. משתמשים ייחודיים נספרים ב-UniqueCounter
+(HyperLogLog שמתמזג בין ימים, ומדויק לחלונות קטנים). את המשתמש אי אפשר
+להוריד מהיום שה-flow יצא ממנו, ולכן היום הזה מסומן כלא מדויק ומספר
+המשתמשים בחלון activity שכולל אותו מדווח כקירוב (unique_users_exact=False).
+
+חלון של days ימים הוא ימים קלנדריים (UTC): היום ו-(days - 1) הימים שלפניו,
+ולא "24 * days שעות אחורה" כמו לפני הסיכומים - חלון של יום אחד מתחיל בחצות.
+התקנה קיימת שעוברת לסיכומים: backfill_rollups בונה אותם פעם אחת מ-bot_flows
+ומ-funnel_events (בניה מלאה - גם ימים שכבר יש בהם מסמך חלקי מעדכונים חיים),
+ומסמן ב-engine_migrations שהבניה הושלמה. המנוע מריץ אותו בעלייה, ועדכון חי
+לא נכתב לפני שהבניה הושלמה - אחרת היה נספר פעמיים או נמחק בבניה.
+"""
+
+import datetime
+
+from pymongo import UpdateOne
+
+from engine.hll import UniqueCounter
+from engine.migrations import run_once
+
+
+ROLLUPS_COLLECTION = "funnel_rollups"
+WINDOWS = ("start", "activity")
+MAX_STAGE = 5
+# חלון מקסימלי (בימים) - days מגיע מה-query string
+MAX_WINDOW_DAYS = 365
+
+# השדות של flow שהסיכומים נגזרים מהם
+FLOW_ROLLUP_FIELDS = {
+    "user_id": 1, "current_stage": 1, "final_status": 1, "created_at": 1, "updated_at": 1,
+}
+
+# סימון ב-engine_migrations שהסיכומים נבנו מהנתונים הקיימים
+BACKFILL_MIGRATION = "backfill:funnel_rollups"
+
+_default_unique = UniqueCounter()
+
+COUNT_FIELDS = ("total_flows",) + tuple(
+    f"reached_stage_{stage}" for stage in range(1, MAX_STAGE + 1)
+) + ("cancelled", "failed")
+
+
+def day_key(timestamp):
+    """מחרוזת היום (UTC) של חותמת זמן."""
+    return timestamp.strftime("%Y-%m-%d")
+
+
+def flow_counts(flow):
+    """
+    התרומה של flow אחד למוני המשפך.
+
+    Returns:
+        dict: שדה -> 0/1 (לכל אחד מ-COUNT_FIELDS)
+    """
+    stage = flow.get("current_stage") or 0
+    final_status = flow.get("final_status")
+    counts = {"total_flows": 1}
+    for reached in range(1, MAX_STAGE + 1):
+        counts[f"reached_stage_{reached}"] = int(stage >= reached)
+    counts["cancelled"] = int(final_status == "cancelled")
+    counts["failed"] = int(final_status == "failed")
+    return counts
+
+
+def apply_flow_updates(before, updates):
+    """מחזיר את מצב ה-flow אחרי $set של updates (שדות מקוננים כמו stage_times.* לא נדרשים)."""
+    after = dict(before)
+    after.update({field: value for field, value in updates.items() if "." not in field})
+    return after
+
+
+def record_flow_change(db, before, after, unique=None):
+    """
+    מעדכן את הסיכומים היומיים לפי שינוי ב-flow.
+
+    Args:
+        db: חיבור ל-MongoDB
+        before: ה-flow לפני השינוי (FLOW_ROLLUP_FIELDS), או None ל-flow חדש
+        after: ה-flow אחרי השינוי
+        unique: UniqueCounter לספירת המשתמשים
+    """
+    unique = unique or _default_unique
+    new_counts = flow_counts(after)
+    old_counts = flow_counts(before) if before else {}
+    user_id = after.get("user_id")
+    operations = []
+
+    # cohort לפי יום היצירה - ה-flow נשאר באותו יום, רק המונים משתנים
+    created_at = after.get("created_at")
+    if created_at is not None:
+        operations.extend(_rollup_updates(
+            unique, "start", day_key(created_at), _diff(new_counts, old_counts), user_id
+        ))
+
+    # פעילות אחרונה - ה-flow עובר מהיום של העדכון הקודם ליום של העדכון הנוכחי
+    updated_at = after.get("updated_at")
+    previous_at = before.get("updated_at") if before else None
+    if updated_at is not None:
+        if previous_at is not None and day_key(previous_at) != day_key(updated_at):
+            operations.extend(_rollup_updates(
+                unique, "activity", day_key(previous_at), _diff({}, old_counts), None,
+                inexact=True
+            ))
+            old_counts = {}
+        operations.extend(_rollup_updates(
+            unique, "activity", day_key(updated_at), _diff(new_counts, old_counts), user_id
+        ))
+
+    if operations:
+        # ordered - הוספה לרשימה המדויקת מניחה שמסמך היום כבר נוצר
+        db[ROLLUPS_COLLECTION].bulk_write(operations, ordered=True)
+
+
+def record_event(db, event_type, timestamp):
+    """מגדיל את מונה סוג האירוע ביום שלו."""
+    day = day_key(timestamp)
+    db[ROLLUPS_COLLECTION].update_one(
+        {"_id": f"events:{day}"},
+        {"$inc": {f"events.{event_type}": 1}, "$setOnInsert": {"window": "events", "day": day}},
+        upsert=True
+    )
+
+
+def clamp_days(days):
+    """מגביל את אורך החלון ל-1..MAX_WINDOW_DAYS."""
+    return max(1, min(MAX_WINDOW_DAYS, int(days)))
+
+
+def window_days(days, now=None):
+    """רשימת ימי החלון (UTC) - היום ו-(days - 1) הימים שלפניו, לכל היותר MAX_WINDOW_DAYS."""
+    today = (now or datetime.datetime.utcnow()).date()
+    return [day_key(today - datetime.timedelta(days=offset)) for offset in range(clamp_days(days))]
+
+
+def get_funnel_totals(db, window, days, unique=None, now=None):
+    """
+    מסכם את מסמכי הסיכום של החלון.
+
+    Args:
+        window: "start" או "activity"
+        days: מספר הימים (כולל היום)
+        unique: UniqueCounter לספירת המשתמשים
+
+    Returns:
+        dict: COUNT_FIELDS -> סכום, unique_users (מספר) ו-unique_users_exact
+    """
+    unique = unique or _default_unique
+    totals = {field: 0 for field in COUNT_FIELDS}
+    docs = list(db[ROLLUPS_COLLECTION].find(
+        {"_id": {"$in": [f"{window}:{day}" for day in window_days(days, now)]}}
+    ))
+    for doc in docs:
+        for field in COUNT_FIELDS:
+            totals[field] += doc.get(field, 0)
+    totals["unique_users"], totals["unique_users_exact"] = unique.count(docs)
+    return totals
+
+
+def get_event_totals(db, days, now=None):
+    """סכום מוני האירועים בחלון. Returns: dict event_type -> count."""
+    totals = {}
+    docs = db[ROLLUPS_COLLECTION].find(
+        {"_id": {"$in": [f"events:{day}" for day in window_days(days, now)]}}, {"events": 1}
+    )
+    for doc in docs:
+        for event_type, count in (doc.get("events") or {}).items():
+            totals[event_type] = totals.get(event_type, 0) + count
+    return totals
+
+
+def rebuild_rollups(db, unique=None):
+    """
+    בונה מחדש את כל funnel_rollups מ-bot_flows ומ-funnel_events הקיימים.
+
+    Returns:
+        dict: flows, event_days, documents (מספר מסמכי הסיכום שנכתבו)
+    """
+    documents, result = _build_documents(db, unique or _default_unique)
+    db[ROLLUPS_COLLECTION].delete_many({})
+    insert_rollup_documents(db[ROLLUPS_COLLECTION], documents)
+    return dict(result, documents=len(documents))
+
+
+def backfill_rollups(db, unique=None):
+    """
+    בונה את funnel_rollups מהנתונים הקיימים, פעם אחת לכל DB.
+    הבניה מלאה (כמו rebuild_rollups): מסמכי יום שנכתבו לפניה מעדכונים חיים
+    מכילים רק חלק מה-flows של היום, והם נבנים מחדש ולא נשמרים כמו שהם.
+    worker שמגיע בזמן שהבניה רצה ב-worker אחר ממתין לסיומה.
+
+    Returns:
+        dict או None: כמו rebuild_rollups, או None אם הבניה כבר הושלמה
+    """
+    def backfill():
+        result = rebuild_rollups(db, unique)
+        print(f"✅ Backfilled {result['documents']} funnel rollup documents "
+              f"from {result['flows']} flows")
+        return result
+
+    return run_once(db, BACKFILL_MIGRATION, backfill)
+
+
+def _build_documents(db, unique):
+    """מסמכי הסיכום מ-bot_flows ומ-funnel_events. Returns: (documents, {flows, event_days})."""
+    rollups = {}
+    flows = 0
+    for flow in db.bot_flows.find({}, FLOW_ROLLUP_FIELDS):
+        flows += 1
+        counts = flow_counts(flow)
+        for window, timestamp in (("start", flow.get("created_at")),
+                                  ("activity", flow.get("updated_at"))):
+            if timestamp is None:
+                continue
+            day = day_key(timestamp)
+            doc = rollups.setdefault(f"{window}:{day}", {
+                "window": window, "day": day, "users": set(),
+                **{field: 0 for field in COUNT_FIELDS},
+            })
+            for field, value in counts.items():
+                doc[field] += value
+            if flow.get("user_id") is not None:
+                doc["users"].add(flow["user_id"])
+
+    event_days = 0
+    for row in db.funnel_events.aggregate([
+        {"$group": {
+            "_id": {
+                "day": {"$dateToString": {"format": "%Y-%m-%d", "date": "$timestamp"}},
+                "event_type": "$event_type",
+            },
+            "count": {"$sum": 1},
+        }},
+    ], allowDiskUse=True):
+        day = row["_id"]["day"]
+        if day is None or not row["_id"].get("event_type"):
+            continue
+        doc = rollups.get(f"events:{day}")
+        if doc is None:
+            event_days += 1
+            doc = rollups[f"events:{day}"] = {"window": "events", "day": day, "events": {}}
+        doc["events"][row["_id"]["event_type"]] = row["count"]
+
+    documents = []
+    for rollup_id, doc in rollups.items():
+        users = doc.pop("users", None)
+        if users is not None:
+            doc.update(unique.build_document(users))
+        documents.append({"_id": rollup_id, **doc})
+    return documents, {"flows": flows, "event_days": event_days}
+
+
+def insert_rollup_documents(collection, documents):
+    """
+    מכניס מסמכי סיכום במנות (כדי לא לשלוח בקשה אחת ענקית).
+
+    Returns:
+        int: מספר המסמכים שנכתבו
+    """
+    for start in range(0, len(documents), 1000):
+        collection.insert_many(documents[start:start + 1000], ordered=False)
+    return len(documents)
+
+
+def _diff(new_counts, old_counts):
+    inc = {}
+    for field in COUNT_FIELDS:
+        delta = new_counts.get(field, 0) - old_counts.get(field, 0)
+        if delta:
+            inc[field] = delta
+    return inc
+
+
+def _rollup_updates(unique, window, day, inc, user_id, inexact=False):
+    rollup_id = f"{window}:{day}"
+    user_ids = [user_id] if user_id is not None else []
+    update = unique.sketch_update(user_ids)
+    update["$setOnInsert"] = {**update.get("$setOnInsert", {}), "window": window, "day": day}
+    if inc:
+        update["$inc"] = inc
+        if inexact:
+            update.update(unique.inexact_update())
+    if len(update) == 1:
+        return []
+    operations = [UpdateOne({"_id": rollup_id}, update, upsert=True)]
+    exact = unique.exact_update(rollup_id, user_ids)
+    if exact is not None:
+        operations.append(exact)
+    return operations
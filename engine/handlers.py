@@ -0,0 +1,71 @@
+"""
+Engine Handlers - התאמת חתימות של handlers בפלאגינים
+פלאגינים ישנים מגדירים handle_message(text) או handle_message(text, user_id),
+וחדשים handle_message(text, user_id=None, context=None).
+החתימה נבדקת פעם אחת בזמן הטעינה ונשמר adapter שקורא ל-handler ישירות,
+כך שה-dispatch הוא קריאה אחת ו-TypeError אמיתי מתוך הפלאגין לא נבלע.
+"""
+
+import inspect
+
+from engine.routing import read_routes
+
+
+class PluginEntry:
+    """פלאגין טעון במטמון: המודול, ה-adapters ל-handlers שלו והצהרות הניתוב."""
+
+    __slots__ = ("name", "module", "on_message", "on_callback", "routes")
+
+    def __init__(self, name, module):
+        self.name = name
+        self.module = module
+        self.on_message = build_adapter(module, "handle_message", 3)
+        self.on_callback = build_adapter(module, "handle_callback", 2)
+        self.routes = read_routes(module)
+
+
+def build_adapter(module, attr_name, max_args):
+    """
+    בונה adapter ל-handler לפי מספר הארגומנטים שהחתימה שלו מקבלת.
+
+    Args:
+        module: מודול הפלאגין
+        attr_name: שם ה-handler (handle_message / handle_callback)
+        max_args: מספר הארגומנטים שהמנוע יכול להעביר
+
+    Returns:
+        callable שמקבל תמיד max_args ארגומנטים, או None אם אין handler מתאים
+    """
+    handler = getattr(module, attr_name, None)
+    if not callable(handler):
+        return None
+
+    arg_count = _accepted_arg_count(handler, max_args)
+    if arg_count is None:
+        print(f"⚠️ {module.__name__}.{attr_name} has an unsupported signature - skipped")
+        return None
+
+    if arg_count == max_args:
+        return handler
+
+    def adapter(*args):
+        return handler(*args[:arg_count])
+
+    return adapter
+
+
+def _accepted_arg_count(handler, max_args):
+    """מחזיר את המספר הגדול ביותר של ארגומנטים פוזיציונליים (עד max_args) שה-handler מקבל."""
+    try:
+        signature = inspect.signature(handler)
+    except (TypeError, ValueError):
+        # אין חתימה זמינה (למשל פונקציה מ-C) - נעביר את כל הארגומנטים
+        return max_args
+
+    for count in range(max_args, 0, -1):
+        try:
+            signature.bind(*([None] * count))
+            return count
+        except TypeError:
+            continue
+    return None
@@ -0,0 +1,200 @@
+"""
+Engine HLL - ספירת משתמשים ייחודיים בקירוב (HyperLogLog)
+במקום לשמור / לקבץ את כל מזהי המשתמשים כדי לספור אותם, כל מסמך יומי מחזיק
+sketch קטן: מילון רגיסטרים {"<index>": rank} שמתעדכן ב-$max. sketches של כמה
+ימים מתמזגים (מקסימום לכל רגיסטר), כך שספירה על חלון של N ימים היא מיזוג של
+N מסמכים קטנים בלי תלות בכמות המשתמשים.
+
+לחלונות קטנים נשמרת גם רשימה מדויקת של מזהים, עד exact_limit לכל יום.
+כל עוד לכל יום בחלון יש רשימה, אף יום לא הגיע לתקרה ואף יום לא סומן כלא
+מדויק (משתמש שיצא ממנו - אי אפשר להוריד מזהה מה-sketch) - הספירה מדויקת.
+מסמך בלי רשימה (נכתב לפני שהיא נוספה) נחשב לא ידוע, והספירה היא קירוב.
+"""
+
+import hashlib
+import math
+
+from pymongo import UpdateOne
+
+
+MIN_PRECISION = 4
+MAX_PRECISION = 16
+_HASH_BITS = 64
+
+
+def precision_for_error(error):
+    """
+    מחזיר את ה-precision (מספר ביטים לאינדקס) שמבטיח סטיית תקן של error לכל היותר.
+    סטיית התקן של HyperLogLog היא בערך 1.04 / sqrt(2 ** precision).
+    """
+    if error <= 0:
+        return MAX_PRECISION
+    registers = (1.04 / error) ** 2
+    return max(MIN_PRECISION, min(MAX_PRECISION, math.ceil(math.log2(registers))))
+
+
+def register_for(value, precision):
+    """
+    מחזיר את (index, rank) שהערך מעדכן.
+
+    Returns:
+        tuple: אינדקס הרגיסטר, ומיקום הביט הדולק הראשון אחרי ביטי האינדקס
+    """
+    digest = hashlib.blake2b(str(value).encode(), digest_size=8).digest()
+    hashed = int.from_bytes(digest, "big")
+    index = hashed >> (_HASH_BITS - precision)
+    rest_bits = _HASH_BITS - precision
+    rest = hashed & ((1 << rest_bits) - 1)
+    rank = rest_bits - rest.bit_length() + 1
+    return index, rank
+
+
+def fold(registers, from_precision, to_precision):
+    """ממיר רגיסטרים ל-precision נמוך יותר (כדי למזג sketches שנשמרו בהגדרות שונות)."""
+    if from_precision == to_precision:
+        return dict(registers)
+    shift = from_precision - to_precision
+    folded = {}
+    for key, rank in registers.items():
+        index = int(key)
+        dropped = index & ((1 << shift) - 1)
+        # ביטי האינדקס שנחתכו הופכים לתחילת הסיומת שממנה מחושב ה-rank
+        new_rank = shift - dropped.bit_length() + 1 if dropped else shift + rank
+        new_key = str(index >> shift)
+        if new_rank > folded.get(new_key, 0):
+            folded[new_key] = new_rank
+    return folded
+
+
+def estimate(registers, precision):
+    """
+    מעריך את מספר הערכים הייחודיים מהרגיסטרים (רגיסטר שחסר במילון = 0).
+    לקרדינליות נמוכה משמש linear counting (התיקון הסטנדרטי של HyperLogLog).
+    """
+    m = 1 << precision
+    if not registers:
+        return 0
+    alpha = {16: 0.673, 32: 0.697, 64: 0.709}.get(m, 0.7213 / (1 + 1.079 / m))
+    zeros = m - len(registers)
+    harmonic = zeros + sum(2.0 ** -rank for rank in registers.values())
+    raw = alpha * m * m / harmonic
+    if raw <= 2.5 * m and zeros:
+        return int(round(m * math.log(m / zeros)))
+    return int(round(raw))
+
+
+class UniqueCounter:
+    """
+    ספירת משתמשים ייחודיים במסמכים יומיים: sketch בשדה hll (+ hll_p)
+    ורשימה מדויקת בשדה users עד exact_limit.
+    """
+
+    def __init__(self, precision=12, exact_limit=1000,
+                 sketch_field="hll", exact_field="users"):
+        """
+        Args:
+            precision: מספר ביטי האינדקס (2 ** precision רגיסטרים)
+            exact_limit: כמה מזהים לשמור במדויק לכל יום (0 = תמיד קירוב)
+            sketch_field: שם השדה של הרגיסטרים
+            exact_field: שם השדה של הרשימה המדויקת
+        """
+        self.precision = max(MIN_PRECISION, min(MAX_PRECISION, int(precision)))
+        self.exact_limit = max(0, int(exact_limit))
+        self.sketch_field = sketch_field
+        self.exact_field = exact_field
+        self.inexact_field = f"{exact_field}_inexact"
+
+    @classmethod
+    def for_error(cls, error, exact_limit=1000):
+        """יוצר מונה עם precision שמתאים לסטיית התקן המבוקשת (למשל 0.02 = 2%)."""
+        return cls(precision_for_error(error), exact_limit)
+
+    def sketch_update(self, user_ids):
+        """
+        עדכון ה-sketch עבור המשתמשים - לשילוב ב-update של מסמך היום.
+
+        Returns:
+            dict: {"$max": {...}, "$setOnInsert": {hll_p, users: []}}
+                  (בלי $max אם אין משתמשים)
+        """
+        registers = {}
+        for user_id in user_ids:
+            index, rank = register_for(user_id, self.precision)
+            field = f"{self.sketch_field}.{index}"
+            if rank > registers.get(field, 0):
+                registers[field] = rank
+        # מסמך חדש נוצר עם רשימה ריקה, כדי שמסמך בלי רשימה יזוהה כמסמך ישן
+        on_insert = {self.exact_field: []} if self.exact_limit else {}
+        if not registers:
+            return {"$setOnInsert": on_insert} if on_insert else {}
+        on_insert[f"{self.sketch_field}_p"] = self.precision
+        return {"$max": registers, "$setOnInsert": on_insert}
+
+    def inexact_update(self):
+        """
+        מסמן שמשתמשים ברשימה / ב-sketch כבר לא שייכים ליום (הספירה שלו היא חסם עליון).
+
+        Returns:
+            dict: {"$set": {users_inexact: True}}
+        """
+        return {"$set": {self.inexact_field: True}}
+
+    def exact_update(self, doc_id, user_ids, collection_filter=None):
+        """
+        הוספה לרשימה המדויקת, רק כל עוד היא קטנה מהתקרה (המסמך כבר קיים - בלי upsert).
+
+        Returns:
+            UpdateOne או None
+        """
+        user_ids = sorted(set(user_ids))
+        if not user_ids or not self.exact_limit:
+            return None
+        selector = dict(collection_filter or {}, _id=doc_id)
+        selector[f"{self.exact_field}.{self.exact_limit - 1}"] = {"$exists": False}
+        return UpdateOne(selector, {"$addToSet": {self.exact_field: {"$each": user_ids}}})
+
+    def build_document(self, user_ids):
+        """שדות ה-sketch והרשימה המדויקת למסמך שנבנה מחדש (backfill)."""
+        registers = {}
+        for user_id in user_ids:
+            index, rank = register_for(user_id, self.precision)
+            if rank > registers.get(str(index), 0):
+                registers[str(index)] = rank
+        doc = {self.sketch_field: registers, f"{self.sketch_field}_p": self.precision}
+        if self.exact_limit:
+            # רשימה באורך התקרה מסמנת שהיום לא נשמר במלואו
+            doc[self.exact_field] = sorted(user_ids)[:self.exact_limit]
+        return doc
+
+    def count(self, docs):
+        """
+        מספר המשתמשים הייחודיים באיחוד של מסמכי החלון.
+
+        Returns:
+            tuple: (count, exact) - exact=True אם הספירה מדויקת
+        """
+        docs = list(docs)
+        if self.exact_limit and all(
+                isinstance(doc.get(self.exact_field), list)
+                and len(doc[self.exact_field]) < self.exact_limit for doc in docs):
+            users = set()
+            for doc in docs:
+                users.update(doc[self.exact_field])
+            return len(users), not any(doc.get(self.inexact_field) for doc in docs)
+
+        sketches = [
+            (doc.get(self.sketch_field) or {}, doc.get(f"{self.sketch_field}_p", self.precision))
+            for doc in docs
+        ]
+        precision = min([p for _, p in sketches] + [self.precision])
+        merged = {}
+        for registers, sketch_precision in sketches:
+            for key, rank in fold(registers, sketch_precision, precision).items():
+                if rank > merged.get(key, 0):
+                    merged[key] = rank
+        return estimate(merged, precision), False
+
+    def projection(self):
+        """השדות שצריך לשלוף מהמסמכים היומיים בשביל count()."""
+        return {self.sketch_field: 1, f"{self.sketch_field}_p": 1, self.exact_field: 1,
+                self.inexact_field: 1}
@@ -0,0 +1,387 @@
+"""
+Engine Maintenance - אינדקסים ומיגרציות ל-MongoDB
+
+bot_states נשאל תמיד לפי {bot_id, user_id, key} (ולפי {bot_id, user_id} לטעינת
+כל המפתחות של משתמש). האינדקס המורכב הייחודי כאן משרת את שתי השאילתות
+ומונע מסמכים כפולים לאותו מפתח.
+
+תכנון sharding (כשה-collection יגדל מעבר לשרת אחד):
+    shard key: {bot_id: 1, user_id: 1}
+    - כל השאילתות כוללות את שניהם, כך שכל קריאה / כתיבה הולכת ל-shard אחד
+    - כל המפתחות של משתמש באותו chunk (טעינה בשאילתה אחת נשארת מקומית)
+    - האינדקס הייחודי מתחיל ב-shard key, כנדרש לאינדקס ייחודי ב-collection מבוזר
+
+שימוש:
+    python -m engine.maintenance indexes              # דוח אינדקסים חסרים
+    python -m engine.maintenance dedupe-states        # בדיקה בלבד (dry run)
+    python -m engine.maintenance dedupe-states --apply
+    python -m engine.maintenance ensure-indexes
+    python -m engine.maintenance state-sizes          # גודל המצב לפי בוט
+    python -m engine.maintenance gc-state-blobs --apply
+    python -m engine.maintenance rebuild-funnel-rollups  # בניה מחדש של funnel_rollups
+    python -m engine.maintenance rebuild-activity-rollups
+    python -m engine.maintenance refresh-webhooks     # setWebhook מחדש לכל הבוטים הרשומים
+"""
+
+import argparse
+import datetime
+import os
+import sys
+
+import gridfs
+from pymongo.errors import OperationFailure
+
+from engine.activity import rebuild_activity_rollups
+from engine.funnel import rebuild_rollups
+from engine.hll import UniqueCounter
+from engine.telegram_api import WEBHOOK_ALLOWED_UPDATES
+
+
+BOT_STATES_INDEX_NAME = "bot_states_bot_user_key"
+BOT_STATES_INDEX_KEYS = [("bot_id", 1), ("user_id", 1), ("key", 1)]
+
+# אינדקסים שהמנוע מנהל: collection -> [(name, keys, options)]
+EXPECTED_INDEXES = {
+    "bot_states": [
+        (BOT_STATES_INDEX_NAME, BOT_STATES_INDEX_KEYS, {"unique": True}),
+    ],
+}
+
+_DUPLICATE_KEY_CODE = 11000
+
+# ה-bucket ב-GridFS שבו StateStore שומר ערכים גדולים
+STATE_BLOB_COLLECTION = "bot_state_blobs"
+
+# סימון ב-engine_migrations לרישום מחדש של ה-webhooks - רשימה אחרת של
+# allowed_updates היא פעולה חדשה, שרצה שוב בעלייה הבאה
+WEBHOOK_REFRESH_MIGRATION = "refresh_webhooks:" + ",".join(WEBHOOK_ALLOWED_UPDATES)
+
+# gc-state-blobs לא נוגע בקבצים צעירים מזה (כתיבה שהמסמך שלה עוד לא נכתב)
+GC_GRACE_SECONDS = 3600
+
+
+class DuplicateStateKeysError(RuntimeError):
+    """האינדקס הייחודי על bot_states לא נוצר כי יש מסמכים כפולים לאותו מפתח."""
+
+    def __init__(self):
+        super().__init__(
+            "bot_states has duplicate (bot_id, user_id, key) documents - "
+            "run: python -m engine.maintenance dedupe-states --apply"
+        )
+
+
+def ensure_state_indexes(db):
+    """
+    יוצר את האינדקס הייחודי על bot_states (Idempotent).
+
+    Returns:
+        bool: True - האינדקס קיים
+
+    Raises:
+        DuplicateStateKeysError: יש מסמכים כפולים שמונעים את יצירת האינדקס
+    """
+    try:
+        db.bot_states.create_index(BOT_STATES_INDEX_KEYS, name=BOT_STATES_INDEX_NAME, unique=True)
+        return True
+    except OperationFailure as e:
+        if e.code == _DUPLICATE_KEY_CODE:
+            raise DuplicateStateKeysError() from e
+        raise
+
+
+def find_missing_indexes(db):
+    """
+    משווה את האינדקסים הקיימים לאינדקסים שהמנוע מצפה להם.
+
+    Returns:
+        list: [{"collection", "name", "keys"}] של אינדקסים חסרים
+    """
+    missing = []
+    for collection_name, indexes in EXPECTED_INDEXES.items():
+        existing = {
+            tuple((field, int(direction)) for field, direction in info["key"])
+            for info in db[collection_name].index_information().values()
+        }
+        for name, keys, _ in indexes:
+            if tuple(keys) not in existing:
+                missing.append({"collection": collection_name, "name": name, "keys": keys})
+    return missing
+
+
+def dedupe_bot_states(db, apply=False):
+    """
+    מוצא מסמכים כפולים ב-bot_states לאותו (bot_id, user_id, key) ומוחק את העודפים.
+    נשמר המסמך שנכתב אחרון: לפי updated_at (כל כתיבה של StateStore מעדכנת
+    אותו, כך שמסמך בלי updated_at לא נכתב מאז ומפסיד), ובין מסמכים ישנים -
+    לפי זמן היצירה שב-_id. הסדר הטבעי של ה-collection לא מעיד איזה ערך נכתב אחרון.
+    ערכים ב-GridFS של המסמכים שנמחקים נמחקים גם הם.
+
+    Args:
+        db: חיבור ל-MongoDB
+        apply: False = רק דוח, True = מחיקה בפועל
+
+    Returns:
+        dict: groups (מספר מפתחות כפולים), removed (מסמכים שנמחקו / יימחקו),
+              blobs (ערכים ב-GridFS שנמחקו / יימחקו)
+    """
+    pipeline = [
+        {"$group": {
+            "_id": {"bot_id": "$bot_id", "user_id": "$user_id", "key": "$key"},
+            "ids": {"$push": "$_id"},
+            "count": {"$sum": 1},
+        }},
+        {"$match": {"count": {"$gt": 1}}},
+    ]
+
+    groups = 0
+    extra_ids = []
+    extra_blobs = []
+    for group in db.bot_states.aggregate(pipeline, allowDiskUse=True):
+        groups += 1
+        docs = sorted(
+            db.bot_states.find({"_id": {"$in": group["ids"]}}, {"updated_at": 1, "blob_id": 1}),
+            key=_written_at
+        )
+        keep = docs[-1]
+        for doc in docs[:-1]:
+            extra_ids.append(doc["_id"])
+            if doc.get("blob_id") is not None and doc.get("blob_id") != keep.get("blob_id"):
+                extra_blobs.append(doc["blob_id"])
+
+    removed = 0
+    if apply:
+        # מחיקה במנות כדי לא לבנות שאילתה ענקית אחת
+        for start in range(0, len(extra_ids), 1000):
+            result = db.bot_states.delete_many({"_id": {"$in": extra_ids[start:start + 1000]}})
+            removed += result.deleted_count
+        fs = gridfs.GridFS(db, collection=STATE_BLOB_COLLECTION)
+        for blob_id in extra_blobs:
+            fs.delete(blob_id)
+    else:
+        removed = len(extra_ids)
+
+    return {"groups": groups, "removed": removed, "blobs": len(extra_blobs), "applied": apply}
+
+
+def _written_at(doc):
+    """מפתח מיון לפי זמן הכתיבה האחרונה (updated_at, ואם אין - זמן היצירה שב-_id)."""
+    written = doc.get("updated_at")
+    if written is not None:
+        return (1, written, str(doc["_id"]))
+    created = getattr(doc["_id"], "generation_time", None)
+    created = created.replace(tzinfo=None) if created else datetime.datetime.min
+    return (0, created, str(doc["_id"]))
+
+
+def state_size_report(db, limit=20):
+    """
+    גודל המצב השמור לכל בוט - כדי לזהות בוטים שהמצב שלהם גדל בלי גבול.
+    מסמך בלי שדה size (נכתב לפני שנוספה הספירה) נמדד לפי גודל ה-BSON שלו.
+
+    Args:
+        db: חיבור ל-MongoDB
+        limit: כמה בוטים ומפתחות להחזיר (הגדולים ביותר)
+
+    Returns:
+        dict: bots (לפי בוט: סה"כ בתים, מפתחות, מפתחות ב-GridFS, המפתח הגדול),
+              keys (המפתחות הגדולים ביותר)
+    """
+    size_expr = {"$ifNull": ["$size", {"$bsonSize": "$$ROOT"}]}
+
+    bots = list(db.bot_states.aggregate([
+        {"$project": {"bot_id": 1, "key": 1, "blob_id": 1, "bytes": size_expr}},
+        {"$sort": {"bytes": -1}},
+        {"$group": {
+            "_id": "$bot_id",
+            "total_bytes": {"$sum": "$bytes"},
+            "keys": {"$sum": 1},
+            "offloaded": {"$sum": {"$cond": [{"$ifNull": ["$blob_id", False]}, 1, 0]}},
+            "largest_key": {"$first": "$key"},
+            "largest_bytes": {"$first": "$bytes"},
+        }},
+        {"$sort": {"total_bytes": -1}},
+        {"$limit": limit},
+    ], allowDiskUse=True))
+
+    keys = list(db.bot_states.aggregate([
+        {"$project": {"_id": 0, "bot_id": 1, "user_id": 1, "key": 1, "bytes": size_expr}},
+        {"$sort": {"bytes": -1}},
+        {"$limit": limit},
+    ], allowDiskUse=True))
+
+    return {"bots": bots, "keys": keys}
+
+
+def gc_state_blobs(db, apply=False, grace_seconds=GC_GRACE_SECONDS):
+    """
+    מוחק מ-GridFS ערכים שאף מסמך ב-bot_states כבר לא מפנה אליהם.
+    StateStore מוחק בעצמו ערך שנדרס; זו רשת ביטחון לתהליך שנפל בין הכתיבה
+    ל-GridFS לבין הכתיבה למסמך (או בין הכתיבה למחיקת הערך הקודם).
+    StateStore כותב את הקובץ ל-GridFS לפני המסמך, ולכן רק קבצים שהועלו
+    לפני יותר מ-grace_seconds נחשבים יתומים - כתיבה שבדרך לא נמחקת.
+
+    Args:
+        grace_seconds: גיל מינימלי (לפי uploadDate) של קובץ שמותר למחוק
+
+    Returns:
+        dict: orphans (מספר הקבצים היתומים), applied
+    """
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=grace_seconds)
+    candidates = [
+        doc["_id"] for doc in db[STATE_BLOB_COLLECTION].files.find(
+            {"uploadDate": {"$lt": cutoff}}, {"_id": 1}
+        )
+    ]
+    referenced = set(db.bot_states.distinct("blob_id", {"blob_id": {"$ne": None}}))
+    fs = gridfs.GridFS(db, collection=STATE_BLOB_COLLECTION)
+
+    orphans = [blob_id for blob_id in candidates if blob_id not in referenced]
+    if apply:
+        for blob_id in orphans:
+            fs.delete(blob_id)
+    return {"orphans": len(orphans), "applied": apply}
+
+
+def refresh_webhooks(db, client, base_url, allowed_updates=WEBHOOK_ALLOWED_UPDATES):
+    """
+    רושם מחדש את ה-webhook של כל בוט ב-bot_registry עם allowed_updates.
+    setWebhook בלי allowed_updates שומר את הרשימה הקודמת, ולכן בוטים שנרשמו
+    לפני ש-chat_member נוסף לרשימה לא מקבלים אותו עד שנרשמים מחדש.
+
+    Args:
+        client: TelegramClient
+        base_url: הכתובת הציבורית של השרת (RENDER_EXTERNAL_URL)
+
+    Returns:
+        dict: bots, updated, failed
+    """
+    tokens = [doc["token"] for doc in db.bot_registry.find({}, {"token": 1}) if doc.get("token")]
+    updated = 0
+    for token in tokens:
+        bot_id = token.split(":")[0]
+        try:
+            response = client.post(
+                token, "setWebhook",
+                {"url": f"{base_url.rstrip('/')}/{token}", "allowed_updates": allowed_updates}
+            )
+        except Exception as e:
+            print(f"⚠️ Failed to refresh webhook of {bot_id}: {e}")
+            continue
+        if response.ok:
+            updated += 1
+        else:
+            print(f"⚠️ Failed to refresh webhook of {bot_id}: {response.status_code} {response.text}")
+    return {"bots": len(tokens), "updated": updated, "failed": len(tokens) - updated}
+
+
+def _unique_counter():
+    """UniqueCounter לפי אותן הגדרות שהמנוע משתמש בהן."""
+    return UniqueCounter.for_error(
+        float(os.environ.get("UNIQUE_USERS_ERROR", 0.02)),
+        exact_limit=int(os.environ.get("UNIQUE_USERS_EXACT_LIMIT", 1000)),
+    )
+
+
+def _connect():
+    from dotenv import load_dotenv
+    from pymongo import MongoClient
+
+    load_dotenv()
+    mongo_uri = os.environ.get("MONGO_URI")
+    if not mongo_uri:
+        print("❌ MONGO_URI is not configured")
+        sys.exit(1)
+    client = MongoClient(mongo_uri, serverSelectionTimeoutMS=5000)
+    return client.get_database("bot_factory")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m engine.maintenance")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("indexes", help="report missing indexes")
+    dedupe = commands.add_parser("dedupe-states", help="remove duplicate bot_states documents")
+    dedupe.add_argument("--apply", action="store_true", help="actually delete (default: dry run)")
+    commands.add_parser("ensure-indexes", help="create the bot_states unique index")
+    sizes = commands.add_parser("state-sizes", help="report bot_states size per bot")
+    sizes.add_argument("--limit", type=int, default=20)
+    gc = commands.add_parser("gc-state-blobs", help="delete unreferenced offloaded state values")
+    gc.add_argument("--apply", action="store_true", help="actually delete (default: dry run)")
+    gc.add_argument("--grace-seconds", type=int, default=GC_GRACE_SECONDS,
+                    help="only delete blobs uploaded at least this long ago")
+    commands.add_parser("rebuild-funnel-rollups", help="rebuild funnel_rollups from bot_flows")
+    commands.add_parser("rebuild-activity-rollups", help="rebuild user_action_rollups from user_actions")
+    commands.add_parser("refresh-webhooks", help="re-register every registered bot's webhook")
+    args = parser.parse_args(argv)
+
+    db = _connect()
+
+    if args.command == "indexes":
+        missing = find_missing_indexes(db)
+        if not missing:
+            print("✅ All expected indexes exist")
+        for index in missing:
+            print(f"⚠️ Missing index on {index['collection']}: {index['name']} {index['keys']}")
+        return 1 if missing else 0
+
+    if args.command == "dedupe-states":
+        result = dedupe_bot_states(db, apply=args.apply)
+        verb = "Removed" if args.apply else "Would remove"
+        print(f"{verb} {result['removed']} duplicate documents in {result['groups']} keys "
+              f"({result['blobs']} offloaded values)")
+        return 0
+
+    if args.command == "ensure-indexes":
+        try:
+            ensure_state_indexes(db)
+        except DuplicateStateKeysError as e:
+            print(f"❌ {e}")
+            return 1
+        print("✅ bot_states index is in place")
+        return 0
+
+    if args.command == "state-sizes":
+        report = state_size_report(db, limit=args.limit)
+        print("Bots by state size:")
+        for bot in report["bots"]:
+            print(f"  {bot['_id']}: {bot['total_bytes']} bytes in {bot['keys']} keys "
+                  f"({bot['offloaded']} in GridFS), largest: {bot['largest_key']} "
+                  f"({bot['largest_bytes']} bytes)")
+        print("Largest keys:")
+        for key in report["keys"]:
+            print(f"  {key.get('bot_id')} / {key.get('user_id')} / {key.get('key')}: {key['bytes']} bytes")
+        return 0
+
+    if args.command == "gc-state-blobs":
+        result = gc_state_blobs(db, apply=args.apply, grace_seconds=args.grace_seconds)
+        verb = "Deleted" if args.apply else "Would delete"
+        print(f"{verb} {result['orphans']} unreferenced state blobs")
+        return 0
+
+    if args.command == "rebuild-funnel-rollups":
+        result = rebuild_rollups(db, _unique_counter())
+        print(f"✅ Rebuilt {result['documents']} rollup documents from {result['flows']} flows "
+              f"and {result['event_days']} days of events")
+        return 0
+
+    if args.command == "rebuild-activity-rollups":
+        result = rebuild_activity_rollups(db, _unique_counter())
+        print(f"✅ Rebuilt {result['days']} daily user_actions rollups")
+        return 0
+
+    if args.command == "refresh-webhooks":
+        from engine.telegram_api import TelegramClient
+
+        base_url = os.environ.get("RENDER_EXTERNAL_URL")
+        if not base_url:
+            print("❌ RENDER_EXTERNAL_URL is not configured")
+            return 1
+        result = refresh_webhooks(db, TelegramClient(), base_url)
+        print(f"✅ Re-registered {result['updated']}/{result['bots']} webhooks "
+              f"({result['failed']} failed)")
+        return 1 if result["failed"] else 0
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
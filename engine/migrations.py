@@ -0,0 +1,115 @@
+"""
+Engine Migrations - פעולות חד-פעמיות שרצות בעליית השרת
+פעולה (למשל רישום מחדש של webhooks או בניית סיכומים מהנתונים הקיימים)
+רצה פעם אחת לכל DB, גם כשכמה workers עולים יחד.
+
+כל פעולה מסומנת במסמך ב-engine_migrations לפי שם:
+    status: running - worker תפס את הפעולה עד lease_until
+    status: done    - הפעולה הסתיימה; לא תרוץ שוב
+worker אחר שמגיע בזמן שהפעולה רצה ממתין לסיומה (wait=True), כדי שלא
+ימשיך לפני שהיא הושלמה. worker שנפל באמצע משחרר את הפעולה כשה-lease פג.
+"""
+
+import datetime
+import os
+import socket
+import threading
+import time
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+
+MIGRATIONS_COLLECTION = "engine_migrations"
+
+_locks_guard = threading.Lock()
+# name -> Lock: פעולה אחת רצה פעם אחת גם בין threads של אותו תהליך
+_locks = {}
+# פעולות שכבר ידוע שהסתיימו - בלי לשאול את ה-DB שוב
+_completed = set()
+
+
+def run_once(db, name, fn, wait=True, lease_seconds=600, poll_interval=1.0):
+    """
+    מריץ את fn() אם הפעולה name עוד לא הושלמה ב-DB הזה.
+
+    Args:
+        db: חיבור ל-MongoDB
+        name: שם הפעולה (ה-_id של מסמך הסימון)
+        fn: הפעולה עצמה
+        wait: להמתין ל-worker אחר שמריץ את הפעולה כרגע (False - לוותר)
+        lease_seconds: אחרי כמה זמן worker אחר רשאי לתפוס פעולה שלא הסתיימה
+        poll_interval: כל כמה שניות לבדוק אם ה-worker האחר סיים
+
+    Returns:
+        התוצאה של fn, או None אם הפעולה כבר הושלמה (או רצה ב-worker אחר ו-wait=False)
+
+    Raises:
+        כל שגיאה של fn - הפעולה משתחררת ותרוץ שוב בעלייה הבאה
+    """
+    if name in _completed:
+        return None
+
+    with _locks_guard:
+        lock = _locks.setdefault(name, threading.Lock())
+
+    with lock:
+        if name in _completed:
+            return None
+
+        collection = db[MIGRATIONS_COLLECTION]
+        owner = f"{socket.gethostname()}:{os.getpid()}"
+        while True:
+            status = _claim(collection, name, owner, lease_seconds)
+            if status == "done":
+                _completed.add(name)
+                return None
+            if status == "claimed":
+                break
+            if not wait:
+                return None
+            time.sleep(poll_interval)
+
+        try:
+            result = fn()
+        except Exception:
+            # שחרור מיידי - הפעולה תרוץ שוב בעלייה הבאה
+            collection.update_one(
+                {"_id": name, "owner": owner},
+                {"$set": {"status": "failed", "lease_until": datetime.datetime.utcnow()}}
+            )
+            raise
+
+        collection.update_one(
+            {"_id": name, "owner": owner},
+            {"$set": {"status": "done", "finished_at": datetime.datetime.utcnow()},
+             "$unset": {"lease_until": ""}}
+        )
+        _completed.add(name)
+        return result
+
+
+def _claim(collection, name, owner, lease_seconds):
+    """
+    מנסה לתפוס את הפעולה.
+
+    Returns:
+        str: "done" (הושלמה), "claimed" (נתפסה ע"י ה-worker הזה) או "busy" (רצה ב-worker אחר)
+    """
+    doc = collection.find_one({"_id": name}, {"status": 1})
+    if doc and doc.get("status") == "done":
+        return "done"
+
+    now = datetime.datetime.utcnow()
+    try:
+        # מסמך קיים שלא תואם (lease בתוקף) גורם ל-upsert לנסות ליצור _id כפול
+        collection.find_one_and_update(
+            {"_id": name, "status": {"$ne": "done"},
+             "$or": [{"lease_until": {"$lt": now}}, {"lease_until": {"$exists": False}}]},
+            {"$set": {"status": "running", "owner": owner, "started_at": now,
+                      "lease_until": now + datetime.timedelta(seconds=lease_seconds)}},
+            upsert=True, return_document=ReturnDocument.AFTER
+        )
+        return "claimed"
+    except DuplicateKeyError:
+        return "busy"
@@ -0,0 +1,456 @@
+"""
+Engine Rate Limit - קצב שליחה יוצא לטלגרם
+טלגרם מגביל בערך ל-30 הודעות בשנייה לבוט, הודעה אחת בשנייה לצ'אט פרטי
+ו-20 הודעות בדקה לקבוצה. המתזמן כאן מחזיק תור שליחה לכל צ'אט,
+מקצב לפי token buckets (לבוט ולצ'אט) ומכבד retry_after מתשובות 429.
+
+תשובת 429 חוסמת רק את הצ'אט שקיבל אותה - צ'אט אחד שהוצף לא עוצר את שאר
+הצ'אטים של הבוט. רק כשכמה צ'אטים של אותו בוט מקבלים 429 באותו זמן (או
+כשהקריאה לא שייכת לצ'אט) המגבלה כנראה של הבוט כולו, ואז נחסם גם דלי הבוט.
+
+קריאות שהתוצאה שלהן נדרשת (deleteMessage, banChatMember וכו') עוברות באותו
+תור דרך call(), שממתין לתשובה. קריאה בלי צ'אט (answerCallbackQuery) צורכת
+רק מדלי הבוט.
+"""
+
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+
+
+class TokenBucket:
+    """
+    דלי אסימונים קלאסי: rate אסימונים בשנייה, עד capacity אסימונים צבורים.
+    """
+
+    __slots__ = ("rate", "capacity", "tokens", "updated", "blocked_until")
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def delay(self, now):
+        """כמה שניות עד שיהיה אסימון זמין (0 = זמין עכשיו)."""
+        self._refill(now)
+        wait = self.blocked_until - now
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return max(0.0, wait)
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def block(self, until):
+        """חוסם את הדלי עד זמן מסוים (retry_after מטלגרם)."""
+        self.blocked_until = max(self.blocked_until, until)
+
+    def is_idle(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity and now >= self.blocked_until
+
+
+class _PendingCall:
+    """קריאה שממתינה לתשובה (call). השדות מתעדכנים עם הנעילה של המתזמן."""
+
+    __slots__ = ("done", "response", "error", "started", "cancelled")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None
+        self.error = None
+        self.started = False
+        self.cancelled = False
+
+
+class OutboundScheduler:
+    """
+    תור שליחה יוצא עם הגבלת קצב לכל בוט ולכל צ'אט.
+    - הודעות לאותו צ'אט נשלחות לפי הסדר
+    - כשאין אסימון ההודעה ממתינה בתור (לא נזרקת)
+    - תשובת 429 מחזירה את ההודעה לראש התור וחוסמת את הצ'אט עד retry_after
+    """
+
+    def __init__(self, send_fn, bot_rate=30, bot_burst=30, chat_rate=1.0, chat_burst=3,
+                 group_rate=20 / 60, group_burst=3, workers=2, max_queue=10000, max_retries=5,
+                 bot_wide_chats=3, call_timeout=30):
+        """
+        Args:
+            send_fn: פונקציה (bot_token, method, payload) שמחזירה requests.Response
+            bot_rate / bot_burst: קצב ופרץ מקסימלי לבוט
+            chat_rate / chat_burst: קצב ופרץ לצ'אט פרטי
+            group_rate / group_burst: קצב ופרץ לקבוצה
+            workers: מספר ה-threads ששולחים בפועל
+            max_queue: מספר ההודעות המקסימלי שממתינות (בכל הבוטים יחד)
+            max_retries: מספר ניסיונות חוזרים על 429 לפני ויתור על הודעה
+            bot_wide_chats: מכמה צ'אטים חסומים בו-זמנית (של אותו בוט) 429 נחשב
+                            מגבלה של הבוט כולו וחוסם גם את דלי הבוט
+            call_timeout: כמה שניות call() מחכה שהקריאה תצא מהתור
+        """
+        self._send_fn = send_fn
+        self._bot_limits = (bot_rate, bot_burst)
+        self._chat_limits = (chat_rate, chat_burst)
+        self._group_limits = (group_rate, group_burst)
+        self._workers = max(1, int(workers))
+        self._max_queue = max(1, int(max_queue))
+        self._max_retries = max_retries
+        self._bot_wide_chats = max(1, int(bot_wide_chats))
+        self._call_timeout = call_timeout
+
+        self._cond = threading.Condition()
+        self._threads = []
+        self._started = False
+        self._seq = itertools.count()
+
+        self._bot_buckets = {}
+        self._chat_buckets = {}
+        # bot_token -> {chat_id: blocked_until} של צ'אטים שקיבלו 429
+        self._limited_chats = {}
+        # (bot_token, chat_id) -> deque של [enqueued_at, method, payload, attempts, _PendingCall]
+        self._queues = {}
+        # heap של (ready_at, seq, key) - כל מפתח מופיע לכל היותר פעם אחת
+        self._schedule = []
+        self._scheduled = set()
+        self._in_flight = set()
+        self._size = 0
+        self._last_prune = time.monotonic()
+
+        # bot_id -> מונים לכל tenant
+        self._tenant_stats = {}
+
+    def start(self):
+        """מפעיל את ה-workers (פעם אחת בלבד, lazy)."""
+        if self._started:
+            return
+        with self._cond:
+            if self._started:
+                return
+            for index in range(self._workers):
+                thread = threading.Thread(
+                    target=self._worker_loop,
+                    name=f"outbound-sender-{index}",
+                    daemon=True,
+                )
+                thread.start()
+                self._threads.append(thread)
+            self._started = True
+
+    def submit(self, bot_token, chat_id, method, payload):
+        """
+        מכניס קריאה לתור השליחה של הצ'אט (chat_id=None - קריאה שלא שייכת לצ'אט).
+
+        Returns:
+            bool: האם הקריאה נכנסה לתור (False = התור הכללי מלא)
+        """
+        return self._enqueue(bot_token, chat_id, method, payload, None)
+
+    def call(self, bot_token, chat_id, method, payload, timeout=None):
+        """
+        שולח קריאה דרך תור הצ'אט וממתין לתשובה. הקריאה לא עוקפת הודעות שממתינות
+        לפניה, צורכת אסימונים ונשלחת שוב אחרי retry_after על 429.
+
+        Returns:
+            requests.Response (גם 429 אחרי max_retries), או None אם התור מלא
+            או שהקריאה לא יצאה מהתור תוך timeout (ואז היא מבוטלת)
+
+        Raises:
+            Exception: שגיאת הרשת של השליחה
+        """
+        pending = _PendingCall()
+        if not self._enqueue(bot_token, chat_id, method, payload, pending):
+            return None
+        if not pending.done.wait(self._call_timeout if timeout is None else timeout):
+            with self._cond:
+                if not pending.started:
+                    pending.cancelled = True
+                    print(f"⚠️ Telegram {method} for bot {bot_token[:10]}... "
+                          f"timed out in the outbound queue")
+                    return None
+            # כבר נשלחה - מחכים לתשובה (מוגבל ב-timeout של ה-HTTP)
+            pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.response
+
+    def _enqueue(self, bot_token, chat_id, method, payload, pending):
+        self.start()
+        key = (bot_token, chat_id)
+        with self._cond:
+            stats = self._tenant(bot_token)
+            if self._size >= self._max_queue:
+                stats["dropped"] += 1
+                return False
+
+            queue = self._queues.get(key)
+            if queue is None:
+                queue = self._queues[key] = deque()
+            queue.append([time.monotonic(), method, payload, 0, pending])
+            self._size += 1
+            stats["queued"] += 1
+            stats["pending"] += 1
+
+            if key not in self._in_flight:
+                self._schedule_key(key, time.monotonic())
+        return True
+
+    def try_acquire(self, bot_token, chat_id):
+        """
+        תופס אסימון לשליחה מיידית מחוץ לתור (למשל תשובה בגוף ה-webhook).
+        מצליח רק אם אין הודעות ממתינות לצ'אט הזה, כדי לא לעקוף אותן.
+
+        Returns:
+            bool: האם מותר לשלוח עכשיו
+        """
+        key = (bot_token, chat_id)
+        now = time.monotonic()
+        with self._cond:
+            if self._queues.get(key) or key in self._in_flight:
+                return False
+            if self._delay(key, now) > 0:
+                return False
+            self._take(key, now)
+            self._tenant(bot_token)["inline"] += 1
+        return True
+
+    def drain(self, timeout=10.0):
+        """ממתין עד שכל ההודעות בתור נשלחו (לשימוש בכיבוי השרת)."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._size or self._in_flight:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def stats(self):
+        """מחזיר מדדי תור ו-latency לכל tenant (לפי bot_id)."""
+        with self._cond:
+            tenants = {}
+            for bot_id, entry in self._tenant_stats.items():
+                sent = entry["sent_from_queue"]
+                tenants[bot_id] = {
+                    "queued": entry["queued"],
+                    "pending": entry["pending"],
+                    "sent": entry["sent"],
+                    "inline": entry["inline"],
+                    "rate_limited": entry["rate_limited"],
+                    "bot_blocks": entry["bot_blocks"],
+                    "failed": entry["failed"],
+                    "dropped": entry["dropped"],
+                    "avg_queue_ms": round(entry["wait_total"] / sent * 1000, 2) if sent else 0,
+                    "max_queue_ms": round(entry["wait_max"] * 1000, 2),
+                }
+            return {
+                "queue_depth": self._size,
+                "max_queue": self._max_queue,
+                "active_chats": len(self._queues),
+                "tenants": tenants,
+            }
+
+    # === Internal ===
+
+    def _tenant(self, bot_token):
+        bot_id = bot_token.split(':')[0] if ':' in bot_token else bot_token[:10]
+        stats = self._tenant_stats.get(bot_id)
+        if stats is None:
+            stats = self._tenant_stats[bot_id] = {
+                "queued": 0, "pending": 0, "sent": 0, "inline": 0, "sent_from_queue": 0,
+                "rate_limited": 0, "bot_blocks": 0, "failed": 0, "dropped": 0,
+                "wait_total": 0.0, "wait_max": 0.0,
+            }
+        return stats
+
+    def _bot_bucket(self, bot_token):
+        bucket = self._bot_buckets.get(bot_token)
+        if bucket is None:
+            bucket = self._bot_buckets[bot_token] = TokenBucket(*self._bot_limits)
+        return bucket
+
+    def _chat_bucket(self, key):
+        """דלי הצ'אט, או None לקריאה שלא שייכת לצ'אט."""
+        if key[1] is None:
+            return None
+        bucket = self._chat_buckets.get(key)
+        if bucket is None:
+            chat_id = key[1]
+            # chat_id שלילי = קבוצה / ערוץ
+            is_group = isinstance(chat_id, int) and chat_id < 0
+            limits = self._group_limits if is_group else self._chat_limits
+            bucket = self._chat_buckets[key] = TokenBucket(*limits)
+        return bucket
+
+    def _delay(self, key, now):
+        chat_bucket = self._chat_bucket(key)
+        delay = self._bot_bucket(key[0]).delay(now)
+        if chat_bucket is not None:
+            delay = max(delay, chat_bucket.delay(now))
+        return delay
+
+    def _take(self, key, now):
+        self._bot_bucket(key[0]).take(now)
+        chat_bucket = self._chat_bucket(key)
+        if chat_bucket is not None:
+            chat_bucket.take(now)
+
+    def _schedule_key(self, key, ready_at):
+        if key in self._scheduled:
+            return
+        self._scheduled.add(key)
+        heapq.heappush(self._schedule, (ready_at, next(self._seq), key))
+        self._cond.notify()
+
+    def _next_job(self):
+        """ממתין למפתח שמוכן לשליחה ושיש לו אסימונים. נקרא עם הנעילה."""
+        while True:
+            if not self._schedule:
+                self._cond.wait(30)
+                self._prune_idle_buckets()
+                continue
+
+            ready_at, _, key = self._schedule[0]
+            now = time.monotonic()
+            if ready_at > now:
+                self._cond.wait(ready_at - now)
+                continue
+
+            heapq.heappop(self._schedule)
+            self._scheduled.discard(key)
+            queue = self._queues.get(key)
+            # קריאות call() שפג הזמן שלהן לא נשלחות
+            while queue and queue[0][4] is not None and queue[0][4].cancelled:
+                queue.popleft()
+                self._size -= 1
+                self._tenant(key[0])["pending"] -= 1
+                self._cond.notify_all()
+            if not queue:
+                self._queues.pop(key, None)
+                continue
+
+            delay = self._delay(key, now)
+            if delay > 0:
+                self._schedule_key(key, now + delay)
+                continue
+
+            self._take(key, now)
+            job = queue.popleft()
+            if job[4] is not None:
+                job[4].started = True
+            self._size -= 1
+            self._tenant(key[0])["pending"] -= 1
+            self._in_flight.add(key)
+            return key, job
+
+    def _worker_loop(self):
+        while True:
+            with self._cond:
+                key, job = self._next_job()
+
+            bot_token, chat_id = key
+            enqueued_at, method, payload, attempts, pending = job
+            retry_after = None
+            failed = False
+            response = None
+            error = None
+            try:
+                response = self._send_fn(bot_token, method, payload)
+                if response is not None and response.status_code == 429:
+                    retry_after = _parse_retry_after(response)
+                elif response is not None and not response.ok:
+                    print(f"⚠️ Telegram {method} failed: {response.status_code} {response.text[:200]}")
+            except Exception as e:
+                failed = True
+                error = e
+                print(f"❌ Failed sending Telegram {method}: {e}")
+
+            now = time.monotonic()
+            with self._cond:
+                self._in_flight.discard(key)
+                stats = self._tenant(bot_token)
+                queue = self._queues.get(key)
+
+                if retry_after is not None and attempts < self._max_retries:
+                    # 429 - ההודעה חוזרת לראש התור ונחסום עד retry_after
+                    stats["rate_limited"] += 1
+                    job[3] = attempts + 1
+                    queue.appendleft(job)
+                    self._size += 1
+                    stats["pending"] += 1
+                    until = now + retry_after
+                    if pending is not None:
+                        pending.started = False
+                    chat_bucket = self._chat_bucket(key)
+                    if chat_bucket is not None:
+                        chat_bucket.block(until)
+                    if self._is_bot_wide(bot_token, chat_id, now, until):
+                        stats["bot_blocks"] += 1
+                        self._bot_bucket(bot_token).block(until)
+                    print(f"⏳ Telegram 429 for bot {bot_token[:10]}... chat {chat_id}, "
+                          f"retry after {retry_after}s")
+                else:
+                    if failed or retry_after is not None:
+                        stats["failed"] += 1
+                    else:
+                        stats["sent"] += 1
+                    stats["sent_from_queue"] += 1
+                    wait = now - enqueued_at
+                    stats["wait_total"] += wait
+                    if wait > stats["wait_max"]:
+                        stats["wait_max"] = wait
+                    if pending is not None:
+                        pending.response = response
+                        pending.error = error
+                        pending.done.set()
+
+                if queue:
+                    self._schedule_key(key, now)
+                else:
+                    self._queues.pop(key, None)
+                self._cond.notify_all()
+
+    def _is_bot_wide(self, bot_token, chat_id, now, until):
+        """
+        האם 429 הוא מגבלה של הבוט כולו ולא של הצ'אט. נקרא עם הנעילה.
+
+        Returns:
+            bool: True אם הקריאה לא שייכת לצ'אט, או שכמה צ'אטים של הבוט חסומים עכשיו
+        """
+        if chat_id is None:
+            return True
+        limited = self._limited_chats.setdefault(bot_token, {})
+        for other in [other for other, blocked_until in limited.items() if blocked_until <= now]:
+            del limited[other]
+        limited[chat_id] = until
+        return len(limited) >= self._bot_wide_chats
+
+    def _prune_idle_buckets(self):
+        """מנקה דליים של צ'אטים שלא היו פעילים (מלאים ואין להם תור)."""
+        now = time.monotonic()
+        if now - self._last_prune < 60:
+            return
+        self._last_prune = now
+        for key in list(self._chat_buckets):
+            if key not in self._queues and self._chat_buckets[key].is_idle(now):
+                del self._chat_buckets[key]
+        for bot_token in list(self._limited_chats):
+            if all(until <= now for until in self._limited_chats[bot_token].values()):
+                del self._limited_chats[bot_token]
+
+
+def _parse_retry_after(response):
+    """מחלץ retry_after (שניות) מתשובת 429 של טלגרם."""
+    try:
+        parameters = response.json().get("parameters") or {}
+        return max(1, int(parameters.get("retry_after", 1)))
+    except Exception:
+        return 1
@@ -0,0 +1,186 @@
+"""
+Engine Registry - מטמון למיפוי טוקן -> פלאגין מתוך bot_registry
+נטען פעם אחת במלואו, מתרענן בהדרגה לפי created_at ומתעדכן מיד
+כשהמנוע או ה-Architect רושמים / מוחקים בוט, כך שב-dispatch הרגיל
+אין קריאות ל-MongoDB בכלל.
+"""
+
+import threading
+import time
+
+
+class BotRegistryCache:
+    """
+    מפה בזיכרון של token -> plugin_filename.
+    """
+
+    def __init__(self, get_db, refresh_interval=30, full_reload_interval=600,
+                 negative_ttl=30, max_negative=10000):
+        """
+        Args:
+            get_db: פונקציה שמחזירה חיבור ל-MongoDB (או None)
+            refresh_interval: כל כמה שניות לשלוף רישומים חדשים (לפי created_at)
+            full_reload_interval: כל כמה שניות לטעון הכל מחדש (תופס מחיקות מ-workers אחרים)
+            negative_ttl: כמה זמן לזכור שטוקן לא קיים
+            max_negative: מספר מקסימלי של טוקנים לא קיימים שנזכרים
+        """
+        self._get_db = get_db
+        self._refresh_interval = refresh_interval
+        self._full_reload_interval = full_reload_interval
+        self._negative_ttl = negative_ttl
+        self._max_negative = max_negative
+
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._tokens = {}
+        self._negative = {}
+        self._loaded = False
+        self._watermark = None
+        self._last_refresh = 0.0
+        self._last_full_load = 0.0
+
+        self._hits = 0
+        self._misses = 0
+        self._db_reads = 0
+
+    def get(self, bot_token, fresh=False):
+        """
+        מחזיר את שם קובץ הפלאגין של הטוקן, או None.
+
+        Args:
+            bot_token: טוקן הבוט
+            fresh: True = בהחטאה לא לסמוך על המטמון השלילי (לבדיקות קיום לפני יצירה)
+        """
+        self._maybe_refresh()
+
+        with self._lock:
+            plugin_filename = self._tokens.get(bot_token)
+            if plugin_filename is not None:
+                self._hits += 1
+                return plugin_filename
+
+            self._misses += 1
+            missed_at = self._negative.get(bot_token)
+            if not fresh and missed_at and time.monotonic() - missed_at < self._negative_ttl:
+                return None
+
+        # לא במטמון - אולי נרשם ב-worker אחר מאז הרענון האחרון
+        return self._lookup(bot_token)
+
+    def put(self, bot_token, plugin_filename):
+        """מעדכן את המטמון מיד אחרי רישום בוט."""
+        with self._lock:
+            self._tokens[bot_token] = plugin_filename
+            self._negative.pop(bot_token, None)
+
+    def remove_plugin(self, plugin_filename):
+        """מסיר מהמטמון את כל הטוקנים שמשויכים לקובץ פלאגין."""
+        with self._lock:
+            for token in [t for t, name in self._tokens.items() if name == plugin_filename]:
+                del self._tokens[token]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "bots": len(self._tokens),
+                "hits": self._hits,
+                "misses": self._misses,
+                "db_reads": self._db_reads,
+                "negative_entries": len(self._negative),
+            }
+
+    # === Internal ===
+
+    def _maybe_refresh(self):
+        now = time.monotonic()
+        if self._last_refresh and now - self._last_refresh < self._refresh_interval:
+            return
+
+        # רענון אחד בכל פעם; אחרי הטעינה הראשונה לא ממתינים לרענון של thread אחר
+        if not self._refresh_lock.acquire(blocking=not self._loaded):
+            return
+        try:
+            db = self._get_db()
+            if db is None:
+                return
+
+            if not self._loaded or now - self._last_full_load >= self._full_reload_interval:
+                self._load_all(db, now)
+            else:
+                self._load_since_watermark(db, now)
+        finally:
+            self._refresh_lock.release()
+
+    def _load_all(self, db, now):
+        try:
+            docs = list(db.bot_registry.find({}, {"token": 1, "plugin_filename": 1, "created_at": 1}))
+        except Exception as e:
+            print(f"⚠️ Failed loading bot registry: {e}")
+            self._last_refresh = now
+            return
+
+        tokens = {}
+        watermark = None
+        for doc in docs:
+            if doc.get("token") and doc.get("plugin_filename"):
+                tokens[doc["token"]] = doc["plugin_filename"]
+            created_at = doc.get("created_at")
+            if created_at and (watermark is None or created_at > watermark):
+                watermark = created_at
+
+        with self._lock:
+            first_load = self._last_full_load == 0.0
+            self._tokens = tokens
+            self._negative.clear()
+            self._watermark = watermark
+            self._loaded = True
+            self._last_refresh = now
+            self._last_full_load = now
+            self._db_reads += 1
+        if first_load:
+            print(f"✅ Bot registry loaded: {len(tokens)} bots")
+
+    def _load_since_watermark(self, db, now):
+        query = {}
+        if self._watermark is not None:
+            query = {"created_at": {"$gt": self._watermark}}
+        try:
+            docs = list(db.bot_registry.find(query, {"token": 1, "plugin_filename": 1, "created_at": 1}))
+        except Exception as e:
+            print(f"⚠️ Failed refreshing bot registry: {e}")
+            self._last_refresh = now
+            return
+
+        with self._lock:
+            for doc in docs:
+                if doc.get("token") and doc.get("plugin_filename"):
+                    self._tokens[doc["token"]] = doc["plugin_filename"]
+                    self._negative.pop(doc["token"], None)
+                created_at = doc.get("created_at")
+                if created_at and (self._watermark is None or created_at > self._watermark):
+                    self._watermark = created_at
+            self._last_refresh = now
+            self._db_reads += 1
+
+    def _lookup(self, bot_token):
+        db = self._get_db()
+        if db is None:
+            return None
+
+        try:
+            doc = db.bot_registry.find_one({"token": bot_token}, {"plugin_filename": 1})
+        except Exception as e:
+            print(f"❌ Error fetching bot from MongoDB: {e}")
+            return None
+
+        with self._lock:
+            self._db_reads += 1
+            plugin_filename = doc.get("plugin_filename") if doc else None
+            if plugin_filename:
+                self._tokens[bot_token] = plugin_filename
+                self._negative.pop(bot_token, None)
+            else:
+                if len(self._negative) >= self._max_negative:
+                    self._negative.clear()
+                self._negative[bot_token] = time.monotonic()
+        return plugin_filename
@@ -0,0 +1,134 @@
+"""
+Engine Routing - אינדקס ניתוב לפלאגינים של הבוט הראשי
+פלאגינים מצהירים על הפקודות / ה-callback_data שבבעלותם:
+
+    COMMANDS = ["/start", "/stats"]          # התאמה מדויקת למילה הראשונה
+    COMMAND_PREFIXES = ["/create_bot "]      # התאמה לתחילת הטקסט
+    CALLBACK_DATA = ["create_bot", "cancel"]
+    CALLBACK_PREFIXES = ["order:"]
+    CATCH_ALL = True                         # מטפל גם בטקסט חופשי
+
+המנוע בונה מזה מפה מדויקת + trie של קידומות ומנתב כל עדכון ישירות לפלאגין
+המתאים. פלאגין שלא הצהיר על כלום (או הצהיר CATCH_ALL) נשאר בשרשרת הכללית.
+"""
+
+
+class PrefixTrie:
+    """trie של תווים: מוצא את כל הקידומות הרשומות שהטקסט מתחיל בהן."""
+
+    __slots__ = ("_root",)
+
+    def __init__(self):
+        self._root = {}
+
+    def insert(self, prefix, value):
+        node = self._root
+        for char in prefix:
+            node = node.setdefault(char, {})
+        node.setdefault(None, []).append(value)
+
+    def match(self, text):
+        """
+        Returns:
+            list: הערכים של כל הקידומות שמתאימות, מהארוכה לקצרה
+        """
+        matches = []
+        node = self._root
+        for char in text:
+            node = node.get(char)
+            if node is None:
+                break
+            if None in node:
+                matches.append(node[None])
+        result = []
+        for values in reversed(matches):
+            result.extend(values)
+        return result
+
+
+class RoutingIndex:
+    """
+    אינדקס ניתוב על רשימת פלאגינים (PluginEntry).
+    מחזיר לכל עדכון את המועמדים לפי הסדר: בעלים מוצהרים ואחריהם catch-all.
+    """
+
+    def __init__(self, plugins):
+        self._commands = {}
+        self._command_prefixes = PrefixTrie()
+        self._callback_data = {}
+        self._callback_prefixes = PrefixTrie()
+        self._message_fallback = []
+        self._callback_fallback = []
+
+        for plugin in plugins:
+            routes = plugin.routes
+            if plugin.on_message:
+                for command in routes.get("commands", ()):
+                    self._commands.setdefault(command, []).append(plugin)
+                for prefix in routes.get("command_prefixes", ()):
+                    self._command_prefixes.insert(prefix, plugin)
+                if routes.get("catch_all") or not (
+                        routes.get("commands") or routes.get("command_prefixes")):
+                    self._message_fallback.append(plugin)
+
+            if plugin.on_callback:
+                for data in routes.get("callback_data", ()):
+                    self._callback_data.setdefault(data, []).append(plugin)
+                for prefix in routes.get("callback_prefixes", ()):
+                    self._callback_prefixes.insert(prefix, plugin)
+                if not (routes.get("callback_data") or routes.get("callback_prefixes")):
+                    self._callback_fallback.append(plugin)
+
+    def message_candidates(self, text):
+        """מחזיר את הפלאגינים שכדאי לנסות עבור הודעת טקסט, לפי הסדר."""
+        stripped = text.strip()
+        owners = []
+        if stripped.startswith("/"):
+            # "/start@MyBot args" -> "/start"
+            command = stripped.split(maxsplit=1)[0].split("@", 1)[0]
+            owners.extend(self._commands.get(command, ()))
+        owners.extend(self._command_prefixes.match(stripped))
+        return _merge(owners, self._message_fallback)
+
+    def callback_candidates(self, callback_data):
+        """מחזיר את הפלאגינים שכדאי לנסות עבור callback query, לפי הסדר."""
+        owners = []
+        if callback_data:
+            owners.extend(self._callback_data.get(callback_data, ()))
+            owners.extend(self._callback_prefixes.match(callback_data))
+        return _merge(owners, self._callback_fallback)
+
+
+def read_routes(module):
+    """
+    קורא את הצהרות הניתוב מהמודול של הפלאגין.
+
+    Returns:
+        dict: commands, command_prefixes, callback_data, callback_prefixes, catch_all
+    """
+    return {
+        "commands": _as_tuple(getattr(module, "COMMANDS", None)),
+        "command_prefixes": _as_tuple(getattr(module, "COMMAND_PREFIXES", None)),
+        "callback_data": _as_tuple(getattr(module, "CALLBACK_DATA", None)),
+        "callback_prefixes": _as_tuple(getattr(module, "CALLBACK_PREFIXES", None)),
+        "catch_all": bool(getattr(module, "CATCH_ALL", False)),
+    }
+
+
+def _as_tuple(value):
+    if not value:
+        return ()
+    if isinstance(value, str):
+        return (value,)
+    return tuple(item for item in value if isinstance(item, str) and item)
+
+
+def _merge(owners, fallback):
+    """בעלים מוצהרים קודם, ואחריהם שרשרת ה-catch-all - בלי כפילויות."""
+    seen = set()
+    result = []
+    for plugin in list(owners) + fallback:
+        if id(plugin) not in seen:
+            seen.add(id(plugin))
+            result.append(plugin)
+    return result
@@ -0,0 +1,906 @@
+"""
+Engine State - שמירת מצב משותפת לבוטים שנוצרו
+כל בוט שנוצר קורא ל-save_state / load_state. במקום MongoClient נפרד לכל פלאגין,
+כל הבוטים עוברים דרך StateStore אחד שמשתמש בחיבור המשותף של המנוע
+(connection pool אחד ו-handle אחד ל-bot_states).
+
+בתוך batch() (הטיפול בעדכון אחד) יש מטמון לכל (בוט, משתמש): בנגיעה הראשונה
+נטענים כל המפתחות של המשתמש בשאילתה אחת, והכתיבות נאספות ונכתבות
+ב-bulk_write אחד ביציאה מה-batch. המטמון נזרק בסוף ה-batch, כך שכל עדכון
+רואה את מה שנכתב לפניו - גם מ-worker אחר.
+cache_ttl > 0 שומר את המצב גם בין עדכונים (מהיר יותר, אבל נכון רק כשיש
+תהליך אחד: worker אחר לא רואה כתיבות שלא עברו דרכו עד שה-TTL עובר).
+
+ערכים גדולים (מעל offload_bytes) נשמרים ב-GridFS ולא בתוך המסמך: המסמך
+ב-bot_states מחזיק רק blob_id, והערך נטען רק כשמבקשים את המפתח הזה.
+כתיבה שדורסת ערך כזה קוראת את ה-blob_id הקודם באותה פעולה (find_one_and_update)
+ומוחקת אותו אחרי שהכתיבה הצליחה - בלי תלות במטמון או ב-worker שכתב אותו.
+רשימה שגדלה ב-push_state מעבר לסף מועברת ל-GridFS באותו אופן.
+לכל מסמך נשמר גם size (בבתים) לדוח גודל המצב לפי בוט (עדכון אטומי מסיר
+אותו, והדוח מודד את המסמך עצמו), ו-updated_at (זמן השרת בכתיבה האחרונה) -
+לפיו dedupe-states יודע איזה מסמך כפול הוא העדכני.
+"""
+
+import copy
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import bson
+import gridfs
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+
+# מסמך ב-MongoDB מוגבל ל-16MB; נשאר מקום לשאר השדות (bot_id, user_id, key, size)
+_MAX_INLINE_BYTES = 16 * 1024 * 1024 - 64 * 1024
+
+# מצורף לכל כתיבה - זמן השרת (לא של ה-worker) של הכתיבה האחרונה
+_TOUCH = {"$currentDate": {"updated_at": True}}
+# מצורף לעדכון אטומי - הגודל הקודם כבר לא נכון
+_UNSET_SIZE = {"$unset": {"size": ""}}
+
+
+class _UserState:
+    """כל המפתחות של משתמש אחד בבוט אחד, כפי שנטענו מה-DB."""
+
+    __slots__ = ("values", "dirty", "blobs", "loaded_at")
+
+    def __init__(self, values, blobs, loaded_at):
+        self.values = values
+        # key -> (value, BSON) של כתיבות שממתינות לסוף ה-batch
+        self.dirty = {}
+        # key -> blob_id של ערכים שנשמרו ב-GridFS
+        self.blobs = blobs
+        self.loaded_at = loaded_at
+
+
+class _LazyBlob:
+    """ערך שנשמר ב-GridFS ועוד לא נטען (blob_id=None - ערך שצריך לקרוא מחדש מה-DB)."""
+
+    __slots__ = ("blob_id",)
+
+    def __init__(self, blob_id):
+        self.blob_id = blob_id
+
+
+class StateStore:
+    """
+    גישה ל-collection של bot_states עבור כל הבוטים.
+    """
+
+    def __init__(self, get_db, collection="bot_states", cache_ttl=0, max_cached_users=10000,
+                 offload_bytes=256 * 1024, blob_collection="bot_state_blobs"):
+        """
+        Args:
+            get_db: פונקציה שמחזירה חיבור ל-MongoDB (או None)
+            collection: שם ה-collection
+            cache_ttl: כמה שניות לסמוך על מצב שנטען גם אחרי סוף ה-batch
+                       (0 = מטמון רק בתוך batch; מעל 0 - רק כשיש worker אחד)
+            max_cached_users: מספר צמדי (בוט, משתמש) המקסימלי במטמון שבין batches
+            offload_bytes: ערך שגודלו (BSON) מעל הסף נשמר ב-GridFS (0 = כבוי)
+            blob_collection: שם ה-bucket ב-GridFS
+        """
+        self._get_db = get_db
+        self._collection_name = collection
+        self._cache_ttl = cache_ttl
+        self._max_cached_users = max(1, int(max_cached_users))
+        self._offload_bytes = offload_bytes
+        self._blob_collection = blob_collection
+        self._fs = None
+        self._fs_db = None
+        # האם האינדקס הייחודי על (bot_id, user_id, key) אושר (mark_unique_index)
+        self._unique_index = False
+
+        self._lock = threading.Lock()
+        # מטמון בין batches (רק כש-cache_ttl > 0)
+        self._cache = OrderedDict()
+        self._local = threading.local()
+
+        self._hits = 0
+        self._misses = 0
+        self._db_reads = 0
+        self._db_writes = 0
+        self._flush_errors = 0
+        self._failed_writes = 0
+        self._rejected = 0
+        self._blob_writes = 0
+        self._blob_reads = 0
+        self._replaced_blobs = 0
+
+    def database(self):
+        """מחזיר את ה-DB המשותף (או None) - עבור פלאגינים שניגשים ישירות ל-_get_state_db()."""
+        return self._get_db()
+
+    def mark_unique_index(self, confirmed):
+        """
+        מעדכן האם האינדקס הייחודי על bot_states קיים (נקרא מהמנוע אחרי ensure_state_indexes).
+        בלעדיו עדכון אטומי בודק קודם במפורש שהערך לא שמור ב-GridFS.
+        """
+        self._unique_index = bool(confirmed)
+
+    def save(self, bot_id, user_id, key, value):
+        """
+        שומר ערך עבור משתמש בבוט.
+        הערך נבדק (קידוד BSON וגודל) כאן, כך שערך שלא ניתן לשמור מחזיר False מיד.
+        בתוך batch() הכתיבה נדחית לסוף ה-batch; מחוץ לו נכתבת מיד.
+
+        Returns:
+            bool: האם השמירה הצליחה (בתוך batch - האם הערך תקין ונרשם לכתיבה)
+        """
+        user_id = str(user_id)
+        encoded = self._encode(bot_id, key, value)
+        if encoded is None:
+            return False
+
+        if self._in_batch():
+            state = self._user_state(bot_id, user_id)
+            if state is not None:
+                self._stage(state, {key: encoded})
+                return True
+
+        return self._write_now(bot_id, user_id, {key: encoded})
+
+    def load(self, bot_id, user_id, key, default=None):
+        """
+        טוען ערך עבור משתמש בבוט.
+
+        Returns:
+            הערך השמור או ערך ברירת המחדל
+        """
+        user_id = str(user_id)
+        if self._caching():
+            state = self._user_state(bot_id, user_id)
+            if state is None:
+                return default
+            return self._cached_value(state, bot_id, user_id, key, default)
+
+        value = self._fetch_value(bot_id, user_id, key)
+        return default if value is _MISSING else value
+
+    def load_many(self, bot_id, user_id, keys, defaults=None):
+        """
+        טוען כמה מפתחות של משתמש בשאילתה אחת.
+
+        Args:
+            keys: רשימת מפתחות
+            defaults: מילון key -> ערך ברירת מחדל (מפתח חסר בלי ברירת מחדל יחזור כ-None)
+
+        Returns:
+            dict: key -> ערך
+        """
+        user_id = str(user_id)
+        keys = list(keys)
+        defaults = defaults or {}
+        result = {key: defaults.get(key) for key in keys}
+
+        if self._caching():
+            state = self._user_state(bot_id, user_id)
+            if state is None:
+                return result
+            for key in keys:
+                result[key] = self._cached_value(state, bot_id, user_id, key, result[key])
+            return result
+
+        collection = self._collection()
+        if collection is None:
+            return result
+        try:
+            docs = collection.find(
+                {"bot_id": bot_id, "user_id": user_id, "key": {"$in": keys}},
+                {"key": 1, "value": 1, "blob_id": 1}
+            )
+            for doc in docs:
+                if doc.get("key") not in result:
+                    continue
+                if doc.get("blob_id") is not None:
+                    value = self._read_blob(doc["blob_id"])
+                    if value is not _MISSING:
+                        result[doc["key"]] = value
+                else:
+                    result[doc["key"]] = doc.get("value")
+            with self._lock:
+                self._db_reads += 1
+        except Exception as e:
+            print(f"⚠️ Failed to load state for {bot_id}: {e}")
+        return result
+
+    def save_many(self, bot_id, user_id, values):
+        """
+        שומר כמה מפתחות של משתמש בכתיבה אחת (bulk_write).
+        אם אחד הערכים לא ניתן לשמירה - אף ערך לא נשמר.
+        בתוך batch() הכתיבה נדחית לסוף ה-batch.
+
+        Args:
+            values: מילון key -> ערך
+
+        Returns:
+            bool: האם השמירה הצליחה (בתוך batch - האם הערכים תקינים ונרשמו לכתיבה)
+        """
+        user_id = str(user_id)
+        if not values:
+            return True
+
+        encoded = {}
+        for key, value in values.items():
+            encoded[key] = self._encode(bot_id, key, value)
+            if encoded[key] is None:
+                return False
+
+        if self._in_batch():
+            state = self._user_state(bot_id, user_id)
+            if state is not None:
+                self._stage(state, encoded)
+                return True
+
+        return self._write_now(bot_id, user_id, encoded)
+
+    def incr(self, bot_id, user_id, key, amount=1):
+        """
+        מגדיל מונה באופן אטומי בצד השרת ($inc). מפתח שלא קיים מתחיל מ-0.
+
+        Returns:
+            הערך החדש, או None אם העדכון נכשל
+        """
+        doc = self._atomic_update(bot_id, user_id, key, {"$inc": {"value": amount}}, return_value=True)
+        if doc is _OFFLOADED:
+            current = self.load(bot_id, user_id, key, 0)
+            if not isinstance(current, (int, float)) or isinstance(current, bool):
+                return None
+            return current + amount if self.save(bot_id, user_id, key, current + amount) else None
+        if doc is None:
+            return None
+        value = doc.get("value")
+        self._update_cached(bot_id, str(user_id), key, lambda _: value)
+        return value
+
+    def push(self, bot_id, user_id, key, item):
+        """
+        מוסיף פריט לסוף רשימה באופן אטומי ($push) - בלי לשלוח את כל הרשימה.
+
+        Returns:
+            bool: האם העדכון הצליח
+        """
+        def append(current):
+            return (current if isinstance(current, list) else []) + [copy.deepcopy(item)]
+
+        # כשיש offload צריך את הרשימה החדשה כדי לדעת אם עברה את הסף
+        result = self._atomic_update(bot_id, user_id, key, {"$push": {"value": item}},
+                                     return_value=bool(self._offload_bytes))
+        if result is _OFFLOADED:
+            return self._read_modify_write(bot_id, user_id, key, append)
+        if result is None:
+            return False
+        if result is True:
+            self._update_cached(bot_id, str(user_id), key, append)
+            return True
+        value = result.get("value")
+        self._update_cached(bot_id, str(user_id), key, lambda _: value)
+        self._offload_grown(bot_id, str(user_id), key, value)
+        return True
+
+    def pull(self, bot_id, user_id, key, item):
+        """
+        מסיר מרשימה את כל המופעים של פריט באופן אטומי ($pull).
+
+        Returns:
+            bool: האם העדכון הצליח
+        """
+        def remove(current):
+            return [x for x in current if x != item] if isinstance(current, list) else current
+
+        result = self._atomic_update(bot_id, user_id, key, {"$pull": {"value": item}}, upsert=False)
+        if result is _OFFLOADED:
+            return self._read_modify_write(bot_id, user_id, key, remove)
+        if result is None:
+            return False
+        self._update_cached(bot_id, str(user_id), key, remove)
+        return True
+
+    @contextmanager
+    def batch(self):
+        """
+        תוחם טיפול בעדכון אחד: המצב נטען פעם אחת לכל משתמש, וכתיבות נאספות
+        ונכתבות יחד ביציאה (גם אחרי שגיאה).
+        """
+        depth = getattr(self._local, "depth", 0)
+        if depth == 0:
+            self._local.states = {}
+        self._local.depth = depth + 1
+        try:
+            yield self
+        finally:
+            self._local.depth = depth
+            if depth == 0:
+                states, self._local.states = self._local.states, None
+                self._flush(states)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "cached_users": len(self._cache),
+                "cache_ttl": self._cache_ttl,
+                "hits": self._hits,
+                "misses": self._misses,
+                "db_reads": self._db_reads,
+                "db_writes": self._db_writes,
+                "flush_errors": self._flush_errors,
+                "failed_writes": self._failed_writes,
+                "rejected_values": self._rejected,
+                "offload_bytes": self._offload_bytes,
+                "blob_writes": self._blob_writes,
+                "blob_reads": self._blob_reads,
+                "replaced_blobs": self._replaced_blobs,
+            }
+
+    # === Internal ===
+
+    def _collection(self):
+        db = self._get_db()
+        if db is None:
+            return None
+        return db[self._collection_name]
+
+    def _in_batch(self):
+        return getattr(self._local, "depth", 0) > 0
+
+    def _caching(self):
+        """האם קריאות עוברות דרך המטמון (בתוך batch, או מטמון בין batches)."""
+        return bool(self._cache_ttl) or self._in_batch()
+
+    def _offloads(self, size):
+        return bool(self._offload_bytes) and size > self._offload_bytes
+
+    def _encode(self, bot_id, key, value):
+        """
+        מקודד ערך ל-BSON - גם כבדיקה שאפשר לשמור אותו.
+
+        Returns:
+            tuple: (עותק של הערך כפי שיחזור מה-DB, BSON), או None אם אי אפשר לשמור
+        """
+        try:
+            bson.encode({"key": key})
+            data = bson.encode({"value": value})
+        except Exception as e:
+            print(f"⚠️ Cannot save state {key!r} for {bot_id}: {e}")
+            with self._lock:
+                self._rejected += 1
+            return None
+        if len(data) > _MAX_INLINE_BYTES and not self._offloads(len(data)):
+            print(f"⚠️ Cannot save state {key!r} for {bot_id}: value is {len(data)} bytes")
+            with self._lock:
+                self._rejected += 1
+            return None
+        # עותק דרך BSON - שינוי של רשימה / מילון בפלאגין לא משנה את מה שנשמר
+        return bson.decode(data)["value"], data
+
+    def _known_state(self, cache_key):
+        """המצב של (בוט, משתמש) אם כבר נטען - ב-batch הנוכחי או במטמון שבין batches."""
+        states = getattr(self._local, "states", None)
+        if states and cache_key in states:
+            return states[cache_key]
+        return self._cache.get(cache_key)
+
+    def _user_state(self, bot_id, user_id):
+        """מחזיר את המפתחות של המשתמש מהמטמון, או טוען את כולם בשאילתה אחת."""
+        cache_key = (bot_id, user_id)
+        states = getattr(self._local, "states", None)
+        if states is not None:
+            state = states.get(cache_key)
+            if state is not None:
+                with self._lock:
+                    self._hits += 1
+                return state
+
+        state = self._shared_state(cache_key) if self._cache_ttl else None
+        if state is None:
+            state = self._load_user(bot_id, user_id)
+            if state is None:
+                return None
+        if states is not None:
+            states[cache_key] = state
+        return state
+
+    def _shared_state(self, cache_key):
+        """מצב מהמטמון שבין batches, אם עוד לא עבר ה-TTL."""
+        now = time.monotonic()
+        with self._lock:
+            state = self._cache.get(cache_key)
+            # מפתחות שממתינים לכתיבה נשארים גם אחרי שה-TTL עבר
+            if state is not None and (state.dirty or now - state.loaded_at < self._cache_ttl):
+                self._cache.move_to_end(cache_key)
+                self._hits += 1
+                return state
+        return None
+
+    def _load_user(self, bot_id, user_id):
+        """טוען את כל המפתחות של המשתמש בשאילתה אחת (ושומר במטמון שבין batches אם פעיל)."""
+        cache_key = (bot_id, user_id)
+        now = time.monotonic()
+        with self._lock:
+            self._misses += 1
+
+        collection = self._collection()
+        if collection is None:
+            return None
+        try:
+            docs = collection.find(
+                {"bot_id": bot_id, "user_id": user_id},
+                {"key": 1, "value": 1, "blob_id": 1}
+            )
+            values = {}
+            blobs = {}
+            for doc in docs:
+                if "key" not in doc:
+                    continue
+                if doc.get("blob_id") is not None:
+                    # ערך גדול - נטען רק כשמבקשים את המפתח
+                    blobs[doc["key"]] = doc["blob_id"]
+                    values[doc["key"]] = _LazyBlob(doc["blob_id"])
+                else:
+                    values[doc["key"]] = doc.get("value")
+        except Exception as e:
+            print(f"⚠️ Failed to load state for {bot_id}: {e}")
+            return None
+
+        with self._lock:
+            self._db_reads += 1
+            if not self._cache_ttl:
+                return _UserState(values, blobs, now)
+
+            current = self._cache.get(cache_key)
+            if current is not None and current.dirty:
+                # thread אחר כתב בינתיים - הכתיבות שלו גוברות על מה שנקרא
+                current.values = {**values, **{key: value for key, (value, _) in current.dirty.items()}}
+                current.blobs = blobs
+                current.loaded_at = now
+                state = current
+            else:
+                state = _UserState(values, blobs, now)
+                self._cache[cache_key] = state
+            self._cache.move_to_end(cache_key)
+            self._evict()
+        return state
+
+    def _stage(self, state, encoded):
+        """רושם ערכים (שכבר קודדו) לכתיבה בסוף ה-batch."""
+        with self._lock:
+            for key, (value, data) in encoded.items():
+                state.values[key] = value
+                state.dirty[key] = (value, data)
+
+    def _fetch_value(self, bot_id, user_id, key):
+        """קורא מפתח אחד מה-DB (כולל ערך מ-GridFS). Returns: הערך או _MISSING."""
+        collection = self._collection()
+        if collection is None:
+            return _MISSING
+        try:
+            doc = collection.find_one(
+                {"bot_id": bot_id, "user_id": user_id, "key": key},
+                {"value": 1, "blob_id": 1}
+            )
+            with self._lock:
+                self._db_reads += 1
+            if not doc:
+                return _MISSING
+            if doc.get("blob_id") is not None:
+                return self._read_blob(doc["blob_id"])
+            return doc.get("value")
+        except Exception as e:
+            print(f"⚠️ Failed to load state for {bot_id}: {e}")
+            return _MISSING
+
+    def _atomic_update(self, bot_id, user_id, key, update, upsert=True, return_value=False):
+        """
+        מריץ עדכון אטומי על מפתח אחד.
+        כתיבה שממתינה במטמון לאותו מפתח נכתבת קודם, כדי שלא תדרוס את העדכון.
+
+        Returns:
+            המסמך המעודכן (אם return_value), True, או None בכישלון
+        """
+        user_id = str(user_id)
+        collection = self._collection()
+        if collection is None:
+            return None
+
+        with self._lock:
+            state = self._known_state((bot_id, user_id))
+            if state is not None and key in state.blobs and key not in state.dirty:
+                return _OFFLOADED
+            pending = state.dirty.pop(key, _MISSING) if state is not None else _MISSING
+
+        if pending is not _MISSING and not self._write_now(bot_id, user_id, {key: pending}):
+            return None
+
+        # עדכון אטומי רק על ערך שנשמר בתוך המסמך: למסמך כזה אין שדה blob_id.
+        # $exists לא מועתק למסמך שנוצר ב-upsert, ומסמך עם blob_id לא תואם -
+        # עם האינדקס הייחודי ה-upsert נכשל ב-DuplicateKeyError; בלעדיו בודקים קודם,
+        # כדי לא ליצור מסמך שני לאותו מפתח
+        key_filter = {"bot_id": bot_id, "user_id": user_id, "key": key}
+        selector = dict(key_filter, blob_id={"$exists": False})
+        # size לא מתעדכן בעדכון אטומי - מוסר, ודוח הגודל מודד את המסמך עצמו
+        update = dict(update, **_TOUCH, **_UNSET_SIZE)
+        try:
+            if upsert and not self._unique_index and collection.find_one(
+                    dict(key_filter, blob_id={"$exists": True}), {"_id": 1}):
+                return _OFFLOADED
+            if return_value:
+                result = collection.find_one_and_update(
+                    selector, update, projection={"value": 1},
+                    upsert=upsert, return_document=ReturnDocument.AFTER
+                )
+                result = result or {}
+            else:
+                result = collection.update_one(selector, update, upsert=upsert)
+                if not upsert and result.matched_count == 0 and collection.find_one(
+                        dict(key_filter, blob_id={"$exists": True}), {"_id": 1}):
+                    return _OFFLOADED
+                result = True
+        except DuplicateKeyError:
+            # המסמך קיים עם blob_id - ה-upsert ניסה ליצור מסמך נוסף
+            return _OFFLOADED
+        except Exception as e:
+            print(f"⚠️ Failed to update state for {bot_id}: {e}")
+            self._forget(bot_id, user_id, key)
+            return None
+
+        with self._lock:
+            self._db_writes += 1
+        return result
+
+    def _offload_grown(self, bot_id, user_id, key, value):
+        """
+        מעביר ל-GridFS רשימה שגדלה ב-push מעבר ל-offload_bytes.
+        ההעברה מותנית בכך שהערך במסמך לא השתנה מאז ה-push; אם השתנה
+        (worker אחר עדכן בינתיים) ה-blob נמחק, וה-push הבא ינסה שוב.
+        """
+        data = bson.encode({"value": value})
+        if not self._offloads(len(data)):
+            return
+        db = self._get_db()
+        if db is None:
+            return
+
+        blob_id = None
+        try:
+            update, blob_id = self._build_write(db, bot_id, user_id, key, value, data)
+            result = db[self._collection_name].update_one(
+                {"bot_id": bot_id, "user_id": user_id, "key": key,
+                 "blob_id": {"$exists": False}, "value": value},
+                update
+            )
+        except Exception as e:
+            print(f"⚠️ Failed to offload state {key!r} for {bot_id}: {e}")
+            self._delete_blobs(db, [blob_id] if blob_id else [])
+            return
+
+        if result.matched_count == 0:
+            self._delete_blobs(db, [blob_id])
+            return
+        with self._lock:
+            self._db_writes += 1
+            state = self._known_state((bot_id, user_id))
+            if state is not None:
+                state.blobs[key] = blob_id
+
+    def _update_cached(self, bot_id, user_id, key, apply):
+        """מעדכן את הערך במטמון אחרי עדכון אטומי (אם המשתמש טעון)."""
+        with self._lock:
+            state = self._known_state((bot_id, user_id))
+            if state is not None:
+                current = state.values.get(key)
+                if isinstance(current, _LazyBlob):
+                    # לא נטען - ייקרא מה-DB בפעם הבאה שמבקשים אותו
+                    state.values[key] = _LazyBlob(None)
+                    state.blobs.pop(key, None)
+                    return
+                state.values[key] = apply(current)
+
+    def _read_modify_write(self, bot_id, user_id, key, apply):
+        """עדכון רגיל (טעינה, שינוי ושמירה) לערך שנשמר ב-GridFS ולא ניתן לעדכן אטומית."""
+        return self.save(bot_id, user_id, key, apply(self.load(bot_id, user_id, key)))
+
+    def _cached_value(self, state, bot_id, user_id, key, default):
+        """מחזיר עותק של ערך מהמטמון, וטוען ערך גדול / ערך שהשתנה בפעם הראשונה שמבקשים אותו."""
+        with self._lock:
+            if key not in state.values:
+                return default
+            value = state.values[key]
+        if isinstance(value, _LazyBlob):
+            if value.blob_id is None:
+                loaded = self._fetch_value(bot_id, user_id, key)
+            else:
+                loaded = self._read_blob(value.blob_id)
+            if loaded is _MISSING:
+                return default
+            with self._lock:
+                if state.values.get(key) is value:
+                    state.values[key] = loaded
+                value = loaded
+        # עותק - שינוי של רשימה / מילון בפלאגין לא משנה את המטמון בלי save_state
+        return copy.deepcopy(value)
+
+    # === Writes / GridFS ===
+
+    def _gridfs(self, db):
+        if self._fs is None or self._fs_db is not db:
+            self._fs = gridfs.GridFS(db, collection=self._blob_collection)
+            self._fs_db = db
+        return self._fs
+
+    def _read_blob(self, blob_id):
+        db = self._get_db()
+        if db is None:
+            return _MISSING
+        try:
+            data = self._gridfs(db).get(blob_id).read()
+            with self._lock:
+                self._blob_reads += 1
+            return bson.decode(data)["value"]
+        except Exception as e:
+            print(f"⚠️ Failed to load offloaded state {blob_id}: {e}")
+            return _MISSING
+
+    def _build_write(self, db, bot_id, user_id, key, value, data):
+        """
+        בונה את העדכון למפתח אחד. ערך גדול נכתב קודם ל-GridFS.
+
+        Returns:
+            tuple: (update, blob_id החדש או None)
+        """
+        size = len(data)
+        if self._offloads(size):
+            blob_id = self._gridfs(db).put(
+                data, metadata={"bot_id": bot_id, "user_id": user_id, "key": key}
+            )
+            with self._lock:
+                self._blob_writes += 1
+            return {"$set": {"value": None, "blob_id": blob_id, "size": size}, **_TOUCH}, blob_id
+
+        return {"$set": {"value": value, "size": size}, "$unset": {"blob_id": ""}, **_TOUCH}, None
+
+    def _replace_write(self, db, bot_id, user_id, key, update):
+        """
+        כותב מפתח שאולי שמור ב-GridFS, וקורא באותה פעולה את ה-blob_id הקודם.
+
+        Returns:
+            blob_id הקודם או None
+        """
+        before = db[self._collection_name].find_one_and_update(
+            {"bot_id": bot_id, "user_id": user_id, "key": key}, update,
+            projection={"blob_id": 1}, upsert=True, return_document=ReturnDocument.BEFORE
+        )
+        return (before or {}).get("blob_id")
+
+    def _write_batch(self, writes):
+        """
+        כותב ערכים לכמה משתמשים. ערך שנכשל (בבניה או בשרת) לא מפיל את שאר הכתיבות.
+
+        עם אינדקס ייחודי: bulk_write אחד שמעדכן רק מסמכים בלי blob_id. מפתח שכבר
+        שמור ב-GridFS נכשל על האינדקס ונכתב שוב ב-find_one_and_update, שמחזיר את
+        ה-blob_id הקודם - והוא נמחק אחרי שהכתיבה הצליחה (גם אם מי שכתב אותו הוא
+        worker אחר). בלי האינדקס כל מפתח נכתב כך.
+
+        Args:
+            writes: [(bot_id, user_id, {key: (value, BSON)})]
+
+        Returns:
+            set: (bot_id, user_id, key) של הערכים שלא נכתבו (ריק = הכל נכתב)
+        """
+        items = [
+            (bot_id, user_id, key, value, data)
+            for bot_id, user_id, values in writes
+            for key, (value, data) in values.items()
+        ]
+        db = self._get_db()
+        if db is None:
+            return {item[:3] for item in items}
+
+        failed = set()
+        operations = []
+        pending = []
+        replace = []
+        for bot_id, user_id, key, value, data in items:
+            try:
+                update, blob_id = self._build_write(db, bot_id, user_id, key, value, data)
+            except Exception as e:
+                print(f"⚠️ Failed to prepare state {key!r} for {bot_id}: {e}")
+                failed.add((bot_id, user_id, key))
+                continue
+            item = (bot_id, user_id, key, update, blob_id)
+            if not self._unique_index:
+                replace.append(item)
+                continue
+            selector = {"bot_id": bot_id, "user_id": user_id, "key": key,
+                        "blob_id": {"$exists": False}}
+            operations.append(UpdateOne(selector, update, upsert=True))
+            pending.append(item)
+
+        written = []
+        if operations:
+            try:
+                db[self._collection_name].bulk_write(operations, ordered=False)
+                written = pending
+            except BulkWriteError as e:
+                # ordered=False: שאר הפעולות נכתבו, רק השגויות נופלות
+                errors = {error.get("index"): error for error in e.details.get("writeErrors", [])}
+                for i, item in enumerate(pending):
+                    error = errors.get(i)
+                    if error is None:
+                        written.append(item)
+                    elif error.get("code") == 11000:
+                        # הערך הקודם שמור ב-GridFS
+                        replace.append(item)
+                    else:
+                        print(f"⚠️ Failed to write state {item[2]!r} for {item[0]}: "
+                              f"{error.get('errmsg')}")
+                        self._delete_blobs(db, [item[4]] if item[4] else [])
+                        failed.add(item[:3])
+            except Exception as e:
+                print(f"⚠️ Failed to write {len(operations)} state values: {e}")
+                self._delete_blobs(db, [item[4] for item in pending if item[4]])
+                failed.update(item[:3] for item in pending)
+
+        stale_blobs = []
+        for item in replace:
+            bot_id, user_id, key, update, blob_id = item
+            try:
+                old_blob = self._replace_write(db, bot_id, user_id, key, update)
+            except Exception as e:
+                print(f"⚠️ Failed to write state {key!r} for {bot_id}: {e}")
+                self._delete_blobs(db, [blob_id] if blob_id else [])
+                failed.add((bot_id, user_id, key))
+                continue
+            if old_blob is not None and old_blob != blob_id:
+                stale_blobs.append(old_blob)
+            written.append(item)
+
+        with self._lock:
+            if operations:
+                self._db_writes += 1
+            self._db_writes += len(replace)
+            self._failed_writes += len(failed)
+            self._replaced_blobs += len(stale_blobs)
+            for bot_id, user_id, key, _, blob_id in written:
+                state = self._known_state((bot_id, user_id))
+                if state is None:
+                    continue
+                if blob_id is not None:
+                    state.blobs[key] = blob_id
+                else:
+                    state.blobs.pop(key, None)
+        self._delete_blobs(db, stale_blobs)
+        return failed
+
+    def _write_now(self, bot_id, user_id, encoded):
+        """כתיבה מיידית (מחוץ ל-batch) ועדכון המטמון."""
+        if self._write_batch([(bot_id, user_id, encoded)]):
+            self._drop((bot_id, user_id))
+            return False
+        with self._lock:
+            state = self._known_state((bot_id, user_id))
+            if state is not None:
+                for key, (value, _) in encoded.items():
+                    state.values[key] = value
+        return True
+
+    def _delete_blobs(self, db, blob_ids):
+        for blob_id in blob_ids:
+            try:
+                self._gridfs(db).delete(blob_id)
+            except Exception as e:
+                print(f"⚠️ Failed to delete offloaded state {blob_id}: {e}")
+
+    def _evict(self):
+        """פולט את הצמדים הישנים ביותר מעבר לגודל המקסימלי (לא כאלה שממתינים לכתיבה)."""
+        excess = len(self._cache) - self._max_cached_users
+        for cache_key in list(self._cache):
+            if excess <= 0:
+                break
+            if not self._cache[cache_key].dirty:
+                del self._cache[cache_key]
+                excess -= 1
+
+    def _drop(self, cache_key):
+        """מוציא משתמש מהמטמון שבין batches - ייטען מחדש בקריאה הבאה."""
+        with self._lock:
+            self._cache.pop(cache_key, None)
+
+    def _forget(self, bot_id, user_id, key):
+        """הערך של המפתח ב-DB לא ידוע (עדכון שנכשל) - ייקרא מחדש בפעם הבאה."""
+        self._drop((bot_id, user_id))
+        with self._lock:
+            state = self._known_state((bot_id, user_id))
+            if state is not None and key not in state.dirty:
+                state.values[key] = _LazyBlob(None)
+                state.blobs.pop(key, None)
+
+    def _flush(self, states):
+        """כותב ב-bulk_write אחד את כל המפתחות שהשתנו ב-batch."""
+        writes = []
+        with self._lock:
+            for (bot_id, user_id), state in states.items():
+                if not state.dirty:
+                    continue
+                writes.append((bot_id, user_id, state.dirty))
+                state.dirty = {}
+
+        if not writes:
+            return
+
+        failed = self._write_batch(writes)
+        if failed:
+            with self._lock:
+                self._flush_errors += 1
+            # המטמון שבין batches כבר לא משקף את ה-DB - ייטען מחדש בקריאה הבאה
+            for bot_id, user_id, _ in failed:
+                self._drop((bot_id, user_id))
+
+
+_MISSING = object()
+# סימון שהמפתח שמור ב-GridFS ולכן אין עדכון אטומי בצד השרת
+_OFFLOADED = object()
+
+_default_store = None
+
+
+def set_state_store(store):
+    """קובע את ה-StateStore שהפלאגינים משתמשים בו (נקרא פעם אחת מהמנוע)."""
+    global _default_store
+    _default_store = store
+
+
+def get_state_store():
+    """מחזיר את ה-StateStore המשותף (משמש את פונקציות העזר שמוזרקות לבוטים)."""
+    if _default_store is None:
+        raise RuntimeError("State store is not configured")
+    return _default_store
+
+
+def bind_legacy_state_helpers(module, store):
+    """
+    מחבר פלאגין ישן (עם פונקציות עזר שיוצרות MongoClient משלהן) ל-StateStore המשותף.
+    מחליף את save_state / load_state / _get_state_db במודול (ומוסיף את
+    save_states / load_states / incr_state / push_state / pull_state),
+    כך שהפלאגין לא פותח חיבור משלו.
+
+    Returns:
+        bool: האם הפלאגין חובר מחדש
+    """
+    bot_id = getattr(module, "BOT_ID", None)
+    if not isinstance(bot_id, str) or not hasattr(module, "_state_mongo_client"):
+        return False
+    if not callable(getattr(module, "_get_state_db", None)):
+        return False
+
+    def save_state(user_id, key, value):
+        return store.save(bot_id, user_id, key, value)
+
+    def load_state(user_id, key, default=None):
+        return store.load(bot_id, user_id, key, default)
+
+    def save_states(user_id, values):
+        return store.save_many(bot_id, user_id, values)
+
+    def load_states(user_id, keys, defaults=None):
+        return store.load_many(bot_id, user_id, keys, defaults)
+
+    def incr_state(user_id, key, amount=1):
+        return store.incr(bot_id, user_id, key, amount)
+
+    def push_state(user_id, key, item):
+        return store.push(bot_id, user_id, key, item)
+
+    def pull_state(user_id, key, item):
+        return store.pull(bot_id, user_id, key, item)
+
+    module.save_state = save_state
+    module.load_state = load_state
+    module.save_states = save_states
+    module.load_states = load_states
+    module.incr_state = incr_state
+    module.push_state = push_state
+    module.pull_state = pull_state
+    module._get_state_db = store.database
+    return True
@@ -0,0 +1,105 @@
+"""
+Engine Telegram API - לקוח משותף ל-Bot API של טלגרם
+Session אחד עם connection pooling ו-keep-alive לכל הבוטים,
+כדי שכל קריאה לא תפתח חיבור TLS חדש ל-api.telegram.org.
+"""
+
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+TELEGRAM_API_BASE = "https://api.telegram.org"
+
+# סוגי העדכונים שה-webhook מבקש. chat_member לא נשלח בלי בקשה מפורשת,
+# והמנוע צריך אותו כדי לעדכן את מטמון האדמינים
+WEBHOOK_ALLOWED_UPDATES = ["message", "callback_query", "chat_member", "my_chat_member"]
+
+
+class TelegramClient:
+    """
+    לקוח Bot API משותף.
+    כל הבוטים עוברים דרך אותו host, ולכן pool אחד של חיבורים פתוחים מספיק לכולם.
+    """
+
+    def __init__(self, pool_size=20, connect_timeout=3.05, read_timeout=10,
+                 connect_retries=2, base_url=TELEGRAM_API_BASE):
+        """
+        Args:
+            pool_size: מספר החיבורים הפתוחים המקסימלי ל-api.telegram.org
+            connect_timeout: timeout לפתיחת חיבור (שניות)
+            read_timeout: timeout לקבלת תשובה (שניות)
+            connect_retries: ניסיונות חוזרים על כשל בפתיחת חיבור בלבד
+                             (בטוח גם ל-POST - הבקשה עוד לא נשלחה)
+            base_url: כתובת ה-API
+        """
+        self._base_url = base_url.rstrip('/')
+        self._timeout = (connect_timeout, read_timeout)
+
+        retry = Retry(total=connect_retries, connect=connect_retries, read=0,
+                      status=0, other=0, backoff_factor=0.2)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size,
+                              max_retries=retry, pool_block=False)
+        self._session = requests.Session()
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+
+        self._stats_lock = threading.Lock()
+        self._stats = {}
+
+    def post(self, bot_token, method, payload=None, timeout=None):
+        """
+        קורא למתודה ב-Bot API.
+
+        Args:
+            bot_token: טוקן הבוט
+            method: שם המתודה (sendMessage, answerCallbackQuery וכו')
+            payload: גוף הבקשה (dict)
+            timeout: timeout מותאם (שניות או tuple), ברירת מחדל - של הלקוח
+
+        Returns:
+            requests.Response
+
+        Raises:
+            requests.RequestException: בשגיאת רשת / timeout
+        """
+        url = f"{self._base_url}/bot{bot_token}/{method}"
+        started = time.monotonic()
+        ok = False
+        try:
+            response = self._session.post(url, json=payload or {}, timeout=timeout or self._timeout)
+            ok = response.ok
+            return response
+        finally:
+            self._record(method, time.monotonic() - started, ok)
+
+    def stats(self):
+        """מחזיר סטטיסטיקות latency לכל מתודה."""
+        with self._stats_lock:
+            return {
+                method: {
+                    "calls": entry["calls"],
+                    "errors": entry["errors"],
+                    "avg_ms": round(entry["total"] / entry["calls"] * 1000, 2),
+                    "max_ms": round(entry["max"] * 1000, 2),
+                }
+                for method, entry in self._stats.items()
+            }
+
+    def close(self):
+        self._session.close()
+
+    def _record(self, method, elapsed, ok):
+        with self._stats_lock:
+            entry = self._stats.get(method)
+            if entry is None:
+                entry = self._stats[method] = {"calls": 0, "errors": 0, "total": 0.0, "max": 0.0}
+            entry["calls"] += 1
+            entry["total"] += elapsed
+            if elapsed > entry["max"]:
+                entry["max"] = elapsed
+            if not ok:
+                entry["errors"] += 1
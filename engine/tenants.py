@@ -0,0 +1,214 @@
+"""
+Engine Tenants - מטמון מוגבל למודולים של בוטים רשומים
+כל פלאגין bot_<id> שנטען נשאר ב-sys.modules ומחזיק MongoClient משלו.
+המטמון כאן שומר רק את הבוטים הפעילים (LRU + זמן חוסר פעילות),
+ומודול שנפלט מוסר מ-sys.modules והחיבורים שלו נסגרים.
+
+מודול שיש handler שרץ עליו (use()) לא נפלט: הפליטה מדלגת עליו, ו-pop()
+דוחה את הפריקה עד שה-handler האחרון מסיים.
+פליטה זורקת את כל המצב ברמת המודול (משתנים גלובליים, מטמונים בזיכרון של
+הפלאגין) - בטעינה הבאה המודול מתחיל מאפס. מצב שצריך לשרוד נשמר ב-save_state.
+"""
+
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class TenantPluginCache:
+    """
+    מטמון שם פלאגין -> PluginEntry עם LRU ופליטת מודולים לא פעילים.
+    """
+
+    def __init__(self, load_fn, max_size=200, idle_seconds=1800, sweep_interval=60):
+        """
+        Args:
+            load_fn: פונקציה (plugin_name) שמייבאת את הפלאגין ומחזירה PluginEntry או None
+            max_size: מספר המודולים המקסימלי בזיכרון
+            idle_seconds: אחרי כמה שניות בלי שימוש מודול נפלט (0 = ללא הגבלה)
+            sweep_interval: כל כמה שניות לבדוק מודולים לא פעילים
+        """
+        self._load_fn = load_fn
+        self._max_size = max(1, int(max_size))
+        self._idle_seconds = idle_seconds
+        self._sweep_interval = sweep_interval
+
+        self._lock = threading.Lock()
+        # plugin_name -> [entry, last_used]
+        self._entries = OrderedDict()
+        # entry -> מספר ה-handlers שרצים עליו כרגע
+        self._in_use = {}
+        # מודולים שהוצאו מהמטמון בזמן שהיו בשימוש - נפרקים ב-release האחרון
+        self._deferred = set()
+        self._last_sweep = time.monotonic()
+
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._idle_evictions = 0
+        self._skipped_in_use = 0
+
+    @contextmanager
+    def use(self, plugin_name):
+        """
+        מחזיר את הפלאגין (כמו get) ומסמן אותו בשימוש עד סוף הבלוק,
+        כך שהמודול לא נפרק בזמן שה-handler שלו רץ.
+
+        Yields:
+            PluginEntry או None אם הטעינה נכשלה
+        """
+        entry = self.get(plugin_name, acquire=True)
+        try:
+            yield entry
+        finally:
+            if entry is not None:
+                self._release(entry)
+
+    def get(self, plugin_name, acquire=False):
+        """
+        מחזיר את הפלאגין מהמטמון, או טוען אותו אם אינו טעון.
+
+        Args:
+            plugin_name: שם הפלאגין
+            acquire: לסמן את הפלאגין בשימוש (חייב release - עדיף use())
+
+        Returns:
+            PluginEntry או None אם הטעינה נכשלה
+        """
+        now = time.monotonic()
+        evicted = self._sweep_idle(now)
+
+        with self._lock:
+            slot = self._entries.get(plugin_name)
+            if slot is not None:
+                slot[1] = now
+                self._entries.move_to_end(plugin_name)
+                self._hits += 1
+                entry = slot[0]
+                if acquire:
+                    self._in_use[entry] = self._in_use.get(entry, 0) + 1
+            else:
+                self._misses += 1
+                entry = None
+
+        if entry is None:
+            entry = self._load_fn(plugin_name)
+            if entry is not None:
+                with self._lock:
+                    if acquire:
+                        self._in_use[entry] = self._in_use.get(entry, 0) + 1
+                    self._entries[plugin_name] = [entry, now]
+                    self._entries.move_to_end(plugin_name)
+                    evicted.extend(self._evict_overflow())
+
+        for old_entry in evicted:
+            _unload(old_entry)
+        return entry
+
+    def pop(self, plugin_name):
+        """מסיר פלאגין מהמטמון ופורק אותו (למשל אחרי מחיקת פלאגין שנכשל)."""
+        with self._lock:
+            slot = self._entries.pop(plugin_name, None)
+            if slot is not None and self._in_use.get(slot[0]):
+                # handler עוד רץ על המודול - הפריקה תקרה כשיסיים
+                self._deferred.add(slot[0])
+                return
+        if slot is not None:
+            _unload(slot[0])
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "loaded": len(self._entries),
+                "max_size": self._max_size,
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "idle_evictions": self._idle_evictions,
+                "in_use": len(self._in_use),
+                "skipped_in_use": self._skipped_in_use,
+            }
+
+    # === Internal ===
+
+    def _release(self, entry):
+        """מסמן שה-handler סיים, ופורק מודול שהוצא מהמטמון בזמן שרץ."""
+        with self._lock:
+            count = self._in_use.get(entry, 0) - 1
+            if count > 0:
+                self._in_use[entry] = count
+                return
+            self._in_use.pop(entry, None)
+            if entry not in self._deferred:
+                return
+            self._deferred.discard(entry)
+        _unload(entry)
+
+    def _evict_overflow(self):
+        """מוציא את הפחות-בשימוש מעבר ל-max_size (מדלג על מודולים שרצים). נקרא עם הנעילה."""
+        evicted = []
+        excess = len(self._entries) - self._max_size
+        for name in list(self._entries):
+            if excess <= 0:
+                break
+            entry = self._entries[name][0]
+            if self._in_use.get(entry):
+                self._skipped_in_use += 1
+                continue
+            del self._entries[name]
+            evicted.append(entry)
+            self._evictions += 1
+            excess -= 1
+        return evicted
+
+    def _sweep_idle(self, now):
+        """מוציא מהמטמון מודולים שלא היו בשימוש idle_seconds. מחזיר אותם לפריקה."""
+        if not self._idle_seconds or now - self._last_sweep < self._sweep_interval:
+            return []
+
+        evicted = []
+        with self._lock:
+            self._last_sweep = now
+            # הסדר הוא LRU - הלא-פעילים בהתחלה
+            for name, (entry, last_used) in list(self._entries.items()):
+                if now - last_used < self._idle_seconds:
+                    break
+                if self._in_use.get(entry):
+                    # handler ארוך שעוד רץ - לא פורקים מתחתיו
+                    self._skipped_in_use += 1
+                    continue
+                del self._entries[name]
+                evicted.append(entry)
+                self._idle_evictions += 1
+        return evicted
+
+
+def _unload(entry):
+    """מסיר את המודול מ-sys.modules וסוגר את חיבור ה-MongoDB שלו."""
+    module = entry.module
+    module_name = module.__name__
+    if sys.modules.get(module_name) is module:
+        del sys.modules[module_name]
+
+    # importlib שומר את תת-המודול גם כמאפיין של החבילה (plugins.bot_123)
+    package_name, _, attr_name = module_name.rpartition(".")
+    package = sys.modules.get(package_name)
+    if package is not None and getattr(package, attr_name, None) is module:
+        delattr(package, attr_name)
+
+    client = getattr(module, "_state_mongo_client", None)
+    if client is not None:
+        try:
+            client.close()
+        except Exception as e:
+            print(f"⚠️ Failed closing MongoDB client of {module_name}: {e}")
+        # handler שעוד רץ על המודול יפתח חיבור חדש במקום להשתמש בסגור
+        module._state_mongo_client = None
+        module._state_mongo_db = None
+
+    print(f"♻️ Plugin unloaded: {entry.name}")
@@ -0,0 +1,199 @@
+"""
+Engine Write Buffer - כתיבה מרוכזת (write-behind) ל-MongoDB
+מסמכי אנליטיקס נאספים בזיכרון ונכתבים ב-insert_many אחד לפי גודל או זמן,
+במקום insert_one סינכרוני על כל עדכון בנתיב ה-webhook.
+"""
+
+import threading
+import time
+from collections import deque
+
+from pymongo.errors import BulkWriteError
+
+
+OVERFLOW_DROP_OLDEST = "drop_oldest"
+OVERFLOW_DROP_NEWEST = "drop_newest"
+
+
+class BufferedWriter:
+    """
+    באפר כתיבה חסום בגודל עבור collection אחד.
+    thread רקע מרוקן את הבאפר כל flush_interval שניות או כשמגיעים ל-batch_size.
+    """
+
+    def __init__(self, get_db, collection, batch_size=200, flush_interval=2.0,
+                 max_buffer=10000, overflow=OVERFLOW_DROP_OLDEST, on_written=None):
+        """
+        Args:
+            get_db: פונקציה שמחזירה חיבור ל-MongoDB (או None)
+            collection: שם ה-collection
+            batch_size: מספר מסמכים שמפעיל כתיבה מיידית
+            flush_interval: זמן מקסימלי (שניות) שמסמך ממתין בבאפר
+            max_buffer: מספר המסמכים המקסימלי בזיכרון
+            overflow: מה לעשות כשהבאפר מלא - drop_oldest / drop_newest
+            on_written: פונקציה (db, docs) שנקראת עם המסמכים שנכתבו (למשל לעדכון סיכומים)
+        """
+        self._get_db = get_db
+        self._collection = collection
+        self._batch_size = max(1, int(batch_size))
+        self._flush_interval = flush_interval
+        self._max_buffer = max(1, int(max_buffer))
+        self._overflow = overflow
+        self._on_written = on_written
+
+        self._cond = threading.Condition()
+        self._buffer = deque()
+        self._thread = None
+        self._closed = False
+        self._flush_lock = threading.Lock()
+
+        self._appended = 0
+        self._written = 0
+        self._dropped = 0
+        self._failed_batches = 0
+        self._flushes = 0
+
+    def append(self, doc):
+        """
+        מוסיף מסמך לבאפר בלי לחסום.
+
+        Returns:
+            bool: האם המסמך נשמר בבאפר (False = נזרק לפי מדיניות ה-overflow)
+        """
+        self._ensure_thread()
+        with self._cond:
+            if len(self._buffer) >= self._max_buffer:
+                self._dropped += 1
+                if self._overflow == OVERFLOW_DROP_NEWEST:
+                    return False
+                self._buffer.popleft()
+
+            self._buffer.append(doc)
+            self._appended += 1
+            if len(self._buffer) >= self._batch_size:
+                self._cond.notify()
+        return True
+
+    def flush(self):
+        """
+        כותב מיד את כל מה שבבאפר.
+
+        Returns:
+            int: מספר המסמכים שנכתבו
+        """
+        written = 0
+        with self._flush_lock:
+            while True:
+                with self._cond:
+                    if not self._buffer:
+                        break
+                    count = min(len(self._buffer), self._batch_size)
+                    batch = [self._buffer.popleft() for _ in range(count)]
+                inserted = self._write(batch)
+                if inserted is None:
+                    break
+                written += inserted
+        return written
+
+    def close(self, timeout=5.0):
+        """עוצר את ה-thread וכותב את מה שנשאר (לשימוש בכיבוי השרת)."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.flush()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "collection": self._collection,
+                "buffered": len(self._buffer),
+                "max_buffer": self._max_buffer,
+                "appended": self._appended,
+                "written": self._written,
+                "dropped": self._dropped,
+                "failed_batches": self._failed_batches,
+                "flushes": self._flushes,
+            }
+
+    # === Internal ===
+
+    def _ensure_thread(self):
+        if self._thread is not None:
+            return
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(
+                target=self._flush_loop,
+                name=f"write-buffer-{self._collection}",
+                daemon=True,
+            )
+            self._thread.start()
+
+    def _flush_loop(self):
+        while True:
+            with self._cond:
+                deadline = time.monotonic() + self._flush_interval
+                while not self._closed and len(self._buffer) < self._batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                if self._closed:
+                    return
+            self.flush()
+
+    def _write(self, batch):
+        """
+        כותב batch אחד.
+
+        Returns:
+            int: מספר המסמכים שנכתבו, או None אם הכתיבה נכשלה והמסמכים הוחזרו לבאפר
+        """
+        db = self._get_db()
+        if db is None:
+            with self._cond:
+                self._dropped += len(batch)
+            return 0
+
+        written_docs = batch
+        try:
+            result = db[self._collection].insert_many(batch, ordered=False)
+            inserted = len(result.inserted_ids)
+        except BulkWriteError as e:
+            # ordered=False: מסמכים תקינים נכתבו, השגויים לא ינוסו שוב
+            inserted = e.details.get("nInserted", 0)
+            failed = {error.get("index") for error in e.details.get("writeErrors", [])}
+            written_docs = [doc for i, doc in enumerate(batch) if i not in failed]
+            with self._cond:
+                self._failed_batches += 1
+                self._dropped += len(batch) - inserted
+            print(f"⚠️ Partial bulk write to {self._collection}: {inserted}/{len(batch)}")
+        except Exception as e:
+            print(f"⚠️ Failed bulk write to {self._collection}: {e}")
+            with self._cond:
+                self._failed_batches += 1
+                # החזרה לראש הבאפר (בכפוף לגודל המקסימלי) - ננסה שוב ב-flush הבא.
+                # מה שלא נכנס נזרק לפי מדיניות ה-overflow: ב-drop_oldest ה-batch
+                # הוא הישן ביותר, אז נשמרים המסמכים החדשים שבו
+                room = max(0, self._max_buffer - len(self._buffer))
+                if self._overflow == OVERFLOW_DROP_NEWEST:
+                    keep = batch[:room]
+                else:
+                    keep = batch[len(batch) - room:] if room else []
+                self._dropped += len(batch) - len(keep)
+                self._buffer.extendleft(reversed(keep))
+            return None
+
+        with self._cond:
+            self._written += inserted
+            self._flushes += 1
+
+        if self._on_written is not None and written_docs:
+            try:
+                self._on_written(db, written_docs)
+            except Exception as e:
+                print(f"⚠️ on_written failed for {self._collection}: {e}")
+        return inserted
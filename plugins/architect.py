@@ -14,14 +14,26 @@ import ast
 import requests
 from pathlib import Path
 
-from pymongo import MongoClient
+from pymongo import MongoClient, ReturnDocument
 from pymongo.errors import ConnectionFailure, ServerSelectionTimeoutError, DuplicateKeyError
 
 from config import Config
-from engine.app import log_funnel_event
+from engine.app import (
+    log_funnel_event, telegram_client, bot_registry_cache, record_flow_rollup, unique_users,
+    run_rollup_backfills, send_telegram_message,
+)
+from engine.telegram_api import WEBHOOK_ALLOWED_UPDATES
+from engine.funnel import FLOW_ROLLUP_FIELDS, apply_flow_updates
+from engine.activity import get_activity_totals
 
 
 COMMAND_PREFIX = "/create_bot"
+
+# הצהרות ניתוב למנוע (engine/routing.py)
+COMMANDS = ["/start", "/stats", "/cancel", "/create_bot"]
+CALLBACK_DATA = ["create_bot", "cancel"]
+# שיחה מונחית: טוקן ותיאור מגיעים כטקסט חופשי
+CATCH_ALL = True
 GITHUB_API_BASE = "https://api.github.com"
 ANTHROPIC_API_URL = "https://api.anthropic.com/v1/messages"
 ANTHROPIC_MODEL = "claude-sonnet-4-5-20250929"
@@ -176,8 +188,11 @@ def _get_mongo_db():
     try:
         _mongo_client = MongoClient(mongo_uri, serverSelectionTimeoutMS=5000)
         _mongo_client.admin.command('ping')
-        _mongo_db = _mongo_client.get_database("bot_factory")
-        _ensure_funnel_indexes(_mongo_db)
+        db = _mongo_client.get_database("bot_factory")
+        _ensure_funnel_indexes(db)
+        # flows נכתבים רק אחרי שהסיכומים נבנו מהנתונים הקיימים
+        run_rollup_backfills(db)
+        _mongo_db = db
         return _mongo_db
     except (ConnectionFailure, ServerSelectionTimeoutError) as e:
         print(f"❌ MongoDB connection failed in architect: {e}")
@@ -298,27 +313,12 @@ INVALID_TOKEN_MESSAGE = """⚠️ הטוקן לא נראה תקין.
 
 # קוד עזר לשמירת מצב - יתווסף אוטומטית לכל בוט שנוצר
 # Note: Double curly braces {{ }} are escaped for .format() - they become single { } in output
-STATE_HELPER_CODE = '''# === MongoDB State Helpers (auto-generated) ===
-import os
-from pymongo import MongoClient
+STATE_HELPER_CODE = '''# === State Helpers (auto-generated) ===
+# השמירה עוברת דרך ה-StateStore המשותף של המנוע (חיבור MongoDB אחד לכל הבוטים)
+from engine.state import get_state_store
 
-_state_mongo_client = None
-_state_mongo_db = None
 BOT_ID = "{bot_id}"
 
-def _get_state_db():
-    """מחזיר חיבור ל-MongoDB לשמירת מצב."""
-    global _state_mongo_client, _state_mongo_db
-    if _state_mongo_db is None:
-        mongo_uri = os.environ.get("MONGO_URI")
-        if mongo_uri:
-            try:
-                _state_mongo_client = MongoClient(mongo_uri, serverSelectionTimeoutMS=5000)
-                _state_mongo_db = _state_mongo_client.get_database("bot_factory")
-            except Exception:
-                return None
-    return _state_mongo_db
-
 def save_state(user_id, key, value):
     """
     שומר מידע ב-MongoDB עבור משתמש ספציפי.
@@ -331,18 +331,7 @@ def save_state(user_id, key, value):
     Returns:
         bool: האם השמירה הצליחה
     """
-    db = _get_state_db()
-    if db is None:
-        return False
-    try:
-        db.bot_states.update_one(
-            {{"bot_id": BOT_ID, "user_id": str(user_id), "key": key}},
-            {{"$set": {{"value": value}}}},
-            upsert=True
-        )
-        return True
-    except Exception:
-        return False
+    return get_state_store().save(BOT_ID, user_id, key, value)
 
 def load_state(user_id, key, default=None):
     """
@@ -356,14 +345,76 @@ def load_state(user_id, key, default=None):
     Returns:
         הערך השמור או ערך ברירת המחדל
     """
-    db = _get_state_db()
-    if db is None:
-        return default
-    try:
-        doc = db.bot_states.find_one({{"bot_id": BOT_ID, "user_id": str(user_id), "key": key}})
-        return doc.get("value", default) if doc else default
-    except Exception:
-        return default
+    return get_state_store().load(BOT_ID, user_id, key, default)
+
+def save_states(user_id, values):
+    """
+    שומר כמה מפתחות של משתמש בבת אחת.
+    
+    Args:
+        user_id: מזהה המשתמש
+        values: מילון של מפתח -> ערך
+    
+    Returns:
+        bool: האם השמירה הצליחה
+    """
+    return get_state_store().save_many(BOT_ID, user_id, values)
+
+def load_states(user_id, keys, defaults=None):
+    """
+    טוען כמה מפתחות של משתמש בבת אחת.
+    
+    Args:
+        user_id: מזהה המשתמש
+        keys: רשימת מפתחות לטעינה
+        defaults: מילון של מפתח -> ערך ברירת מחדל (אופציונלי)
+    
+    Returns:
+        dict: מפתח -> הערך השמור (או ברירת המחדל / None)
+    """
+    return get_state_store().load_many(BOT_ID, user_id, keys, defaults)
+
+def incr_state(user_id, key, amount=1):
+    """
+    מגדיל מונה באופן אטומי (מפתח שלא קיים מתחיל מ-0).
+    
+    Args:
+        user_id: מזהה המשתמש
+        key: מפתח המונה
+        amount: בכמה להגדיל (אפשר גם שלילי)
+    
+    Returns:
+        הערך החדש, או None אם העדכון נכשל
+    """
+    return get_state_store().incr(BOT_ID, user_id, key, amount)
+
+def push_state(user_id, key, item):
+    """
+    מוסיף פריט לסוף רשימה שמורה באופן אטומי.
+    
+    Args:
+        user_id: מזהה המשתמש
+        key: מפתח הרשימה
+        item: הפריט להוספה
+    
+    Returns:
+        bool: האם העדכון הצליח
+    """
+    return get_state_store().push(BOT_ID, user_id, key, item)
+
+def pull_state(user_id, key, item):
+    """
+    מסיר פריט (כל המופעים שלו) מרשימה שמורה באופן אטומי.
+    
+    Args:
+        user_id: מזהה המשתמש
+        key: מפתח הרשימה
+        item: הפריט להסרה
+    
+    Returns:
+        bool: האם העדכון הצליח
+    """
+    return get_state_store().pull(BOT_ID, user_id, key, item)
 
 # === End of State Helpers ===
 
@@ -392,7 +443,7 @@ CLAUDE_SYSTEM_PROMPT = """אתה המוח מאחורי 'מפעל בוטים מו
 
 === PERSISTENT STORAGE - MongoDB Helper Functions ===
 
-Two helper functions are pre-injected into every bot for saving/loading user data:
+These helper functions are pre-injected into every bot for saving/loading user data:
 
 save_state(user_id, key, value) - Saves data to MongoDB
    - user_id: The user's Telegram ID (passed to handle_message)
@@ -406,13 +457,44 @@ load_state(user_id, key, default=None) - Loads data from MongoDB
    - default: Value to return if key doesn't exist
    - Returns: The saved value or default
 
+load_states(user_id, keys, defaults=None) - Loads several keys in ONE database call
+   - keys: A list of keys to load
+   - defaults: Optional dict of key -> default value (missing keys without a default are None)
+   - Returns: A dict of key -> value
+
+save_states(user_id, values) - Saves several keys in ONE database call
+   - values: A dict of key -> value
+   - Returns: True if saved successfully, False otherwise
+
 Example usage:
    score = load_state(user_id, "score", 0)
    score += 10
    save_state(user_id, "score", score)
 
+When a handler needs more than one key, ALWAYS use load_states/save_states instead of
+several load_state/save_state calls:
+   state = load_states(user_id, ["score", "level", "awaiting_answer"], {"score": 0, "level": 1})
+   state["score"] += 10
+   save_states(user_id, {"score": state["score"], "awaiting_answer": False})
+
+incr_state(user_id, key, amount=1) - Atomically adds amount to a numeric counter
+   - A missing key starts from 0
+   - Returns: The new value (or None on failure)
+
+push_state(user_id, key, item) - Atomically appends item to a saved list
+   - A missing key becomes a new list [item]
+   - Returns: True if saved successfully, False otherwise
+
+pull_state(user_id, key, item) - Atomically removes every occurrence of item from a saved list
+   - Returns: True if saved successfully, False otherwise
+
+For counters and lists ALWAYS use the atomic helpers instead of load -> modify -> save:
+   count = incr_state(user_id, "messages_count")           # NOT load_state + 1 + save_state
+   push_state(user_id, "cart", item_id)                    # NOT cart.append + save_state
+   pull_state(user_id, "cart", item_id)                    # NOT cart.remove + save_state
+
 IMPORTANT: Do NOT import or define these functions - they are already available!
-Do NOT use global variables (like users = {} or scores = []) - use save_state/load_state instead.
+Do NOT use global variables (like users = {} or scores = []) - use the state helpers instead.
 
 === SECURITY POLICY (TERMINAL BOTS ARE FORBIDDEN) ===
 Do NOT create bots that run terminal/OS commands or execute processes.
@@ -576,24 +658,26 @@ def _create_flow(user_id):
     flow_id = _generate_flow_id()
     now = datetime.datetime.utcnow()
     
+    flow = {
+        "_id": flow_id,
+        "user_id": str(user_id),
+        "creator_id": str(user_id),
+        "status": "started",
+        "current_stage": 1,
+        "bot_token_id": None,
+        "created_at": now,
+        "updated_at": now,
+        "completed_at": None,
+        "final_status": None,
+        "stage_times": {"stage_1_at": now}
+    }
     try:
-        db.bot_flows.insert_one({
-            "_id": flow_id,
-            "user_id": str(user_id),
-            "creator_id": str(user_id),
-            "status": "started",
-            "current_stage": 1,
-            "bot_token_id": None,
-            "created_at": now,
-            "updated_at": now,
-            "completed_at": None,
-            "final_status": None,
-            "stage_times": {"stage_1_at": now}
-        })
-        return flow_id
+        db.bot_flows.insert_one(flow)
     except Exception as e:
         print(f"❌ Failed to create flow: {e}")
         return None
+    record_flow_rollup(db, None, flow)
+    return flow_id
 
 
 def _update_flow(flow_id, status=None, stage=None, bot_token_id=None, final_status=None):
@@ -627,7 +711,13 @@ def _update_flow(flow_id, status=None, stage=None, bot_token_id=None, final_stat
             updates["current_stage"] = stage
             updates[f"stage_times.stage_{stage}_at"] = now
     
-    db.bot_flows.update_one({"_id": flow_id}, {"$set": updates})
+    # המצב הקודם חוזר מאותה פעולה אטומית - הסיכומים היומיים מתעדכנים לפי ההפרש
+    before = db.bot_flows.find_one_and_update(
+        {"_id": flow_id}, {"$set": updates},
+        projection=FLOW_ROLLUP_FIELDS, return_document=ReturnDocument.BEFORE
+    )
+    if before:
+        record_flow_rollup(db, before, apply_flow_updates(before, updates))
 
 
 def _get_flow(flow_id):
@@ -792,19 +882,11 @@ def _notify_admin(message, error_type="general"):
     
     full_message = f"{icon} *התראת מערכת - Architect*\n\n{message}"
     
-    try:
-        requests.post(
-            f"https://api.telegram.org/bot{telegram_token}/sendMessage",
-            json={
-                "chat_id": admin_chat_id,
-                "text": full_message,
-                "parse_mode": "Markdown"
-            },
-            timeout=10
-        )
-        print(f"✅ Admin notified: {error_type}")
-    except Exception as e:
-        print(f"❌ Failed to notify admin: {e}")
+    # דרך מתזמן השליחה של המנוע (הגבלת קצב ו-retry_after כשהוא פעיל)
+    send_telegram_message(
+        telegram_token, admin_chat_id, {"text": full_message, "parse_mode": "Markdown"}
+    )
+    print(f"✅ Admin notified: {error_type}")
 
 
 def _register_bot_in_mongodb(bot_token, plugin_filename, user_id=None):
@@ -842,6 +924,7 @@ def _register_bot_in_mongodb(bot_token, plugin_filename, user_id=None):
             {"$set": doc},
             upsert=True
         )
+        bot_registry_cache.put(bot_token, plugin_filename)
         print(f"✅ Bot registered in MongoDB: {plugin_filename}")
         return True, None
     except Exception as e:
@@ -852,6 +935,7 @@ def _register_bot_in_mongodb(bot_token, plugin_filename, user_id=None):
 def _bot_exists_in_mongodb(bot_token):
     """
     בודק אם בוט עם הטוקן הזה כבר קיים ב-MongoDB.
+    עובר דרך מטמון ה-registry של המנוע; בהחטאה נבדק ה-DB עצמו.
     
     Args:
         bot_token: טוקן הבוט
@@ -859,16 +943,7 @@ def _bot_exists_in_mongodb(bot_token):
     Returns:
         bool: האם הבוט קיים
     """
-    db = _get_mongo_db()
-    if db is None:
-        return False
-    
-    try:
-        result = db.bot_registry.find_one({"token": bot_token})
-        return result is not None
-    except Exception as e:
-        print(f"❌ Error checking bot in MongoDB: {e}")
-        return False
+    return bot_registry_cache.get(bot_token, fresh=True) is not None
 
 
 def _get_user_bots_created_today(user_id):
@@ -950,25 +1025,17 @@ def _get_admin_stats(user_id):
         # חישוב תאריך לפני שבוע
         one_week_ago = datetime.datetime.utcnow() - datetime.timedelta(days=7)
         
-        # ספירת משתמשים ייחודיים בשבוע האחרון
-        unique_users_pipeline = [
-            {"$match": {"timestamp": {"$gte": one_week_ago}}},
-            {"$group": {"_id": "$user_id"}},
-            {"$count": "total"}
-        ]
-        unique_users_result = list(db.user_actions.aggregate(unique_users_pipeline))
-        unique_users_count = unique_users_result[0]["total"] if unique_users_result else 0
-        
-        # סה"כ פעולות בשבוע האחרון
-        total_actions = db.user_actions.count_documents({"timestamp": {"$gte": one_week_ago}})
-        
-        # פעולות לפי סוג
-        actions_by_type_pipeline = [
-            {"$match": {"timestamp": {"$gte": one_week_ago}}},
-            {"$group": {"_id": "$action_type", "count": {"$sum": 1}}},
-            {"$sort": {"count": -1}}
+        # משתמשים ייחודיים, סה"כ פעולות ופילוח לפי סוג - מהסיכומים היומיים (7 מסמכים)
+        activity = get_activity_totals(db, 7, unique_users)
+        unique_users_count = activity["unique_users"]
+        unique_users_approximate = not activity["unique_users_exact"]
+        total_actions = activity["actions"]
+        actions_by_type = [
+            {"_id": action_type, "count": count}
+            for action_type, count in sorted(
+                activity["types"].items(), key=lambda item: item[1], reverse=True
+            )
         ]
-        actions_by_type = list(db.user_actions.aggregate(actions_by_type_pipeline))
         
         # טופ 10 משתמשים פעילים
         top_users_pipeline = [
@@ -986,7 +1053,7 @@ def _get_admin_stats(user_id):
         stats_message = f"""📊 *סטטיסטיקות מערכת - 7 ימים אחרונים*
 
 👥 *משתמשים:*
-• משתמשים ייחודיים: {unique_users_count}
+• משתמשים ייחודיים: {unique_users_count}{' (בקירוב)' if unique_users_approximate else ''}
 • סה"כ פעולות: {total_actions}
 
 🤖 *בוטים רשומים:* {total_bots}
@@ -1340,16 +1407,16 @@ def _set_telegram_webhook(bot_token, max_retries=3):
         return False, "חסר RENDER_EXTERNAL_URL בקונפיגורציה"
     
     webhook_url = f"{render_url.rstrip('/')}/{bot_token}"
-    api_url = f"https://api.telegram.org/bot{bot_token}/setWebhook"
     
     last_error = None
     for attempt in range(max_retries):
         try:
             # timeout גדל עם כל ניסיון: 30, 45, 60 שניות
             timeout = 30 + (attempt * 15)
-            response = requests.post(
-                api_url,
-                json={"url": webhook_url},
+            response = telegram_client.post(
+                bot_token,
+                "setWebhook",
+                {"url": webhook_url, "allowed_updates": WEBHOOK_ALLOWED_UPDATES},
                 timeout=timeout
             )
             if response.ok:
@@ -0,0 +1,96 @@
+"""
+הגדרות משותפות לבדיקות.
+בדיקות שצריכות MongoDB רצות מול mongomock (requirements-dev.txt).
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+
+def _bulk_write(self, requests, ordered=True, **kwargs):
+    """
+    bulk_write של mongomock לא תואם ל-pymongo 4.x - מריצים את הפעולות אחת אחת
+    ומחזירים BulkWriteError באותו מבנה כמו השרת.
+    """
+    from pymongo import DeleteOne, InsertOne, UpdateOne
+    from pymongo.errors import BulkWriteError, PyMongoError
+
+    errors = []
+    for index, operation in enumerate(requests):
+        try:
+            if isinstance(operation, UpdateOne):
+                self.update_one(operation._filter, operation._doc, upsert=operation._upsert)
+            elif isinstance(operation, InsertOne):
+                self.insert_one(operation._doc)
+            elif isinstance(operation, DeleteOne):
+                self.delete_one(operation._filter)
+            else:
+                raise NotImplementedError(type(operation).__name__)
+        except PyMongoError as e:
+            errors.append({"index": index, "code": getattr(e, "code", None), "errmsg": str(e)})
+            if ordered:
+                break
+    if errors:
+        raise BulkWriteError({"writeErrors": errors, "nInserted": 0})
+
+
+@pytest.fixture
+def mongo_db():
+    """DB ריק ב-mongomock (כולל GridFS)."""
+    mongomock = pytest.importorskip("mongomock")
+    import mongomock.gridfs
+
+    from engine import migrations
+
+    # פעולות חד-פעמיות שהושלמו נזכרות בתהליך - ב-DB חדש הן עוד לא רצו
+    migrations._completed.clear()
+
+    mongomock.gridfs.enable_gridfs_integration()
+    original = mongomock.Collection.bulk_write
+    mongomock.Collection.bulk_write = _bulk_write
+    try:
+        yield mongomock.MongoClient().get_database("bot_factory")
+    finally:
+        mongomock.Collection.bulk_write = original
+
+
+class FakeResponse:
+    """תשובת requests מינימלית (status_code, ok, json, text)."""
+
+    def __init__(self, status_code=200, body=None):
+        self.status_code = status_code
+        self.ok = 200 <= status_code < 300
+        self._body = body if body is not None else {"ok": self.ok}
+        self.text = str(self._body)
+
+    def json(self):
+        return self._body
+
+
+@pytest.fixture
+def engine_app(monkeypatch):
+    """
+    מודול engine.app בלי MongoDB ובלי טלגרם אמיתי: כל קריאה ל-Bot API
+    נרשמת ב-engine_app.sent_calls ומחזירה תשובה מוצלחת.
+    """
+    monkeypatch.delenv("MONGO_URI", raising=False)
+    import engine.app as app_module
+
+    calls = []
+
+    def post(bot_token, method, payload=None, **kwargs):
+        calls.append((bot_token, method, payload))
+        return FakeResponse(200, {"ok": True, "result": True})
+
+    monkeypatch.setattr(app_module.telegram_client, "post", post)
+    monkeypatch.setattr(app_module, "update_deduplicator", None)
+    monkeypatch.setattr(app_module.Config, "WEBHOOK_ASYNC_MODE", False)
+    monkeypatch.setattr(app_module.Config, "WEBHOOK_INLINE_REPLY", False)
+    monkeypatch.setattr(app_module, "outbound_scheduler", None)
+    monkeypatch.setattr(app_module, "sent_calls", calls, raising=False)
+    return app_module
+
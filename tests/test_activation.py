@@ -0,0 +1,85 @@
+import time
+
+from engine.activation import ActivationCache
+
+
+def _flow(db, bot_token_id, creator_id="42", status="created"):
+    return db.bot_flows.insert_one({
+        "bot_token_id": bot_token_id, "creator_id": creator_id, "status": status,
+    }).inserted_id
+
+
+def test_activated_bot_is_never_read_again(mongo_db):
+    _flow(mongo_db, "111", status="activated")
+    cache = ActivationCache(lambda: mongo_db, pending_ttl=0)
+    assert cache.get("111").activated
+    for _ in range(5):
+        assert cache.get("111").activated
+    assert cache.stats()["db_reads"] == 1
+
+
+def test_pending_bot_is_rechecked_after_ttl(mongo_db):
+    flow_id = _flow(mongo_db, "111")
+    cache = ActivationCache(lambda: mongo_db, pending_ttl=300)
+    entry = cache.get("111")
+    assert entry.flow_id == flow_id and entry.creator_id == "42" and not entry.activated
+    cache.get("111")
+    assert cache.stats()["db_reads"] == 1
+
+    # worker אחר הפעיל את הבוט - אחרי ה-TTL הסטטוס נקרא מחדש
+    mongo_db.bot_flows.update_one({"_id": flow_id}, {"$set": {"status": "activated"}})
+    cache._entries["111"].cached_at = time.monotonic() - 301
+    assert cache.get("111").activated
+    assert cache.stats()["db_reads"] == 2
+
+
+def test_mark_activated_stops_db_checks(mongo_db):
+    _flow(mongo_db, "111")
+    cache = ActivationCache(lambda: mongo_db, pending_ttl=0)
+    cache.get("111")
+    cache.mark_activated("111")
+    assert cache.get("111").activated
+    assert cache.stats()["db_reads"] == 1
+
+
+def test_bot_without_flow_is_cached_negatively(mongo_db):
+    cache = ActivationCache(lambda: mongo_db, negative_ttl=60)
+    assert cache.get("999") is None
+    assert cache.get("999") is None
+    assert cache.stats()["db_reads"] == 1
+
+    cache._entries["999"].cached_at = time.monotonic() - 61
+    _flow(mongo_db, "999")
+    assert cache.get("999") is not None
+
+
+def test_cache_is_bounded(mongo_db):
+    for token_id in ("1", "2", "3"):
+        _flow(mongo_db, token_id, status="activated")
+    cache = ActivationCache(lambda: mongo_db, max_size=2)
+    cache.get("1")
+    cache.get("2")
+    cache.get("1")
+    cache.get("3")
+    assert list(cache._entries) == ["1", "3"]
+
+
+def test_no_database_returns_none():
+    cache = ActivationCache(lambda: None)
+    assert cache.get("111") is None
+
+
+def test_creator_message_activates_flow_once(engine_app, mongo_db, monkeypatch):
+    monkeypatch.setattr(engine_app, "get_mongo_db", lambda: mongo_db)
+    cache = ActivationCache(lambda: mongo_db)
+    monkeypatch.setattr(engine_app, "activation_cache", cache)
+    flow_id = _flow(mongo_db, "111", creator_id="42")
+
+    engine_app._log_activation_if_creator("111:ABC", 7)
+    assert mongo_db.bot_flows.find_one({"_id": flow_id})["status"] == "created"
+
+    engine_app._log_activation_if_creator("111:ABC", 42)
+    engine_app._log_activation_if_creator("111:ABC", 42)
+    assert mongo_db.bot_flows.find_one({"_id": flow_id})["status"] == "activated"
+    assert mongo_db.funnel_events.count_documents({"event_type": "bot_activated_by_creator"}) == 1
+    assert cache.stats()["db_reads"] == 1
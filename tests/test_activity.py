@@ -0,0 +1,77 @@
+import datetime
+
+from engine.activity import (
+    BACKFILL_MIGRATION, ROLLUPS_COLLECTION, backfill_activity_rollups, get_activity_totals,
+    record_actions,
+)
+from engine.hll import UniqueCounter
+from engine.migrations import MIGRATIONS_COLLECTION
+
+NOW = datetime.datetime(2026, 3, 10, 12, 0)
+YESTERDAY = NOW - datetime.timedelta(days=1)
+UNIQUE = UniqueCounter(precision=10, exact_limit=100)
+
+
+def _action(user_id, action_type="message", timestamp=NOW):
+    return {"user_id": user_id, "action_type": action_type, "timestamp": timestamp}
+
+
+def _totals(db, days=7):
+    return get_activity_totals(db, days, UNIQUE, now=NOW)
+
+
+def test_written_actions_update_daily_totals(mongo_db):
+    record_actions(mongo_db, [_action(1), _action(1, "callback"), _action(2, timestamp=YESTERDAY)], UNIQUE)
+    record_actions(mongo_db, [_action("1")], UNIQUE)
+
+    totals = _totals(mongo_db)
+    assert totals["actions"] == 4
+    assert totals["types"] == {"message": 3, "callback": 1}
+    assert (totals["unique_users"], totals["unique_users_exact"]) == (2, True)
+    assert _totals(mongo_db, days=1)["actions"] == 3
+
+
+def _seed_history(db):
+    db.user_actions.insert_many([
+        _action(1, timestamp=YESTERDAY),
+        _action(2, timestamp=YESTERDAY),
+        _action(1, "callback"),
+    ])
+
+
+def test_backfill_builds_rollups_from_existing_actions(mongo_db):
+    _seed_history(mongo_db)
+    assert backfill_activity_rollups(mongo_db, UNIQUE) == {"days": 2}
+    totals = _totals(mongo_db)
+    assert totals["actions"] == 3 and totals["types"] == {"message": 2, "callback": 1}
+    assert (totals["unique_users"], totals["unique_users_exact"]) == (2, True)
+    assert mongo_db[MIGRATIONS_COLLECTION].find_one({"_id": BACKFILL_MIGRATION})["status"] == "done"
+
+
+def test_backfill_rebuilds_today_written_by_live_flushes(mongo_db):
+    _seed_history(mongo_db)
+    # flush חי שנכתב לפני הבניה יצר את מסמך היום עם הפעולות שאחרי העלייה בלבד
+    record_actions(mongo_db, [_action(1, "callback")], UNIQUE)
+
+    backfill_activity_rollups(mongo_db, UNIQUE)
+    assert _totals(mongo_db)["actions"] == 3
+    assert mongo_db[ROLLUPS_COLLECTION].count_documents({}) == 2
+
+
+def test_backfill_runs_once(mongo_db):
+    _seed_history(mongo_db)
+    backfill_activity_rollups(mongo_db, UNIQUE)
+    record_actions(mongo_db, [_action(3)], UNIQUE)
+    assert backfill_activity_rollups(mongo_db, UNIQUE) is None
+    assert _totals(mongo_db)["actions"] == 4
+
+
+def test_engine_runs_both_backfills_once(engine_app, mongo_db):
+    _seed_history(mongo_db)
+    mongo_db.bot_flows.insert_one({
+        "user_id": "1", "current_stage": 1, "created_at": NOW, "updated_at": NOW,
+    })
+    engine_app.run_rollup_backfills(mongo_db)
+    assert mongo_db[MIGRATIONS_COLLECTION].count_documents({"status": "done"}) == 2
+    assert mongo_db.funnel_rollups.count_documents({}) == 2
+    assert mongo_db[ROLLUPS_COLLECTION].count_documents({}) == 2
@@ -0,0 +1,108 @@
+import time
+
+from engine.admins import AdminRosterCache
+
+TOKEN = "1:A"
+CHAT = -100
+
+
+def _member(user_id, status="administrator"):
+    return {"user": {"id": user_id}, "status": status}
+
+
+class _Fetcher:
+    def __init__(self, members):
+        self.members = members
+        self.calls = 0
+
+    def __call__(self, bot_token, chat_id):
+        self.calls += 1
+        return self.members
+
+
+def _member_update(user_id, status):
+    return {"chat": {"id": CHAT}, "new_chat_member": _member(user_id, status)}
+
+
+def test_roster_is_fetched_once_within_ttl():
+    fetch = _Fetcher([_member(1, "creator"), _member(2), _member(3, "member")])
+    cache = AdminRosterCache(fetch, ttl=300)
+    assert cache.is_admin(TOKEN, CHAT, 1)
+    assert cache.is_admin(TOKEN, CHAT, "2")
+    assert not cache.is_admin(TOKEN, CHAT, 3)
+    assert fetch.calls == 1
+
+
+def test_roster_is_refetched_after_ttl():
+    fetch = _Fetcher([_member(1)])
+    cache = AdminRosterCache(fetch, ttl=300)
+    cache.is_admin(TOKEN, CHAT, 1)
+    fetch.members = [_member(2)]
+    cache._rosters[(TOKEN, CHAT)].loaded_at = time.monotonic() - 301
+    assert not cache.is_admin(TOKEN, CHAT, 1)
+    assert cache.is_admin(TOKEN, CHAT, 2)
+    assert fetch.calls == 2
+
+
+def test_member_updates_change_the_cached_roster():
+    fetch = _Fetcher([_member(1)])
+    cache = AdminRosterCache(fetch)
+    cache.is_admin(TOKEN, CHAT, 1)
+
+    cache.apply_member_update(TOKEN, _member_update(2, "administrator"))
+    assert cache.is_admin(TOKEN, CHAT, 2)
+    cache.apply_member_update(TOKEN, _member_update(1, "left"))
+    assert not cache.is_admin(TOKEN, CHAT, 1)
+    assert fetch.calls == 1
+    assert cache.stats()["member_updates"] == 2
+
+
+def test_member_update_for_unknown_chat_is_ignored():
+    fetch = _Fetcher([_member(1)])
+    cache = AdminRosterCache(fetch)
+    cache.apply_member_update(TOKEN, _member_update(2, "administrator"))
+    cache.apply_member_update(TOKEN, {"chat": {"id": CHAT}})
+    assert cache.stats()["chats"] == 0
+    assert not cache.is_admin(TOKEN, CHAT, 2)
+    assert fetch.calls == 1
+
+
+def test_failed_fetch_backs_off():
+    fetch = _Fetcher(None)
+    cache = AdminRosterCache(fetch, retry_seconds=30)
+    assert cache.is_admin(TOKEN, CHAT, 1) is None
+    assert cache.is_admin(TOKEN, CHAT, 1) is None
+    assert fetch.calls == 1
+
+    cache._failures[(TOKEN, CHAT)] = time.monotonic() - 31
+    fetch.members = [_member(1)]
+    assert cache.is_admin(TOKEN, CHAT, 1)
+    assert fetch.calls == 2
+
+
+def test_stale_roster_is_kept_while_backing_off():
+    fetch = _Fetcher([_member(1)])
+    cache = AdminRosterCache(fetch, ttl=300, retry_seconds=30)
+    cache.is_admin(TOKEN, CHAT, 1)
+    cache._rosters[(TOKEN, CHAT)].loaded_at = time.monotonic() - 301
+    fetch.members = None
+    assert cache.is_admin(TOKEN, CHAT, 1)
+    assert cache.is_admin(TOKEN, CHAT, 1)
+    assert fetch.calls == 2
+
+
+def test_member_update_clears_the_backoff():
+    fetch = _Fetcher(None)
+    cache = AdminRosterCache(fetch, retry_seconds=30)
+    cache.is_admin(TOKEN, CHAT, 1)
+    cache.apply_member_update(TOKEN, _member_update(1, "administrator"))
+    fetch.members = [_member(1)]
+    assert cache.is_admin(TOKEN, CHAT, 1)
+    assert fetch.calls == 2
+
+
+def test_cache_is_bounded():
+    cache = AdminRosterCache(_Fetcher([_member(1)]), max_chats=2)
+    for chat_id in (1, 2, 3):
+        cache.is_admin(TOKEN, chat_id, 1)
+    assert list(cache._rosters) == [(TOKEN, 2), (TOKEN, 3)]
@@ -0,0 +1,94 @@
+import threading
+import time
+
+from engine.cache import MemoryCache, MongoCache, ResponseCache, _MISS
+
+
+def test_memory_cache_expires_and_evicts_lru():
+    cache = MemoryCache(max_size=2)
+    cache.set("a", 1, ttl=60)
+    cache.set("b", 2, ttl=60)
+    assert cache.get("a") == 1
+    cache.set("c", 3, ttl=60)
+    # "b" הכי פחות בשימוש
+    assert cache.get("b") is _MISS
+    cache.set("a", 1, ttl=0)
+    assert cache.get("a") is _MISS
+
+
+def test_concurrent_misses_compute_once():
+    cache = ResponseCache(MemoryCache(), ttl=60)
+    calls = []
+    started = threading.Event()
+    release = threading.Event()
+
+    def compute():
+        calls.append(1)
+        started.set()
+        release.wait(2)
+        return {"value": 42}
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(cache.get_or_compute("k", compute)))
+    leader.start()
+    assert started.wait(2)
+    followers = [
+        threading.Thread(target=lambda: results.append(cache.get_or_compute("k", compute)))
+        for _ in range(5)
+    ]
+    for thread in followers:
+        thread.start()
+    time.sleep(0.05)
+    release.set()
+    for thread in [leader] + followers:
+        thread.join(2)
+
+    assert len(calls) == 1
+    assert results == [{"value": 42}] * 6
+    assert cache.stats()["coalesced"] == 5
+
+
+def test_cached_value_is_reused_until_invalidated():
+    cache = ResponseCache(MemoryCache(), ttl=60)
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return len(calls)
+
+    assert cache.get_or_compute("k", compute) == 1
+    assert cache.get_or_compute("k", compute) == 1
+    cache.invalidate("k")
+    assert cache.get_or_compute("k", compute) == 2
+    assert cache.stats()["hits"] == 1
+
+
+def test_failed_compute_releases_waiters():
+    cache = ResponseCache(MemoryCache(), ttl=60)
+
+    def broken():
+        raise RuntimeError("db down")
+
+    try:
+        cache.get_or_compute("k", broken)
+    except RuntimeError:
+        pass
+    assert cache.get_or_compute("k", lambda: "ok") == "ok"
+
+
+def test_mongo_lease_is_exclusive_between_workers(mongo_db):
+    first = MongoCache(lambda: mongo_db)
+    second = MongoCache(lambda: mongo_db)
+    assert first.acquire("k", lease_seconds=30)
+    assert not second.acquire("k", lease_seconds=30)
+    first.release("k")
+    assert second.acquire("k", lease_seconds=30)
+
+
+def test_mongo_cache_is_shared_between_workers(mongo_db):
+    computed = []
+    first = ResponseCache(MongoCache(lambda: mongo_db), ttl=60)
+    second = ResponseCache(MongoCache(lambda: mongo_db), ttl=60)
+    assert first.get_or_compute("k", lambda: computed.append(1) or {"n": 1}) == {"n": 1}
+    assert second.get_or_compute("k", lambda: computed.append(2) or {"n": 2}) == {"n": 1}
+    assert computed == [1]
@@ -0,0 +1,141 @@
+import time
+
+import pytest
+
+from engine.catalog import PluginCatalog, _list_plugin_files, is_system_plugin, is_tenant_plugin
+
+
+class _Entry:
+    def __init__(self, name):
+        self.name = name
+        self.routes = None
+        self.on_message = None
+        self.on_callback = None
+
+
+def _catalog(scan_fn, **kwargs):
+    kwargs.setdefault("watch_mode", "off")
+    return PluginCatalog(scan_fn, ".", **kwargs)
+
+
+def test_snapshot_does_not_rescan():
+    calls = []
+    entries = (_Entry("a"),)
+
+    def scan():
+        calls.append(1)
+        return entries
+
+    catalog = _catalog(scan)
+    first = catalog.snapshot()
+    for _ in range(5):
+        assert catalog.snapshot() is first
+    assert len(calls) == 1
+    assert first.generation == 1
+
+
+def test_reload_bumps_generation_only_on_change():
+    a, b = _Entry("a"), _Entry("b")
+    current = [a]
+    catalog = _catalog(lambda: list(current))
+
+    first = catalog.snapshot()
+    assert catalog.reload() is first
+
+    current.append(b)
+    second = catalog.reload()
+    assert second.generation == 2
+    assert [entry.name for entry in second.plugins] == ["a", "b"]
+    assert catalog.stats()["generation"] == 2
+
+
+def test_poll_watcher_reloads_on_new_plugin_file(tmp_path):
+    (tmp_path / "a.py").write_text("")
+
+    def scan():
+        return [_Entry(path.stem) for path in sorted(tmp_path.glob("*.py"))]
+
+    catalog = PluginCatalog(scan, tmp_path, watch_mode="poll", poll_interval=0.05)
+    assert catalog.snapshot().generation == 1
+    assert catalog.stats()["watcher"] == "poll"
+
+    (tmp_path / "b.py").write_text("")
+    deadline = time.monotonic() + 2
+    while catalog.snapshot().generation == 1 and time.monotonic() < deadline:
+        time.sleep(0.02)
+    names = [entry.name for entry in catalog.snapshot().plugins]
+    assert names == ["a", "b"]
+
+
+@pytest.fixture
+def plugins_dir(engine_app, tmp_path, monkeypatch):
+    monkeypatch.setattr(engine_app, "PLUGINS_DIR", tmp_path)
+    monkeypatch.setattr(engine_app, "PLUGINS_CACHE", {})
+    imported = []
+
+    def fake_import(name):
+        imported.append(name)
+        return None if name == "broken" else _Entry(name)
+
+    monkeypatch.setattr(engine_app, "_import_plugin", fake_import)
+    engine_app.imported = imported
+    return tmp_path
+
+
+def test_scan_loads_only_new_plugins_through_import_plugin(engine_app, plugins_dir):
+    (plugins_dir / "a.py").write_text("")
+    (plugins_dir / "broken.py").write_text("")
+    assert [entry.name for entry in engine_app._scan_plugins()] == ["a"]
+    assert engine_app.imported == ["a", "broken"]
+
+    (plugins_dir / "b.py").write_text("")
+    assert [entry.name for entry in engine_app._scan_plugins()] == ["a", "b"]
+    assert engine_app.imported == ["a", "broken", "b", "broken"]
+
+
+def test_scan_drops_deleted_plugins(engine_app, plugins_dir):
+    (plugins_dir / "a.py").write_text("")
+    (plugins_dir / "b.py").write_text("")
+    engine_app._scan_plugins()
+    (plugins_dir / "a.py").unlink()
+    assert [entry.name for entry in engine_app._scan_plugins()] == ["b"]
+    assert "a" not in engine_app.PLUGINS_CACHE
+
+
+def test_tenant_plugins_are_not_system_plugins():
+    assert is_tenant_plugin("bot_8453126341")
+    assert not is_tenant_plugin("architect")
+    assert not is_tenant_plugin("bot_helper")
+    assert is_system_plugin("architect")
+    assert not is_system_plugin("bot_8453126341")
+    assert not is_system_plugin("__init__")
+
+
+def test_scan_skips_tenant_plugins(engine_app, plugins_dir):
+    (plugins_dir / "architect.py").write_text("")
+    (plugins_dir / "bot_123456.py").write_text("")
+    (plugins_dir / "__init__.py").write_text("")
+    assert [entry.name for entry in engine_app._scan_plugins()] == ["architect"]
+    assert engine_app.imported == ["architect"]
+
+
+def test_tenant_file_changes_do_not_trigger_reload(tmp_path):
+    (tmp_path / "architect.py").write_text("")
+    before = _list_plugin_files(tmp_path, is_system_plugin)
+    (tmp_path / "bot_123456.py").write_text("")
+    assert _list_plugin_files(tmp_path, is_system_plugin) == before == frozenset({"architect.py"})
+
+
+def test_tenant_plugins_load_through_tenant_cache(engine_app, monkeypatch):
+    loaded = []
+
+    class _Tenants:
+        def get(self, name):
+            loaded.append(name)
+            return _Entry(name)
+
+    monkeypatch.setattr(engine_app, "tenant_plugins", _Tenants())
+    monkeypatch.setattr(engine_app, "PLUGINS_CACHE", {})
+    assert engine_app.load_plugin_by_name("bot_123456").name == "bot_123456"
+    assert loaded == ["bot_123456"]
+    assert engine_app.PLUGINS_CACHE == {}
@@ -0,0 +1,86 @@
+from engine.context import ChatHelpers, MessageContext
+
+TOKEN = "1:A"
+
+
+class _Helpers:
+    def __init__(self, admin=True):
+        self.calls = []
+        self.admin = admin
+
+    def recorder(self, name, result=True):
+        def call(*args):
+            self.calls.append((name,) + args)
+            return self.admin if name == "is_user_admin" else result
+        return call
+
+    def build(self):
+        names = ChatHelpers.__slots__
+        return ChatHelpers(**{name: self.recorder(name) for name in names})
+
+
+def _message(chat_type="supergroup"):
+    return {
+        "message_id": 7,
+        "chat": {"id": -100, "type": chat_type, "title": "Group"},
+        "from": {"id": 42, "username": "dana", "first_name": "Dana"},
+        "text": "hi",
+    }
+
+
+def test_behaves_like_a_read_only_mapping():
+    context = MessageContext(TOKEN, _message(), _Helpers().build())
+    assert context["chat_id"] == -100
+    assert context.get("chat_title") == "Group"
+    assert context.get("missing", "default") == "default"
+    assert "user_id" in context and "missing" not in context
+    assert context["is_group"] and not context["is_private"]
+    assert set(dict(context)) == set(context.keys())
+
+
+def test_admin_check_is_lazy_and_computed_once():
+    helpers = _Helpers()
+    context = MessageContext(TOKEN, _message(), helpers.build())
+    context["chat_id"]
+    context["username"]
+    assert helpers.calls == []
+
+    assert context["sender_is_admin"] is True
+    assert context["sender_is_admin"] is True
+    assert helpers.calls == [("is_user_admin", TOKEN, -100, 42)]
+
+
+def test_private_chat_skips_admin_check():
+    helpers = _Helpers()
+    context = MessageContext(TOKEN, _message("private"), helpers.build())
+    assert context["sender_is_admin"] is False
+    assert helpers.calls == []
+
+
+def test_helpers_are_bound_to_the_bot_and_chat():
+    helpers = _Helpers()
+    context = MessageContext(TOKEN, _message(), helpers.build())
+    context["delete_message"]()
+    context["delete_message"](9)
+    context["ban_user"](5)
+    context["mute_user"](5, 3600)
+    context["kick_user"](5)
+    context["unmute_user"](5)
+    context["reply"]({"text": "ok"})
+    context["is_admin"](5)
+    assert helpers.calls == [
+        ("delete_message", TOKEN, -100, 7),
+        ("delete_message", TOKEN, -100, 9),
+        ("ban_user", TOKEN, -100, 5, None),
+        ("mute_user", TOKEN, -100, 5, 3600),
+        ("kick_user", TOKEN, -100, 5),
+        ("unmute_user", TOKEN, -100, 5),
+        ("send_message", TOKEN, -100, {"text": "ok"}),
+        ("is_user_admin", TOKEN, -100, 5),
+    ]
+
+
+def test_engine_builds_context_with_engine_helpers(engine_app):
+    context = engine_app.build_message_context(TOKEN, _message("private"))
+    context["reply"]({"text": "ok"})
+    assert engine_app.sent_calls == [(TOKEN, "sendMessage", {"chat_id": -100, "text": "ok"})]
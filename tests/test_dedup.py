@@ -0,0 +1,59 @@
+from engine.dedup import MemorySeenSet, MongoSeenSet, UpdateDeduplicator
+
+
+class _BrokenBackend:
+    def add(self, key):
+        raise RuntimeError("backend down")
+
+    def size(self):
+        return None
+
+
+def test_second_delivery_is_duplicate():
+    dedup = UpdateDeduplicator(MemorySeenSet())
+    assert not dedup.is_duplicate("123:ABC", {"update_id": 1})
+    assert dedup.is_duplicate("123:ABC", {"update_id": 1})
+    assert not dedup.is_duplicate("123:ABC", {"update_id": 2})
+    assert dedup.stats()["duplicates"] == 1
+
+
+def test_same_update_id_on_other_bot_is_not_duplicate():
+    dedup = UpdateDeduplicator(MemorySeenSet())
+    assert not dedup.is_duplicate("123:ABC", {"update_id": 1})
+    assert not dedup.is_duplicate("456:DEF", {"update_id": 1})
+
+
+def test_forget_allows_redelivery():
+    dedup = UpdateDeduplicator(MemorySeenSet())
+    dedup.is_duplicate("123:ABC", {"update_id": 1})
+    dedup.forget("123:ABC", {"update_id": 1})
+    assert not dedup.is_duplicate("123:ABC", {"update_id": 1})
+
+
+def test_update_without_id_and_backend_errors_fail_open():
+    assert not UpdateDeduplicator(MemorySeenSet()).is_duplicate("123:ABC", {})
+    dedup = UpdateDeduplicator(_BrokenBackend())
+    assert not dedup.is_duplicate("123:ABC", {"update_id": 1})
+    assert dedup.stats()["errors"] == 1
+
+
+def test_memory_set_expires_and_is_bounded():
+    seen = MemorySeenSet(window_seconds=0)
+    assert seen.add("a")
+    assert seen.add("a")
+
+    seen = MemorySeenSet(max_size=2)
+    for key in ("a", "b", "c"):
+        seen.add(key)
+    assert seen.size() == 2
+    # "a" הכי ישן - נפלט
+    assert seen.add("a")
+
+
+def test_mongo_set_is_shared_between_instances(mongo_db):
+    first = MongoSeenSet(lambda: mongo_db)
+    second = MongoSeenSet(lambda: mongo_db)
+    assert first.add("123:1")
+    assert not second.add("123:1")
+    second.discard("123:1")
+    assert first.add("123:1")
@@ -0,0 +1,103 @@
+import threading
+import time
+
+from engine.dispatch import KeyedExecutor, UpdateQueue, update_chat_id
+
+
+def test_same_key_runs_in_submission_order():
+    executor = KeyedExecutor(workers=4)
+    seen = []
+
+    def task(value):
+        # השהיה קטנה נותנת ל-workers אחרים הזדמנות לעקוף אם הסדר לא נשמר
+        time.sleep(0.001)
+        seen.append(value)
+
+    for value in range(50):
+        assert executor.submit("chat-1", task, value)
+    assert executor.drain(5)
+    assert seen == list(range(50))
+
+
+def test_different_keys_run_in_parallel():
+    executor = KeyedExecutor(workers=2)
+    release = threading.Event()
+    started = threading.Barrier(3, timeout=2)
+
+    def blocking():
+        started.wait()
+        release.wait(2)
+
+    executor.submit("chat-1", blocking)
+    executor.submit("chat-2", blocking)
+    # שני המפתחות רצים יחד - אחרת ה-barrier לא היה משתחרר
+    started.wait()
+    release.set()
+    assert executor.drain(5)
+    assert executor.stats()["processed"] == 2
+
+
+def test_same_key_never_runs_concurrently():
+    executor = KeyedExecutor(workers=4)
+    lock = threading.Lock()
+    active = []
+    overlaps = []
+
+    def task():
+        with lock:
+            active.append(1)
+            if len(active) > 1:
+                overlaps.append(len(active))
+        time.sleep(0.001)
+        with lock:
+            active.pop()
+
+    for _ in range(30):
+        executor.submit("chat-1", task)
+    assert executor.drain(5)
+    assert overlaps == []
+
+
+def test_full_queue_drops_new_tasks():
+    executor = KeyedExecutor(workers=1, maxsize=1)
+    release = threading.Event()
+    executor.submit("chat-1", release.wait, 2)
+    # ה-worker אולי עוד לא שלף את הראשונה - ממלאים עד שמשימה נדחית
+    accepted = [executor.submit("chat-1", lambda: None) for _ in range(3)]
+    release.set()
+    assert executor.drain(5)
+    assert not all(accepted)
+    assert executor.stats()["dropped"] == accepted.count(False)
+
+
+def test_failed_task_does_not_stop_the_key():
+    executor = KeyedExecutor(workers=1)
+    seen = []
+    executor.submit("chat-1", lambda: 1 / 0)
+    executor.submit("chat-1", seen.append, "after")
+    assert executor.drain(5)
+    assert seen == ["after"]
+    assert executor.stats()["failed"] == 1
+
+
+def test_update_chat_id_for_each_update_kind():
+    assert update_chat_id({"message": {"chat": {"id": 5}}}) == 5
+    assert update_chat_id({"callback_query": {"message": {"chat": {"id": 6}}}}) == 6
+    assert update_chat_id({"chat_member": {"chat": {"id": -7}}}) == -7
+    assert update_chat_id({"poll": {}}) is None
+
+
+def test_update_queue_keeps_order_per_chat():
+    seen = {1: [], 2: []}
+
+    def handler(bot_token, update):
+        time.sleep(0.001)
+        seen[update["message"]["chat"]["id"]].append(update["update_id"])
+
+    queue = UpdateQueue(handler, workers=4)
+    for update_id in range(40):
+        chat_id = 1 + update_id % 2
+        queue.submit("123:ABC", {"update_id": update_id, "message": {"chat": {"id": chat_id}}})
+    assert queue.drain(5)
+    assert seen[1] == list(range(0, 40, 2))
+    assert seen[2] == list(range(1, 40, 2))
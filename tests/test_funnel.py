@@ -0,0 +1,134 @@
+import datetime
+
+from engine.funnel import (
+    BACKFILL_MIGRATION, ROLLUPS_COLLECTION, backfill_rollups, get_event_totals, get_funnel_totals,
+    record_event, record_flow_change,
+)
+from engine.hll import UniqueCounter
+from engine.migrations import MIGRATIONS_COLLECTION
+
+NOW = datetime.datetime(2026, 3, 10, 12, 0)
+YESTERDAY = NOW - datetime.timedelta(days=1)
+UNIQUE = UniqueCounter(precision=10, exact_limit=100)
+
+
+def _flow(user_id, stage, created_at=YESTERDAY, updated_at=None, final_status=None):
+    return {
+        "user_id": user_id, "current_stage": stage, "final_status": final_status,
+        "created_at": created_at, "updated_at": updated_at or created_at,
+    }
+
+
+def _totals(db, window, days=7):
+    return get_funnel_totals(db, window, days, UNIQUE, now=NOW)
+
+
+def test_new_flow_is_counted_in_both_windows(mongo_db):
+    record_flow_change(mongo_db, None, _flow("u1", 1), UNIQUE)
+    for window in ("start", "activity"):
+        totals = _totals(mongo_db, window)
+        assert totals["total_flows"] == 1 and totals["reached_stage_1"] == 1
+        assert totals["reached_stage_2"] == 0
+        assert (totals["unique_users"], totals["unique_users_exact"]) == (1, True)
+
+
+def test_stage_change_moves_counters_without_recounting_the_flow(mongo_db):
+    before = _flow("u1", 1)
+    record_flow_change(mongo_db, None, before, UNIQUE)
+    after = dict(before, current_stage=4)
+    record_flow_change(mongo_db, before, after, UNIQUE)
+
+    totals = _totals(mongo_db, "start")
+    assert totals["total_flows"] == 1
+    assert [totals[f"reached_stage_{stage}"] for stage in range(1, 6)] == [1, 1, 1, 1, 0]
+
+
+def test_flow_updated_on_a_later_day_moves_between_activity_days(mongo_db):
+    before = _flow("u1", 2)
+    record_flow_change(mongo_db, None, before, UNIQUE)
+    after = dict(before, current_stage=5, final_status="activated", updated_at=NOW)
+    record_flow_change(mongo_db, before, after, UNIQUE)
+
+    assert _totals(mongo_db, "activity", days=1)["reached_stage_5"] == 1
+    week = _totals(mongo_db, "activity")
+    assert week["total_flows"] == 1 and week["reached_stage_2"] == 1
+    # המשתמש לא יורד מהיום שה-flow יצא ממנו - הספירה מסומנת כקירוב
+    assert week["unique_users_exact"] is False
+    # ה-flow נשאר ב-cohort של יום ההתחלה
+    assert _totals(mongo_db, "start", days=1)["total_flows"] == 0
+    assert _totals(mongo_db, "start")["total_flows"] == 1
+
+
+def test_totals_only_cover_the_window(mongo_db):
+    old = NOW - datetime.timedelta(days=30)
+    record_flow_change(mongo_db, None, _flow("u1", 1, created_at=old), UNIQUE)
+    record_flow_change(mongo_db, None, _flow("u2", 3, final_status="cancelled"), UNIQUE)
+    totals = _totals(mongo_db, "start")
+    assert totals["total_flows"] == 1 and totals["cancelled"] == 1
+    assert _totals(mongo_db, "start", days=31)["total_flows"] == 2
+
+
+def test_event_counters(mongo_db):
+    record_event(mongo_db, "flow_started", NOW)
+    record_event(mongo_db, "flow_started", YESTERDAY)
+    record_event(mongo_db, "creation_failed", NOW)
+    assert get_event_totals(mongo_db, 7, now=NOW) == {"flow_started": 2, "creation_failed": 1}
+    assert get_event_totals(mongo_db, 1, now=NOW) == {"flow_started": 1, "creation_failed": 1}
+
+
+def _seed_history(db):
+    db.bot_flows.insert_many([
+        _flow("u1", 5, final_status="activated"),
+        _flow("u2", 2, updated_at=NOW),
+        _flow("u2", 1, final_status="cancelled"),
+    ])
+    db.funnel_events.insert_many([
+        {"event_type": "flow_started", "timestamp": YESTERDAY},
+        {"event_type": "flow_started", "timestamp": NOW},
+    ])
+
+
+def test_backfill_builds_rollups_from_existing_flows(mongo_db):
+    _seed_history(mongo_db)
+    result = backfill_rollups(mongo_db, UNIQUE)
+    assert result["flows"] == 3
+
+    totals = _totals(mongo_db, "start")
+    assert totals["total_flows"] == 3 and totals["reached_stage_5"] == 1
+    assert totals["cancelled"] == 1
+    assert (totals["unique_users"], totals["unique_users_exact"]) == (2, True)
+    assert _totals(mongo_db, "activity", days=1)["total_flows"] == 1
+    assert get_event_totals(mongo_db, 7, now=NOW) == {"flow_started": 2}
+    assert mongo_db[MIGRATIONS_COLLECTION].find_one({"_id": BACKFILL_MIGRATION})["status"] == "done"
+
+
+def test_backfill_rebuilds_days_with_partial_live_documents(mongo_db):
+    _seed_history(mongo_db)
+    # מסמכים חלקיים מעדכונים חיים שנכתבו לפני הבניה: יום ההתחלה בלי total_flows,
+    # ויום פעילות ישן עם מונים שליליים
+    collection = mongo_db[ROLLUPS_COLLECTION]
+    collection.insert_many([
+        {"_id": f"start:{YESTERDAY:%Y-%m-%d}", "window": "start", "reached_stage_4": 1},
+        {"_id": "activity:2026-03-01", "window": "activity", "total_flows": -1},
+    ])
+
+    backfill_rollups(mongo_db, UNIQUE)
+    totals = _totals(mongo_db, "start")
+    assert totals["total_flows"] == 3 and totals["reached_stage_4"] == 1
+    assert collection.find_one({"_id": "activity:2026-03-01"}) is None
+
+
+def test_backfill_runs_once_and_keeps_later_live_updates(mongo_db):
+    _seed_history(mongo_db)
+    backfill_rollups(mongo_db, UNIQUE)
+    record_flow_change(mongo_db, None, _flow("u3", 1), UNIQUE)
+    assert backfill_rollups(mongo_db, UNIQUE) is None
+    assert _totals(mongo_db, "start")["total_flows"] == 4
+
+
+def test_backfill_on_empty_database_only_writes_the_marker(mongo_db):
+    assert backfill_rollups(mongo_db, UNIQUE)["documents"] == 0
+    assert mongo_db[ROLLUPS_COLLECTION].count_documents({}) == 0
+    record_flow_change(mongo_db, None, _flow("u1", 1), UNIQUE)
+    assert backfill_rollups(mongo_db, UNIQUE) is None
+    assert _totals(mongo_db, "start")["total_flows"] == 1
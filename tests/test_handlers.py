@@ -0,0 +1,64 @@
+import types
+
+from engine.handlers import PluginEntry, build_adapter
+
+
+def _module(**handlers):
+    module = types.ModuleType("plugins.fake")
+    for name, handler in handlers.items():
+        setattr(module, name, handler)
+    return module
+
+
+def test_legacy_signatures_receive_only_their_arguments():
+    module = _module(handle_message=lambda text: f"one:{text}")
+    assert build_adapter(module, "handle_message", 3)("hi", 1, {}) == "one:hi"
+
+    module = _module(handle_message=lambda text, user_id: f"two:{text}:{user_id}")
+    assert build_adapter(module, "handle_message", 3)("hi", 1, {}) == "two:hi:1"
+
+
+def test_full_signature_is_called_directly():
+    def handle_message(text, user_id=None, context=None):
+        return text
+
+    module = _module(handle_message=handle_message)
+    assert build_adapter(module, "handle_message", 3) is handle_message
+
+
+def test_varargs_handler_receives_everything():
+    module = _module(handle_message=lambda *args: args)
+    assert build_adapter(module, "handle_message", 3)("hi", 1, {}) == ("hi", 1, {})
+
+
+def test_type_error_inside_plugin_is_not_swallowed():
+    def handle_message(text, user_id=None, context=None):
+        raise TypeError("bug in plugin")
+
+    adapter = build_adapter(_module(handle_message=handle_message), "handle_message", 3)
+    try:
+        adapter("hi", 1, {})
+    except TypeError as e:
+        assert str(e) == "bug in plugin"
+    else:
+        raise AssertionError("TypeError was swallowed")
+
+
+def test_missing_or_unsupported_handler_is_skipped():
+    assert build_adapter(_module(), "handle_message", 3) is None
+    assert build_adapter(_module(handle_message="not callable"), "handle_message", 3) is None
+
+    def keyword_only(*, text):
+        return text
+
+    assert build_adapter(_module(handle_message=keyword_only), "handle_message", 3) is None
+
+
+def test_plugin_entry_builds_both_adapters():
+    module = _module(
+        handle_message=lambda text: text,
+        handle_callback=lambda data, user_id: (data, user_id),
+    )
+    entry = PluginEntry("fake", module)
+    assert entry.on_message("hi", 1, {}) == "hi"
+    assert entry.on_callback("cb", 1) == ("cb", 1)
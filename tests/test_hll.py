@@ -0,0 +1,82 @@
+import pytest
+
+from engine.hll import UniqueCounter, estimate, fold, precision_for_error, register_for
+
+
+def _registers(values, precision):
+    registers = {}
+    for value in values:
+        index, rank = register_for(value, precision)
+        registers[str(index)] = max(rank, registers.get(str(index), 0))
+    return registers
+
+
+@pytest.mark.parametrize("count", [10, 1000, 50000])
+def test_estimate_is_within_expected_error(count):
+    precision = 12
+    result = estimate(_registers(range(count), precision), precision)
+    # סטיית התקן ב-precision 12 היא כ-1.6%; 4 סטיות תקן
+    assert abs(result - count) <= max(1, count * 0.065)
+
+
+def test_estimate_of_empty_sketch_is_zero():
+    assert estimate({}, 12) == 0
+
+
+def test_merge_of_overlapping_days_counts_each_user_once():
+    counter = UniqueCounter(precision=12, exact_limit=0)
+    monday = counter.build_document(range(0, 6000))
+    tuesday = counter.build_document(range(3000, 9000))
+    count, exact = counter.count([monday, tuesday])
+    assert not exact
+    assert abs(count - 9000) <= 9000 * 0.065
+
+
+def test_fold_matches_sketch_built_at_lower_precision():
+    values = range(20000)
+    folded = fold(_registers(values, 14), 14, 10)
+    assert folded == _registers(values, 10)
+
+
+def test_sketches_with_different_precision_merge():
+    fine = UniqueCounter(precision=14, exact_limit=0)
+    coarse = UniqueCounter(precision=10, exact_limit=0)
+    docs = [fine.build_document(range(5000)), coarse.build_document(range(5000, 10000))]
+    count, _ = coarse.count(docs)
+    # precision 10: סטיית תקן כ-3.3%
+    assert abs(count - 10000) <= 10000 * 0.13
+
+
+def test_small_windows_are_exact():
+    counter = UniqueCounter(exact_limit=100)
+    docs = [counter.build_document(["a", "b"]), counter.build_document(["b", "c"])]
+    assert counter.count(docs) == (3, True)
+
+
+def test_day_over_exact_limit_falls_back_to_sketch():
+    counter = UniqueCounter(exact_limit=10)
+    count, exact = counter.count([counter.build_document([str(i) for i in range(50)])])
+    assert not exact
+    assert abs(count - 50) <= 5
+
+
+def test_documents_without_exact_list_are_approximate():
+    counter = UniqueCounter(exact_limit=100)
+    legacy = UniqueCounter(exact_limit=0).build_document(["a", "b"])
+    assert "users" not in legacy
+    count, exact = counter.count([counter.build_document(["a"]), legacy])
+    assert not exact
+    assert count == 2
+
+
+def test_inexact_day_is_reported_approximate():
+    counter = UniqueCounter(exact_limit=100)
+    doc = counter.build_document(["a", "b"])
+    doc[counter.inexact_field] = True
+    assert counter.count([doc]) == (2, False)
+
+
+def test_precision_for_error():
+    assert precision_for_error(0.02) == 12
+    assert precision_for_error(0) == 16
+    assert precision_for_error(1) == 4
@@ -0,0 +1,78 @@
+import pytest
+
+BOT = "123:ABC"
+UPDATE = {"update_id": 1, "message": {"chat": {"id": 5}, "from": {"id": 5}, "text": "hi"}}
+
+
+@pytest.fixture
+def inline(engine_app, monkeypatch):
+    monkeypatch.setattr(engine_app.Config, "WEBHOOK_INLINE_REPLY", True)
+    return engine_app
+
+
+def _run(app_module, monkeypatch, handler):
+    monkeypatch.setattr(app_module, "process_update", lambda bot_token, update: handler())
+    response = app_module.app.test_client().post(f"/{BOT}", json=UPDATE)
+    return response.get_json(), [(method, payload) for _, method, payload in app_module.sent_calls]
+
+
+def test_first_reply_is_returned_in_webhook_response(inline, monkeypatch):
+    body, sent = _run(inline, monkeypatch,
+                      lambda: inline.send_telegram_message(BOT, 5, "hello"))
+    assert body == {"method": "sendMessage", "chat_id": 5, "text": "hello"}
+    assert sent == []
+
+
+def test_reply_with_parse_mode_is_sent_normally(inline, monkeypatch):
+    reply = {"text": "*bold*", "parse_mode": "Markdown"}
+    body, sent = _run(inline, monkeypatch, lambda: inline.send_telegram_message(BOT, 5, reply))
+    assert body == {"ok": True}
+    assert sent == [("sendMessage", {"chat_id": 5, "text": "*bold*", "parse_mode": "Markdown"})]
+
+
+def test_second_message_flushes_the_first_in_order(inline, monkeypatch):
+    def handler():
+        inline.send_telegram_message(BOT, 5, "one")
+        inline.send_telegram_message(BOT, 5, "two")
+
+    body, sent = _run(inline, monkeypatch, handler)
+    assert body == {"ok": True}
+    assert [payload["text"] for _, payload in sent] == ["one", "two"]
+
+
+def test_direct_action_sends_buffered_reply_first(inline, monkeypatch):
+    def handler():
+        inline.send_telegram_message(BOT, 5, "bye")
+        assert inline.delete_message(BOT, 5, 77)
+
+    body, sent = _run(inline, monkeypatch, handler)
+    assert body == {"ok": True}
+    assert [method for method, _ in sent] == ["sendMessage", "deleteMessage"]
+
+
+def test_callback_answer_stays_inline_next_to_messages(inline, monkeypatch):
+    def handler():
+        inline.answer_callback_query(BOT, "cb-1", "done")
+        inline.send_telegram_message(BOT, 5, "result")
+
+    body, sent = _run(inline, monkeypatch, handler)
+    assert body == {"method": "answerCallbackQuery", "callback_query_id": "cb-1", "text": "done"}
+    assert sent == [("sendMessage", {"chat_id": 5, "text": "result"})]
+
+
+def test_buffered_reply_is_sent_when_handler_raises(inline, monkeypatch):
+    monkeypatch.setitem(inline.app.config, "PROPAGATE_EXCEPTIONS", False)
+
+    def handler():
+        inline.send_telegram_message(BOT, 5, "partial")
+        raise RuntimeError("plugin crashed")
+
+    _, sent = _run(inline, monkeypatch, handler)
+    assert sent == [("sendMessage", {"chat_id": 5, "text": "partial"})]
+
+
+def test_other_bot_calls_are_not_captured(inline, monkeypatch):
+    body, sent = _run(inline, monkeypatch,
+                      lambda: inline.send_telegram_message("456:DEF", 9, "elsewhere"))
+    assert body == {"ok": True}
+    assert sent == [("sendMessage", {"chat_id": 9, "text": "elsewhere"})]
@@ -0,0 +1,78 @@
+import datetime
+import types
+
+import pytest
+
+from engine import migrations
+from engine.maintenance import refresh_webhooks
+from engine.migrations import MIGRATIONS_COLLECTION, run_once
+
+
+def test_runs_once_and_records_the_marker(mongo_db):
+    calls = []
+    assert run_once(mongo_db, "task", lambda: calls.append(1) or "result") == "result"
+    assert run_once(mongo_db, "task", lambda: calls.append(1)) is None
+    assert calls == [1]
+    assert mongo_db[MIGRATIONS_COLLECTION].find_one({"_id": "task"})["status"] == "done"
+
+
+def test_marker_is_shared_between_processes(mongo_db):
+    run_once(mongo_db, "task", lambda: None)
+    migrations._completed.clear()
+    assert run_once(mongo_db, "task", lambda: pytest.fail("ran twice")) is None
+
+
+def test_task_held_by_another_worker_is_skipped_or_awaited(mongo_db):
+    collection = mongo_db[MIGRATIONS_COLLECTION]
+    lease_until = datetime.datetime.utcnow() + datetime.timedelta(minutes=10)
+    collection.insert_one({"_id": "task", "status": "running", "owner": "other", "lease_until": lease_until})
+    assert run_once(mongo_db, "task", lambda: pytest.fail("ran while held"), wait=False) is None
+
+    # ה-worker האחר נפל - אחרי שה-lease פג הפעולה נתפסת מחדש
+    collection.update_one({"_id": "task"}, {"$set": {"lease_until": datetime.datetime.utcnow()}})
+    assert run_once(mongo_db, "task", lambda: "took over", poll_interval=0.01) == "took over"
+
+
+def test_failed_task_runs_again(mongo_db):
+    def fail():
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        run_once(mongo_db, "task", fail)
+    assert mongo_db[MIGRATIONS_COLLECTION].find_one({"_id": "task"})["status"] == "failed"
+    assert run_once(mongo_db, "task", lambda: "retried") == "retried"
+
+
+class _Client:
+    def __init__(self, failing=()):
+        self.calls = []
+        self.failing = failing
+
+    def post(self, token, method, payload):
+        self.calls.append((token, method, payload))
+        if token in self.failing:
+            return types.SimpleNamespace(ok=False, status_code=401, text="Unauthorized")
+        return types.SimpleNamespace(ok=True, status_code=200, text="")
+
+
+def test_refresh_webhooks_sends_allowed_updates_for_every_registered_bot(mongo_db):
+    mongo_db.bot_registry.insert_many([
+        {"token": "1:A", "plugin_filename": "bot_1.py"},
+        {"token": "2:B", "plugin_filename": "bot_2.py"},
+    ])
+    client = _Client(failing={"2:B"})
+    result = refresh_webhooks(mongo_db, client, "https://example.com/", ["message", "chat_member"])
+    assert result == {"bots": 2, "updated": 1, "failed": 1}
+    assert client.calls[0] == ("1:A", "setWebhook", {
+        "url": "https://example.com/1:A", "allowed_updates": ["message", "chat_member"],
+    })
+
+
+def test_startup_refresh_runs_once(engine_app, mongo_db, monkeypatch):
+    monkeypatch.setenv("RENDER_EXTERNAL_URL", "https://example.com")
+    monkeypatch.setattr(engine_app, "get_mongo_db", lambda: mongo_db)
+    mongo_db.bot_registry.insert_one({"token": "1:A", "plugin_filename": "bot_1.py"})
+
+    assert engine_app.refresh_registered_webhooks()["updated"] == 1
+    assert engine_app.refresh_registered_webhooks() is None
+    assert [call[1] for call in engine_app.sent_calls] == ["setWebhook"]
@@ -0,0 +1,194 @@
+import threading
+import time
+from types import SimpleNamespace
+
+from engine.rate_limit import OutboundScheduler, TokenBucket
+
+BOT = "123:ABC"
+
+
+def _response(status_code, retry_after=None):
+    body = {"ok": status_code == 200}
+    if retry_after is not None:
+        body["parameters"] = {"retry_after": retry_after}
+    return SimpleNamespace(status_code=status_code, ok=status_code == 200, text="",
+                           json=lambda: body)
+
+
+class _FakeTelegram:
+    """send_fn שמחזיר 429 פעם אחת לכל צ'אט ב-limited_chats, ורושם כל קריאה."""
+
+    def __init__(self, limited_chats=()):
+        self.limited = set(limited_chats)
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def __call__(self, bot_token, method, payload):
+        with self.lock:
+            chat_id = payload.get("chat_id")
+            self.calls.append((chat_id, payload.get("n"), time.monotonic()))
+            if chat_id in self.limited:
+                self.limited.discard(chat_id)
+                return _response(429, retry_after=1)
+        return _response(200)
+
+    def sent_to(self, chat_id):
+        with self.lock:
+            return [n for chat, n, _ in self.calls if chat == chat_id]
+
+
+def _scheduler(send_fn, **kwargs):
+    return OutboundScheduler(send_fn, bot_rate=1000, bot_burst=1000, chat_rate=1000,
+                             chat_burst=1000, **kwargs)
+
+
+def _wait_for(condition, timeout=3.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_bucket_refills_at_rate():
+    bucket = TokenBucket(rate=2, capacity=1)
+    now = bucket.updated
+    assert bucket.delay(now) == 0
+    bucket.take(now)
+    assert bucket.delay(now) == 0.5
+    assert bucket.delay(now + 0.5) == 0
+
+
+def test_block_holds_bucket_until_retry_after():
+    bucket = TokenBucket(rate=10, capacity=10)
+    now = bucket.updated
+    bucket.block(now + 3)
+    # חסימה קצרה יותר לא מקצרת את הקיימת
+    bucket.block(now + 1)
+    assert bucket.delay(now) == 3
+    assert bucket.delay(now + 3) == 0
+    assert not bucket.is_idle(now + 1)
+
+
+def test_429_blocks_only_that_chat():
+    telegram = _FakeTelegram(limited_chats={1})
+    scheduler = _scheduler(telegram)
+    scheduler.submit(BOT, 1, "sendMessage", {"chat_id": 1, "n": 1})
+    assert _wait_for(lambda: scheduler.stats()["tenants"]["123"]["rate_limited"] == 1)
+
+    scheduler.submit(BOT, 1, "sendMessage", {"chat_id": 1, "n": 2})
+    submitted_at = time.monotonic()
+    scheduler.submit(BOT, 2, "sendMessage", {"chat_id": 2, "n": 1})
+    assert _wait_for(lambda: telegram.sent_to(2) == [1], timeout=0.5)
+    assert time.monotonic() - submitted_at < 0.5
+    # הצ'אט החסום עוד מחכה ל-retry_after
+    assert telegram.sent_to(1) == [1]
+
+    assert scheduler.drain(5)
+    # ההודעה שקיבלה 429 נשלחת שוב לפני ההודעה שאחריה
+    assert telegram.sent_to(1) == [1, 1, 2]
+    stats = scheduler.stats()["tenants"]["123"]
+    assert stats["bot_blocks"] == 0
+    assert stats["sent"] == 3
+
+
+def test_429_on_several_chats_blocks_the_bot():
+    telegram = _FakeTelegram(limited_chats={1, 2})
+    scheduler = _scheduler(telegram, bot_wide_chats=2)
+    scheduler.submit(BOT, 1, "sendMessage", {"chat_id": 1})
+    scheduler.submit(BOT, 2, "sendMessage", {"chat_id": 2})
+    assert _wait_for(lambda: scheduler.stats()["tenants"]["123"]["rate_limited"] == 2)
+    assert scheduler.stats()["tenants"]["123"]["bot_blocks"] == 1
+
+    scheduler.submit(BOT, 3, "sendMessage", {"chat_id": 3})
+    time.sleep(0.3)
+    assert telegram.sent_to(3) == []
+    assert scheduler.drain(5)
+    assert telegram.sent_to(3) == [None]
+
+
+def test_inline_send_does_not_overtake_queued_messages():
+    release = threading.Event()
+
+    def slow_send(bot_token, method, payload):
+        release.wait(2)
+        return _response(200)
+
+    scheduler = _scheduler(slow_send, workers=1)
+    scheduler.submit(BOT, 1, "sendMessage", {"chat_id": 1})
+    assert not scheduler.try_acquire(BOT, 1)
+    assert scheduler.try_acquire(BOT, 2)
+    release.set()
+    assert scheduler.drain(5)
+
+
+def test_call_waits_for_response_behind_queued_messages():
+    telegram = _FakeTelegram()
+    scheduler = _scheduler(telegram)
+    scheduler.submit(BOT, 1, "sendMessage", {"chat_id": 1, "n": 1})
+    response = scheduler.call(BOT, 1, "deleteMessage", {"chat_id": 1, "n": 2})
+    assert response.status_code == 200
+    assert telegram.sent_to(1) == [1, 2]
+
+
+def test_call_retries_after_429():
+    telegram = _FakeTelegram(limited_chats={1})
+    scheduler = _scheduler(telegram)
+    started = time.monotonic()
+    response = scheduler.call(BOT, 1, "banChatMember", {"chat_id": 1})
+    assert response.status_code == 200
+    assert time.monotonic() - started >= 1
+    assert scheduler.stats()["tenants"]["123"]["rate_limited"] == 1
+
+
+def test_call_that_times_out_in_queue_is_cancelled():
+    telegram = _FakeTelegram(limited_chats={1})
+    scheduler = _scheduler(telegram)
+    scheduler.submit(BOT, 1, "sendMessage", {"chat_id": 1, "n": 1})
+    assert _wait_for(lambda: scheduler.stats()["tenants"]["123"]["rate_limited"] == 1)
+    assert scheduler.call(BOT, 1, "deleteMessage", {"chat_id": 1, "n": 2}, timeout=0.1) is None
+    assert scheduler.drain(5)
+    assert telegram.sent_to(1) == [1, 1]
+
+
+def test_call_raises_network_errors():
+    def broken(bot_token, method, payload):
+        raise ConnectionError("down")
+
+    scheduler = _scheduler(broken)
+    try:
+        scheduler.call(BOT, 1, "deleteMessage", {"chat_id": 1})
+    except ConnectionError:
+        pass
+    else:
+        raise AssertionError("expected ConnectionError")
+
+
+def test_calls_without_chat_use_only_the_bot_bucket():
+    telegram = _FakeTelegram()
+    # קצב צ'אט איטי - קריאות בלי צ'אט לא אמורות להיות מוגבלות בו
+    scheduler = OutboundScheduler(telegram, bot_rate=1000, bot_burst=1000, chat_rate=1,
+                                  chat_burst=1)
+    for n in range(5):
+        scheduler.submit(BOT, None, "answerCallbackQuery", {"chat_id": None, "n": n})
+    started = time.monotonic()
+    assert scheduler.drain(2)
+    assert time.monotonic() - started < 0.5
+    assert telegram.sent_to(None) == [0, 1, 2, 3, 4]
+
+
+def test_engine_actions_go_through_the_scheduler(engine_app, monkeypatch):
+    telegram = _FakeTelegram()
+    scheduler = _scheduler(telegram)
+    monkeypatch.setattr(engine_app, "outbound_scheduler", scheduler)
+
+    engine_app.send_telegram_message(BOT, 1, "hello")
+    assert engine_app.delete_message(BOT, 1, 5)
+    assert engine_app.ban_user(BOT, 1, 9)
+    engine_app.answer_callback_query(BOT, "cb-1")
+    assert scheduler.drain(5)
+
+    assert engine_app.sent_calls == []
+    assert sorted(chat or 0 for chat, _, _ in telegram.calls) == [0, 1, 1, 1]
+    assert scheduler.stats()["tenants"]["123"]["sent"] == 4
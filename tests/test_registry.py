@@ -0,0 +1,64 @@
+import datetime
+
+from engine.registry import BotRegistryCache
+
+
+def _register(db, token, plugin, minutes=0):
+    db.bot_registry.insert_one({
+        "token": token, "plugin_filename": plugin,
+        "created_at": datetime.datetime(2026, 1, 1) + datetime.timedelta(minutes=minutes),
+    })
+
+
+def test_lookups_are_served_from_memory(mongo_db):
+    _register(mongo_db, "1:A", "bot_a.py")
+    cache = BotRegistryCache(lambda: mongo_db, refresh_interval=3600)
+    assert cache.get("1:A") == "bot_a.py"
+    reads = cache.stats()["db_reads"]
+    for _ in range(10):
+        assert cache.get("1:A") == "bot_a.py"
+    assert cache.stats()["db_reads"] == reads
+
+
+def test_bot_registered_by_another_worker_is_found_on_miss(mongo_db):
+    cache = BotRegistryCache(lambda: mongo_db, refresh_interval=3600)
+    assert cache.get("1:A") is None
+    _register(mongo_db, "2:B", "bot_b.py")
+    assert cache.get("2:B") == "bot_b.py"
+
+
+def test_unknown_token_is_cached_negatively(mongo_db):
+    cache = BotRegistryCache(lambda: mongo_db, refresh_interval=3600, negative_ttl=60)
+    cache.get("x")
+    assert cache.get("9:Z") is None
+    reads = cache.stats()["db_reads"]
+    assert cache.get("9:Z") is None
+    assert cache.stats()["db_reads"] == reads
+
+    # fresh=True (בדיקת קיום לפני יצירה) לא סומך על המטמון השלילי
+    _register(mongo_db, "9:Z", "bot_z.py")
+    assert cache.get("9:Z", fresh=True) == "bot_z.py"
+
+
+def test_incremental_refresh_picks_up_new_registrations(mongo_db):
+    _register(mongo_db, "1:A", "bot_a.py")
+    cache = BotRegistryCache(lambda: mongo_db, refresh_interval=0, full_reload_interval=3600)
+    assert cache.get("1:A") == "bot_a.py"
+    _register(mongo_db, "2:B", "bot_b.py", minutes=5)
+    cache.get("1:A")
+    assert cache.stats()["bots"] == 2
+
+
+def test_put_and_remove_update_the_map_immediately(mongo_db):
+    cache = BotRegistryCache(lambda: mongo_db, refresh_interval=3600)
+    cache.get("x")
+    cache.put("1:A", "bot_a.py")
+    cache.put("2:A", "bot_a.py")
+    assert cache.get("1:A") == "bot_a.py"
+    cache.remove_plugin("bot_a.py")
+    assert cache.stats()["bots"] == 0
+
+
+def test_without_database_every_lookup_misses():
+    cache = BotRegistryCache(lambda: None)
+    assert cache.get("1:A") is None
@@ -0,0 +1,58 @@
+from types import SimpleNamespace
+
+from engine.handlers import PluginEntry
+from engine.routing import PrefixTrie, RoutingIndex
+
+
+def _plugin(name, **routes):
+    module = SimpleNamespace(
+        __name__=name,
+        handle_message=lambda text, chat_id, user_id: None,
+        handle_callback=lambda data, chat_id: None,
+        **routes,
+    )
+    return PluginEntry(name, module)
+
+
+def test_trie_returns_longest_prefix_first():
+    trie = PrefixTrie()
+    trie.insert("order:", "short")
+    trie.insert("order:pay:", "long")
+    trie.insert("other", "unrelated")
+    assert trie.match("order:pay:42") == ["long", "short"]
+    assert trie.match("order:7") == ["short"]
+    assert trie.match("ord") == []
+
+
+def test_command_owner_comes_before_catch_all():
+    owner = _plugin("owner", COMMANDS=["/start"])
+    chat = _plugin("chat")
+    index = RoutingIndex([chat, owner])
+    assert index.message_candidates("/start") == [owner, chat]
+    assert index.message_candidates("/start@MyBot now") == [owner, chat]
+    # פקודה שלא הוצהרה - רק השרשרת הכללית
+    assert index.message_candidates("/help") == [chat]
+
+
+def test_command_prefix_matches_start_of_text():
+    creator = _plugin("creator", COMMAND_PREFIXES=["/create_bot "])
+    index = RoutingIndex([creator])
+    assert index.message_candidates("  /create_bot a weather bot") == [creator]
+    assert index.message_candidates("/create_bot") == []
+
+
+def test_callback_prefixes_and_exact_data():
+    orders = _plugin("orders", CALLBACK_PREFIXES=["order:"])
+    cancel = _plugin("cancel", CALLBACK_DATA=["cancel"])
+    generic = _plugin("generic")
+    index = RoutingIndex([orders, cancel, generic])
+    assert index.callback_candidates("order:12") == [orders, generic]
+    assert index.callback_candidates("cancel") == [cancel, generic]
+    assert index.callback_candidates("other") == [generic]
+
+
+def test_catch_all_owner_is_not_listed_twice():
+    plugin = _plugin("both", COMMANDS=["/start"], CATCH_ALL=True)
+    index = RoutingIndex([plugin])
+    assert index.message_candidates("/start") == [plugin]
+    assert index.message_candidates("hello") == [plugin]
@@ -0,0 +1,239 @@
+import datetime
+import types
+
+import gridfs
+import pytest
+
+from engine.maintenance import (
+    DuplicateStateKeysError,
+    dedupe_bot_states,
+    ensure_state_indexes,
+    gc_state_blobs,
+)
+from engine.state import StateStore, bind_legacy_state_helpers
+
+BOT = "123"
+
+
+@pytest.fixture(params=[True, False], ids=["unique-index", "no-index"])
+def indexed(request):
+    return request.param
+
+
+def _store(db, indexed=True, **kwargs):
+    if indexed:
+        ensure_state_indexes(db)
+    store = StateStore(lambda: db, **kwargs)
+    store.mark_unique_index(indexed)
+    return store
+
+
+def _blob_count(db):
+    return db.bot_state_blobs.files.count_documents({})
+
+
+def test_legacy_plugin_helpers_use_the_shared_store(mongo_db):
+    store = _store(mongo_db)
+    module = types.ModuleType("plugins.bot_123")
+    module.BOT_ID = BOT
+    module._state_mongo_client = None
+    module._get_state_db = lambda: None
+
+    assert bind_legacy_state_helpers(module, store)
+    assert module.save_state(1, "step", "start")
+    assert module.load_state(1, "step") == "start"
+    assert store.load(BOT, 1, "step") == "start"
+    assert module._get_state_db() is mongo_db
+
+
+def test_plugin_without_legacy_helpers_is_left_alone(mongo_db):
+    module = types.ModuleType("plugins.architect")
+    assert not bind_legacy_state_helpers(module, _store(mongo_db))
+    assert not hasattr(module, "save_state")
+
+
+def test_batch_reads_once_and_writes_on_exit(mongo_db):
+    store = _store(mongo_db)
+    store.save_many(BOT, 1, {"a": 1, "b": 2})
+    reads, writes = store.stats()["db_reads"], store.stats()["db_writes"]
+
+    with store.batch():
+        assert store.load(BOT, 1, "a") == 1
+        assert store.load(BOT, 1, "b") == 2
+        assert store.save(BOT, 1, "a", 10)
+        assert store.save(BOT, 1, "c", [1, 2])
+        # נרשם לכתיבה אבל עוד לא נכתב
+        assert mongo_db.bot_states.count_documents({"key": "c"}) == 0
+        assert store.load(BOT, 1, "a") == 10
+
+    assert store.stats()["db_reads"] == reads + 1
+    assert store.stats()["db_writes"] == writes + 1
+    assert store.load_many(BOT, 1, ["a", "b", "c"]) == {"a": 10, "b": 2, "c": [1, 2]}
+
+
+def test_batch_cache_does_not_outlive_the_batch(mongo_db):
+    first = _store(mongo_db)
+    second = _store(mongo_db)
+    with first.batch():
+        assert first.load(BOT, 1, "step") is None
+    second.save(BOT, 1, "step", "awaiting_name")
+    with first.batch():
+        assert first.load(BOT, 1, "step") == "awaiting_name"
+
+
+def test_loaded_values_are_copies(mongo_db):
+    store = _store(mongo_db)
+    store.save(BOT, 1, "items", [1])
+    with store.batch():
+        store.load(BOT, 1, "items").append(2)
+        assert store.load(BOT, 1, "items") == [1]
+
+
+def test_invalid_value_is_rejected_in_save(mongo_db):
+    store = _store(mongo_db, offload_bytes=0)
+    with store.batch():
+        assert not store.save(BOT, 1, "bad", object())
+        assert store.save(BOT, 1, "good", "ok")
+        assert not store.save_many(BOT, 1, {"x": 1, "y": {1, 2}})
+    assert store.load(BOT, 1, "good") == "ok"
+    assert store.load_many(BOT, 1, ["bad", "x", "y"]) == {"bad": None, "x": None, "y": None}
+    assert store.stats()["rejected_values"] == 2
+
+
+def test_load_many_reads_once_and_applies_defaults(mongo_db):
+    store = _store(mongo_db)
+    assert store.save_many(BOT, 1, {"name": "Dana", "age": 30})
+    reads = store.stats()["db_reads"]
+    values = store.load_many(BOT, 1, ["name", "age", "city"], defaults={"city": "TLV"})
+    assert values == {"name": "Dana", "age": 30, "city": "TLV"}
+    assert store.stats()["db_reads"] == reads + 1
+
+
+def test_save_many_writes_all_keys_in_one_round_trip(mongo_db):
+    store = _store(mongo_db)
+    writes = store.stats()["db_writes"]
+    assert store.save_many(BOT, 1, {"a": 1, "b": 2, "c": 3})
+    assert store.stats()["db_writes"] == writes + 1
+    assert mongo_db.bot_states.count_documents({"bot_id": BOT}) == 3
+
+
+def test_atomic_counter_and_list_ops(mongo_db, indexed):
+    store = _store(mongo_db, indexed)
+    assert store.incr(BOT, 1, "visits") == 1
+    assert store.incr(BOT, 1, "visits", 5) == 6
+    assert store.push(BOT, 1, "tags", "a")
+    assert store.push(BOT, 1, "tags", "b")
+    assert store.pull(BOT, 1, "tags", "a")
+    assert store.load_many(BOT, 1, ["visits", "tags"]) == {"visits": 6, "tags": ["b"]}
+    assert "blob_id" not in mongo_db.bot_states.find_one({"key": "visits"})
+
+
+def test_atomic_op_inside_batch_sees_staged_value(mongo_db):
+    store = _store(mongo_db)
+    store.save(BOT, 1, "visits", 1)
+    with store.batch():
+        assert store.load(BOT, 1, "visits") == 1
+        assert store.incr(BOT, 1, "visits") == 2
+        assert store.load(BOT, 1, "visits") == 2
+
+
+def test_dedupe_keeps_latest_and_removes_its_blobs(mongo_db):
+    fs = gridfs.GridFS(mongo_db, collection="bot_state_blobs")
+    old_blob = fs.put(b"old")
+    base = {"bot_id": BOT, "user_id": "1", "key": "k"}
+    mongo_db.bot_states.insert_many([
+        dict(base, value=None, blob_id=old_blob, updated_at=datetime.datetime(2024, 1, 1)),
+        dict(base, value="new", updated_at=datetime.datetime(2024, 1, 2)),
+    ])
+
+    result = dedupe_bot_states(mongo_db, apply=True)
+    assert result["removed"] == 1 and result["blobs"] == 1
+    assert mongo_db.bot_states.find_one(base)["value"] == "new"
+    assert _blob_count(mongo_db) == 0
+    assert ensure_state_indexes(mongo_db)
+
+
+def test_index_is_not_created_while_duplicates_exist(mongo_db):
+    base = {"bot_id": BOT, "user_id": "1", "key": "k"}
+    mongo_db.bot_states.insert_many([dict(base, value=1), dict(base, value=2)])
+    with pytest.raises(DuplicateStateKeysError):
+        ensure_state_indexes(mongo_db)
+    assert dedupe_bot_states(mongo_db, apply=False)["removed"] == 1
+    assert mongo_db.bot_states.count_documents(base) == 2
+
+
+def test_large_value_is_offloaded_to_gridfs(mongo_db):
+    store = _store(mongo_db, offload_bytes=1024)
+    big = "x" * 4096
+    assert store.save(BOT, 1, "big", big)
+    doc = mongo_db.bot_states.find_one({"key": "big"})
+    assert doc["value"] is None and doc["blob_id"] is not None
+    assert _blob_count(mongo_db) == 1
+    assert store.load(BOT, 1, "big") == big
+
+
+def test_overwrite_deletes_previous_blob_from_any_store(mongo_db, indexed):
+    writer = _store(mongo_db, indexed, offload_bytes=1024)
+    other = _store(mongo_db, indexed, offload_bytes=1024)
+    writer.save(BOT, 1, "big", "x" * 4096)
+
+    # store אחר (בלי המפתח במטמון) דורס את הערך
+    assert other.save(BOT, 1, "big", [])
+    assert _blob_count(mongo_db) == 0
+    assert mongo_db.bot_states.find_one({"key": "big"}).get("blob_id") is None
+
+    other.save(BOT, 1, "big", "y" * 4096)
+    with writer.batch():
+        writer.save(BOT, 1, "big", "z" * 4096)
+    assert _blob_count(mongo_db) == 1
+    assert mongo_db.bot_states.count_documents({"key": "big"}) == 1
+    assert other.load(BOT, 1, "big") == "z" * 4096
+
+
+def test_atomic_ops_on_offloaded_value_do_not_duplicate_the_key(mongo_db, indexed):
+    store = _store(mongo_db, indexed, offload_bytes=1024)
+    store.save(BOT, 1, "log", ["x" * 2048])
+    assert store.push(BOT, 1, "log", "y")
+    assert store.load(BOT, 1, "log") == ["x" * 2048, "y"]
+    assert mongo_db.bot_states.count_documents({"key": "log"}) == 1
+    assert _blob_count(mongo_db) == 1
+
+
+def test_atomic_update_drops_stale_size(mongo_db, indexed):
+    store = _store(mongo_db, indexed)
+    store.save(BOT, 1, "tags", ["a"])
+    assert "size" in mongo_db.bot_states.find_one({"key": "tags"})
+    store.push(BOT, 1, "tags", "b")
+    assert "size" not in mongo_db.bot_states.find_one({"key": "tags"})
+
+
+def test_list_growing_past_threshold_is_offloaded(mongo_db, indexed):
+    store = _store(mongo_db, indexed, offload_bytes=1024)
+    for _ in range(3):
+        assert store.push(BOT, 1, "log", "x" * 400)
+    doc = mongo_db.bot_states.find_one({"key": "log"})
+    assert doc["value"] is None and doc["blob_id"] is not None
+    assert _blob_count(mongo_db) == 1
+
+    # מכאן push עובר בקריאה-שינוי-כתיבה, והערך נשאר ב-GridFS
+    assert store.push(BOT, 1, "log", "y")
+    assert store.load(BOT, 1, "log") == ["x" * 400] * 3 + ["y"]
+    assert mongo_db.bot_states.count_documents({"key": "log"}) == 1
+    assert _blob_count(mongo_db) == 1
+
+
+def test_gc_keeps_recent_and_referenced_blobs(mongo_db):
+    store = _store(mongo_db, offload_bytes=1024)
+    store.save(BOT, 1, "big", "x" * 4096)
+    fs = gridfs.GridFS(mongo_db, collection="bot_state_blobs")
+    old_orphan = fs.put(b"orphan")
+    old = datetime.datetime.utcnow() - datetime.timedelta(hours=2)
+    mongo_db.bot_state_blobs.files.update_many({}, {"$set": {"uploadDate": old}})
+    # נכתב ל-GridFS, המסמך שמפנה אליו עוד לא נכתב
+    fs.put(b"just written")
+
+    assert gc_state_blobs(mongo_db, apply=False)["orphans"] == 1
+    assert gc_state_blobs(mongo_db, apply=True, grace_seconds=3600)["orphans"] == 1
+    assert not fs.exists(old_orphan)
+    assert _blob_count(mongo_db) == 2
+    assert store.load(BOT, 1, "big") == "x" * 4096
@@ -0,0 +1,58 @@
+import pytest
+import requests
+
+from engine.telegram_api import TelegramClient
+
+
+class _Session:
+    """מחליף את ה-requests.Session ורושם את הבקשות."""
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def post(self, url, json=None, timeout=None):
+        self.requests.append((url, json, timeout))
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+def _response(ok):
+    response = requests.Response()
+    response.status_code = 200 if ok else 400
+    return response
+
+
+def test_calls_share_one_session_with_default_timeout():
+    client = TelegramClient(connect_timeout=2, read_timeout=7, base_url="https://api.test/")
+    session = client._session = _Session([_response(True), _response(True)])
+    client.post("1:A", "sendMessage", {"chat_id": 1})
+    client.post("2:B", "getMe", timeout=30)
+    assert session.requests == [
+        ("https://api.test/bot1:A/sendMessage", {"chat_id": 1}, (2, 7)),
+        ("https://api.test/bot2:B/getMe", {}, 30),
+    ]
+
+
+def test_pool_size_and_connect_only_retries():
+    client = TelegramClient(pool_size=12, connect_retries=3)
+    adapter = client._session.get_adapter("https://api.telegram.org")
+    assert adapter._pool_maxsize == 12
+    assert adapter.max_retries.connect == 3
+    # בקשה שכבר נשלחה לא נשלחת שוב (POST לא אידמפוטנטי)
+    assert adapter.max_retries.read == 0
+
+
+def test_stats_count_calls_and_errors():
+    client = TelegramClient()
+    client._session = _Session([_response(True), _response(False),
+                                requests.ConnectionError("down")])
+    client.post("1:A", "sendMessage")
+    client.post("1:A", "sendMessage")
+    with pytest.raises(requests.ConnectionError):
+        client.post("1:A", "sendMessage")
+    stats = client.stats()["sendMessage"]
+    assert stats["calls"] == 3
+    assert stats["errors"] == 2
@@ -0,0 +1,99 @@
+import sys
+import time
+import types
+
+from engine.tenants import TenantPluginCache
+
+
+class _Entry:
+    def __init__(self, name):
+        self.name = name
+        self.module = types.ModuleType(f"plugins.{name}")
+        sys.modules[self.module.__name__] = self.module
+
+
+def _cache(**kwargs):
+    loads = []
+
+    def load(name):
+        loads.append(name)
+        return _Entry(name)
+
+    cache = TenantPluginCache(load, **kwargs)
+    cache.loads = loads
+    return cache
+
+
+def test_hit_does_not_reload():
+    cache = _cache()
+    entry = cache.get("bot_1")
+    assert cache.get("bot_1") is entry
+    assert cache.loads == ["bot_1"]
+
+
+def test_least_recently_used_is_evicted_and_unloaded():
+    cache = _cache(max_size=2, idle_seconds=0)
+    first = cache.get("bot_1")
+    cache.get("bot_2")
+    cache.get("bot_1")
+    cache.get("bot_3")
+    assert list(cache._entries) == ["bot_1", "bot_3"]
+    assert "plugins.bot_2" not in sys.modules
+    assert sys.modules["plugins.bot_1"] is first.module
+    assert cache.stats()["evictions"] == 1
+
+
+def test_idle_modules_are_swept():
+    cache = _cache(idle_seconds=10, sweep_interval=0)
+    cache.get("bot_1")
+    cache.get("bot_2")
+    cache._entries["bot_1"][1] = time.monotonic() - 11
+    cache.get("bot_2")
+    assert list(cache._entries) == ["bot_2"]
+    assert "plugins.bot_1" not in sys.modules
+    assert cache.stats()["idle_evictions"] == 1
+
+
+def test_module_in_use_is_not_evicted():
+    cache = _cache(max_size=1, idle_seconds=0)
+    with cache.use("bot_1") as entry:
+        cache.get("bot_2")
+        assert "bot_1" in cache._entries
+        assert sys.modules["plugins.bot_1"] is entry.module
+        assert cache.stats()["skipped_in_use"] == 1
+
+
+def test_pop_while_in_use_defers_unload():
+    cache = _cache()
+    with cache.use("bot_1") as entry:
+        cache.pop("bot_1")
+        assert "bot_1" not in cache._entries
+        assert sys.modules["plugins.bot_1"] is entry.module
+    assert "plugins.bot_1" not in sys.modules
+
+
+def test_nested_use_unloads_after_last_release():
+    cache = _cache()
+    with cache.use("bot_1"):
+        with cache.use("bot_1"):
+            cache.pop("bot_1")
+        assert "plugins.bot_1" in sys.modules
+    assert "plugins.bot_1" not in sys.modules
+
+
+def test_unload_closes_module_mongo_client():
+    closed = []
+    cache = _cache()
+    entry = cache.get("bot_1")
+    entry.module._state_mongo_client = types.SimpleNamespace(close=lambda: closed.append(1))
+    cache.pop("bot_1")
+    assert closed == [1]
+    assert entry.module._state_mongo_client is None
+
+
+def test_failed_load_is_not_cached():
+    cache = TenantPluginCache(lambda name: None)
+    assert cache.get("bot_1") is None
+    with cache.use("bot_1") as entry:
+        assert entry is None
+    assert len(cache) == 0
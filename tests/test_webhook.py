@@ -0,0 +1,92 @@
+import threading
+
+from engine.dispatch import UpdateQueue
+
+BOT = "123:ABC"
+
+
+def _message(update_id, chat_id=1, text="hi"):
+    return {
+        "update_id": update_id,
+        "message": {"chat": {"id": chat_id}, "from": {"id": chat_id}, "text": text},
+    }
+
+
+def _async_mode(engine_app, monkeypatch, handler, maxsize=100):
+    queue = UpdateQueue(handler, workers=2, maxsize=maxsize)
+    monkeypatch.setattr(engine_app.Config, "WEBHOOK_ASYNC_MODE", True)
+    monkeypatch.setattr(engine_app, "update_queue", queue)
+    return queue
+
+
+def test_async_mode_acks_before_processing(engine_app, monkeypatch):
+    release = threading.Event()
+    processed = []
+
+    def handler(bot_token, update):
+        release.wait(2)
+        processed.append(update["update_id"])
+
+    queue = _async_mode(engine_app, monkeypatch, handler)
+    response = engine_app.app.test_client().post(f"/{BOT}", json=_message(1))
+    assert response.status_code == 200
+    assert response.get_json() == {"ok": True}
+    assert processed == []
+
+    release.set()
+    assert queue.drain(5)
+    assert processed == [1]
+
+
+def test_async_mode_full_queue_asks_for_redelivery(engine_app, monkeypatch):
+    release = threading.Event()
+    queue = _async_mode(engine_app, monkeypatch, lambda bot_token, update: release.wait(2),
+                        maxsize=1)
+    client = engine_app.app.test_client()
+    statuses = [client.post(f"/{BOT}", json=_message(n)).status_code for n in range(4)]
+    release.set()
+    assert queue.drain(5)
+    assert statuses[0] == 200
+    assert 503 in statuses
+
+
+def test_unprocessable_update_is_acked_without_queueing(engine_app, monkeypatch):
+    queue = _async_mode(engine_app, monkeypatch, lambda bot_token, update: None)
+    response = engine_app.app.test_client().post(f"/{BOT}", json={"update_id": 1, "poll": {}})
+    assert response.get_json() == {"ok": True}
+    assert queue.stats()["enqueued"] == 0
+
+
+def test_failed_sync_processing_allows_redelivery(engine_app, monkeypatch):
+    from engine.dedup import MemorySeenSet, UpdateDeduplicator
+
+    monkeypatch.setattr(engine_app, "update_deduplicator", UpdateDeduplicator(MemorySeenSet()))
+    monkeypatch.setitem(engine_app.app.config, "PROPAGATE_EXCEPTIONS", False)
+    attempts = []
+
+    def flaky(bot_token, update):
+        attempts.append(update["update_id"])
+        if len(attempts) == 1:
+            raise RuntimeError("mongo down")
+
+    monkeypatch.setattr(engine_app, "process_update", flaky)
+    client = engine_app.app.test_client()
+    assert client.post(f"/{BOT}", json=_message(1)).status_code == 500
+    # ההעברה החוזרת של טלגרם מעובדת, ורק היא
+    assert client.post(f"/{BOT}", json=_message(1)).status_code == 200
+    assert client.post(f"/{BOT}", json=_message(1)).status_code == 200
+    assert attempts == [1, 1]
+
+
+def test_sync_duplicate_is_not_processed_twice(engine_app, monkeypatch):
+    from engine.dedup import MemorySeenSet, UpdateDeduplicator
+
+    monkeypatch.setattr(engine_app, "update_deduplicator", UpdateDeduplicator(MemorySeenSet()))
+    processed = []
+    monkeypatch.setattr(engine_app, "process_update",
+                        lambda bot_token, update: processed.append(update["update_id"]))
+    client = engine_app.app.test_client()
+    client.post(f"/{BOT}", json=_message(1))
+    client.post(f"/{BOT}", json=_message(1))
+    client.post("/456:DEF", json=_message(1))
+    assert processed == [1, 1]
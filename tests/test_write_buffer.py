@@ -0,0 +1,54 @@
+import pytest
+
+from engine.write_buffer import OVERFLOW_DROP_NEWEST, OVERFLOW_DROP_OLDEST, BufferedWriter
+
+
+class _FailingCollection:
+    """insert_many שנכשל, ובזמן הכתיבה מגיעים מסמכים חדשים לבאפר."""
+
+    def __init__(self, arriving):
+        self.writer = None
+        self.arriving = arriving
+
+    def insert_many(self, docs, ordered=True):
+        for doc in self.arriving:
+            self.writer.append(doc)
+        self.arriving = []
+        raise ConnectionError("mongo down")
+
+
+def _writer(collection, overflow):
+    writer = BufferedWriter(lambda: {"events": collection}, "events", batch_size=10,
+                            flush_interval=60, max_buffer=3, overflow=overflow)
+    collection.writer = writer
+    return writer
+
+
+def _buffered(writer):
+    return [doc["n"] for doc in writer._buffer]
+
+
+@pytest.mark.parametrize("overflow, expected", [
+    # ה-batch שנכשל ישן יותר ממה שהגיע בזמן הכתיבה - נשמר החדש שבו
+    (OVERFLOW_DROP_OLDEST, [3, 4, 5]),
+    (OVERFLOW_DROP_NEWEST, [1, 4, 5]),
+])
+def test_failed_batch_requeue_follows_overflow_policy(overflow, expected):
+    collection = _FailingCollection([{"n": 4}, {"n": 5}])
+    writer = _writer(collection, overflow)
+    for n in (1, 2, 3):
+        writer.append({"n": n})
+
+    assert writer.flush() == 0
+    assert _buffered(writer) == expected
+    assert writer.stats()["dropped"] == 2
+
+
+def test_full_buffer_drops_by_policy():
+    oldest = _writer(_FailingCollection([]), OVERFLOW_DROP_OLDEST)
+    newest = _writer(_FailingCollection([]), OVERFLOW_DROP_NEWEST)
+    for n in range(5):
+        oldest.append({"n": n})
+        newest.append({"n": n})
+    assert _buffered(oldest) == [2, 3, 4]
+    assert _buffered(newest) == [0, 1, 2]